@@ -0,0 +1,166 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qsl, urlencode, urlparse, urlunparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import metrics
+
+# Defaults for article fetching (override with environment variables)
+DEFAULT_MAX_ARTICLES = int(os.environ.get("TIM_ARTICLE_CACHE_ENTRIES", "128"))
+DEFAULT_FRESH_SECONDS = int(os.environ.get("TIM_ARTICLE_FRESH_SECONDS", "900"))
+DEFAULT_MAX_WORKERS = int(os.environ.get("TIM_FETCH_WORKERS", "8"))
+REQUEST_TIMEOUT = 15
+USER_AGENT = "Mozilla/5.0 (compatible; TIM-IQ-Playground/1.0)"
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ref", "cmpid"}
+FALLBACK_ENCODING = "ISO-8859-1"  # what requests assumes for text/* responses without a charset
+
+# Function to check if input is a URL
+def is_url(text):
+    try:
+        result = urlparse(text)
+        return all([result.scheme, result.netloc])
+    except ValueError:
+        return False
+
+# Function to normalize a URL so equivalent links share one cache entry
+def normalize_url(url):
+    parts = urlparse(url.strip())
+    scheme = parts.scheme.lower()
+    netloc = parts.netloc.lower()
+    if (scheme == "http" and netloc.endswith(":80")) or (scheme == "https" and netloc.endswith(":443")):
+        netloc = netloc.rsplit(":", 1)[0]
+    path = parts.path or "/"
+    if len(path) > 1 and path.endswith("/"):
+        path = path.rstrip("/")
+    query = sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    )
+    return urlunparse((scheme, netloc, path, "", urlencode(query), ""))
+
+# Function to build an HTTP session with a shared connection pool
+def make_http_session(pool_size=DEFAULT_MAX_WORKERS):
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=1)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = USER_AGENT
+    return session
+
+# Function to get the HTML of a response, decoded the way newspaper does it: when the server names
+# no charset, the page's own <meta charset> wins over requests' ISO-8859-1 fallback
+def response_html(response):
+    if (response.encoding or "").upper() != FALLBACK_ENCODING:
+        return response.text
+    if "charset" not in response.headers.get("Content-Type", "").lower():
+        encodings = requests.utils.get_encodings_from_content(response.text)
+        if encodings:
+            response.encoding = encodings[0]
+            return response.text
+    return response.content
+
+# Function to extract the article text from downloaded HTML
+def parse_article_html(url, html):
+    # newspaper pulls in lxml, nltk and friends, so it is only imported once a URL is actually fetched
+    from newspaper import Article
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return article.text
+
+# Bounded cache of extracted article text with ETag/Last-Modified revalidation
+class ArticleFetcher:
+    def __init__(self, max_articles=DEFAULT_MAX_ARTICLES, fresh_seconds=DEFAULT_FRESH_SECONDS,
+                 max_workers=DEFAULT_MAX_WORKERS, session=None):
+        self.max_articles = max_articles
+        self.fresh_seconds = fresh_seconds
+        self.max_workers = max_workers
+        self.session = session or make_http_session(max_workers)
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def _store(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_articles:
+                self._entries.popitem(last=False)
+
+    def fetch(self, url):
+        key = normalize_url(url)
+        entry = self._lookup(key)
+        if entry is not None and time.time() - entry["checked_at"] < self.fresh_seconds:
+            with self._lock:
+                self.hits += 1
+            return entry["text"]
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+
+        with metrics.timer("fetch"):
+            response = self.session.get(url, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code == 304 and entry is not None:
+            with self._lock:
+                self.revalidated += 1
+            self._store(key, dict(entry, checked_at=time.time()))
+            return entry["text"]
+        response.raise_for_status()
+
+        with self._lock:
+            self.misses += 1
+        with metrics.timer("parse"):
+            text = parse_article_html(url, response_html(response))
+        self._store(key, {
+            "text": text,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "checked_at": time.time(),
+        })
+        return text
+
+    # Fetch several URLs concurrently; returns (text, error) pairs in input order
+    def fetch_many(self, urls):
+        unique_urls = list(OrderedDict((normalize_url(url), url) for url in urls).values())
+
+        def fetch_one(url):
+            try:
+                return self.fetch(url), None
+            except Exception as e:
+                return None, e
+
+        workers = max(1, min(self.max_workers, len(unique_urls)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = dict(zip(
+                (normalize_url(url) for url in unique_urls),
+                executor.map(fetch_one, unique_urls),
+            ))
+        return [results[normalize_url(url)] for url in urls]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.revalidated = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "revalidated": self.revalidated, "misses": self.misses,
+                    "entries": len(self._entries)}
@@ -0,0 +1,165 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+from article_fetcher import ArticleFetcher, is_url
+from dedup_index import NEAR_DUPLICATES, DuplicateIndex
+from llm_cache import ResponseCache
+from metrics import METRICS_FILE, metrics
+from model_router import BATCH_RUN, bind_session, current_session, router
+from result_store import RESULT_HISTORY, ResultStore
+from scheduler import BATCH, current_priority
+from shared_state import SHARED, shared_state
+from tim_tools import TOOL_PROMPTS, run_tool
+
+# Headless batch runner: python batch_cli.py corpus.jsonl results.jsonl --tool "Article Neutralizer"
+#
+# Input is JSONL (one object per line) or CSV with a "url", "text" or "input" column and an
+# optional "id" column; JSONL records may also carry a "params" object for the tools.
+# Results are appended to the output JSONL as they complete, one line per (record, tool).
+# Re-running the same command resumes: pairs already written without an error are skipped.
+
+DEFAULT_WORKERS = 4
+
+# Function to read input records lazily from a JSONL or CSV file
+def read_records(path):
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.lower().endswith(".csv"):
+            for index, row in enumerate(csv.DictReader(f)):
+                yield index, row
+        else:
+            index = 0
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                yield index, json.loads(line)
+                index += 1
+
+# Function to get the stable id and the URL/text input of a record
+def record_input(index, record):
+    record_id = str(record.get("id") or index)
+    source = record.get("url") or record.get("text") or record.get("input") or ""
+    return record_id, source.strip()
+
+# Function to load the (record id, tool) pairs already written to the output file
+def load_checkpoint(path):
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a partially written last line from an interrupted run
+            if not result.get("error"):
+                done.add((result["id"], result["tool"]))
+    return done
+
+# Function to process one record with every requested tool
+def process_record(record_id, source, record_params, tools, base_params, fetcher, cache, use_cache, done, duplicates=None,
+                   store=None):
+    pending = [tool for tool in tools if (record_id, tool) not in done]
+    if not pending:
+        return []
+    base = {"id": record_id, "url": source if is_url(source) else None}
+    try:
+        original_text = fetcher.fetch(source) if is_url(source) else source
+    except Exception as e:
+        return [dict(base, tool=tool, error=f"Failed to fetch article from URL: {e}") for tool in pending]
+    if not original_text:
+        return [dict(base, tool=tool, error="No text to analyze.") for tool in pending]
+
+    if isinstance(record_params, str):
+        record_params = json.loads(record_params) if record_params.strip() else {}
+    params = dict(base_params, **(record_params or {}))
+    results = []
+    for tool in pending:
+        result = run_tool(tool, original_text, params, use_cache=use_cache, cache=cache, duplicates=duplicates,
+                          store=store, source_url=base["url"])
+        results.append(dict(base, **result))
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run TIM IQ tools over a corpus of URLs or texts.")
+    parser.add_argument("input", help="JSONL or CSV file of records")
+    parser.add_argument("output", help="JSONL file to append results to (also used as the resume checkpoint)")
+    parser.add_argument("--tool", action="append", choices=list(TOOL_PROMPTS), required=True,
+                        help="tool to run (repeat for several tools)")
+    parser.add_argument("--params", default="{}", help="JSON object of tool parameters, e.g. '{\"culture\": \"Eastern\"}'")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS, help="number of records processed concurrently")
+    parser.add_argument("--no-cache", action="store_true", help="bypass the response cache")
+    parser.add_argument("--restart", action="store_true", help="truncate the output instead of resuming")
+    parser.add_argument("--metrics", default=METRICS_FILE,
+                        help="write stage latencies and token usage here when done (.jsonl appends a snapshot, "
+                             "anything else is Prometheus text)")
+    parser.add_argument("--token-budget", type=int, default=router.batch_budget,
+                        help="tokens this run may use per budget window, 0 for no limit (defaults to $TIM_BATCH_TOKEN_BUDGET); "
+                             "batch runs do not count towards the app's shared budget")
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"), help="OpenAI API key (defaults to $OPENAI_API_KEY)")
+    args = parser.parse_args(argv)
+
+    if not args.api_key:
+        parser.error("an OpenAI API key is required (--api-key or $OPENAI_API_KEY)")
+    openai.api_key = args.api_key
+    base_params = json.loads(args.params)
+    # Batch runs yield to interactive requests in the scheduler, and are charged to their own token budget
+    current_priority.set(BATCH)
+    current_session.set(BATCH_RUN)
+    router.batch_budget = args.token_budget
+
+    if args.restart and os.path.exists(args.output):
+        os.remove(args.output)
+    done = load_checkpoint(args.output)
+
+    fetcher = ArticleFetcher(max_workers=args.workers)
+    cache = ResponseCache(shared=shared_state if SHARED else None)
+    # Syndicated copies of an article reuse the first copy's result instead of costing another call
+    duplicates = DuplicateIndex() if NEAR_DUPLICATES else None
+    store = ResultStore() if RESULT_HISTORY else None
+    write_lock = threading.Lock()
+    counts = {"ok": 0, "failed": 0}
+
+    with open(args.output, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=args.workers) as executor:
+        def write_results(future):
+            for result in future.result():
+                with write_lock:
+                    out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                    out.flush()
+                    counts["failed" if result.get("error") else "ok"] += 1
+
+        # Keep at most two records per worker in flight so huge corpora are streamed, not loaded
+        in_flight = set()
+        for index, record in read_records(args.input):
+            record_id, source = record_input(index, record)
+            if not source:
+                continue
+            if len(in_flight) >= args.workers * 2:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    write_results(future)
+            in_flight.add(executor.submit(
+                bind_session(process_record), record_id, source, record.get("params"), args.tool, base_params,
+                fetcher, cache, not args.no_cache, done, duplicates, store,
+            ))
+        for future in wait(in_flight).done:
+            write_results(future)
+
+    if args.metrics:
+        metrics.write(args.metrics)
+    print(f"Wrote {counts['ok']} results ({counts['failed']} failed) to {args.output}", file=sys.stderr)
+    for row in router.report():
+        print(f"{row['tool']} ({row['model']}): {row['requests']} requests, input {row['actual_in']:,} tokens "
+              f"(estimated {row['estimated_in']:,}), output {row['actual_out']:,} of {row['max_tokens']:,} budgeted",
+              file=sys.stderr)
+    return 1 if counts["failed"] else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,214 @@
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+import openai
+
+import llm_client
+from article_fetcher import ArticleFetcher
+from metrics import metrics
+from mock_servers import (
+    DEFAULT_COMPLETION_TOKENS, DEFAULT_ERROR_RATE, DEFAULT_LATENCY, DEFAULT_TOKEN_RATE,
+    ArticleFixtureServer, MockOpenAIServer, fixture_articles,
+)
+from scheduler import BATCH, INTERACTIVE, priority_context
+from tim_tools import TOOL_PROMPTS, run_tool
+
+# Offline benchmark: python benchmark.py --concurrency 1,4,16 --requests 40 --label my-change
+#
+# Starts a mock OpenAI server and a fixture article server on localhost, then fetches articles
+# and runs the tools headlessly at each concurrency level. Throughput, latency percentiles,
+# memory and per-stage timings are printed and appended to the results file, and each run is
+# compared with the previous one (or with --baseline LABEL). With --processes N each level is
+# split over N worker processes, which share caches and rate limits through TIM_SHARED_STATE.
+# With --batch-share F that fraction of the requests runs at batch priority, and the latency of the
+# interactive ones shows how well the scheduler shields them.
+
+DEFAULT_RESULTS_PATH = "./.tim_cache/benchmarks.jsonl"
+DEFAULT_CONCURRENCY = "1,4,16"
+DEFAULT_REQUESTS = 40
+
+# Function to read the resident set size of this process in MB
+def rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Function to summarize a list of latencies in seconds
+def latency_summary(latencies):
+    if not latencies:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0}
+    p50, p95, p99 = np.percentile(latencies, (50, 95, 99))
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99), "mean": float(np.mean(latencies))}
+
+# Function to fetch an article and run one tool over it, returning (tool, seconds, error, priority)
+def run_request(fetcher, tool_name, url, priority=INTERACTIVE):
+    started = time.monotonic()
+    try:
+        text = fetcher.fetch(url)
+    except Exception as e:
+        return tool_name, time.monotonic() - started, f"fetch failed: {e}", priority
+    with priority_context(priority):
+        result = run_tool(tool_name, text, use_cache=False)
+    return tool_name, time.monotonic() - started, result["error"], priority
+
+# Function to run (tool, url) jobs on `concurrency` threads, returning their outcomes
+def run_jobs(concurrency, jobs):
+    fetcher = ArticleFetcher(max_workers=concurrency)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(executor.map(lambda job: run_request(fetcher, *job), jobs))
+
+# Function run in each worker process of a multi-process level
+def run_jobs_in_process(client, concurrency, jobs):
+    api_base, rpm, tpm = client
+    openai.api_base = api_base
+    openai.api_key = "sk-benchmark"
+    llm_client.rate_limiter = llm_client.make_rate_limiter(rpm, tpm)
+    return run_jobs(concurrency, jobs)
+
+# Function to run one concurrency level and summarize it
+# (tracemalloc slows allocation-heavy code, so Python heap tracing is opt-in; with several
+# processes, per-stage timings and retries stay in the workers and are not reported)
+def run_level(concurrency, tools, urls, requests, trace_memory=False, processes=1, client=None, batch_share=0.0):
+    metrics.reset()
+    retries = llm_client.retry_count
+    # Batch requests are spread evenly among the interactive ones
+    jobs = [(tools[index % len(tools)], urls[index % len(urls)],
+             BATCH if int((index + 1) * batch_share) > int(index * batch_share) else INTERACTIVE)
+            for index in range(requests)]
+    if trace_memory:
+        tracemalloc.start()
+    started = time.monotonic()
+    if processes > 1:
+        shares = [jobs[index::processes] for index in range(processes)]
+        with ProcessPoolExecutor(processes, mp_context=multiprocessing.get_context("spawn")) as pool:
+            outcomes = [outcome for share in pool.map(run_jobs_in_process, [client] * processes,
+                                                      [concurrency] * processes, shares)
+                        for outcome in share]
+    else:
+        outcomes = run_jobs(concurrency, jobs)
+    wall = time.monotonic() - started
+    peak = None
+    if trace_memory:
+        peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        tracemalloc.stop()
+
+    ok = [seconds for _, seconds, error, _ in outcomes if not error]
+    per_tool = {}
+    for tool_name in tools:
+        per_tool[tool_name] = latency_summary([seconds for tool, seconds, error, _ in outcomes if tool == tool_name and not error])
+    per_priority = {priority: latency_summary([seconds for _, seconds, error, job_priority in outcomes
+                                               if job_priority == priority and not error])
+                    for priority in (INTERACTIVE, BATCH)}
+    level = {
+        "concurrency": concurrency,
+        "processes": processes,
+        "requests": requests,
+        "errors": len(outcomes) - len(ok),
+        "wall_seconds": wall,
+        "throughput": len(ok) / wall if wall else 0.0,
+        "latency": latency_summary(ok),
+        "per_tool": per_tool,
+        "per_priority": per_priority,
+        "python_peak_mb": peak,
+        "rss_mb": rss_mb(),
+        "stages": metrics.snapshot()["latency"],
+        "retries": llm_client.retry_count - retries,
+    }
+    first_error = next((error for _, _, error, _ in outcomes if error), None)
+    if first_error:
+        level["first_error"] = first_error
+    return level
+
+# Function to load earlier benchmark runs
+def load_runs(path):
+    if not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+# Function to print one run, with deltas against a baseline run when given
+def print_run(run, baseline=None):
+    previous = {(level["concurrency"], level.get("processes", 1)): level for level in (baseline or {}).get("levels", [])}
+    print(f"{'procs':>5} {'conc':>5} {'req/s':>8} {'p50 s':>7} {'p95 s':>7} {'p99 s':>7} {'errors':>6} {'retries':>7} {'peak MB':>8} {'rss MB':>7}")
+    for level in run["levels"]:
+        latency = level["latency"]
+        peak = "-" if level["python_peak_mb"] is None else f"{level['python_peak_mb']:.1f}"
+        line = (f"{level.get('processes', 1):>5} {level['concurrency']:>5} {level['throughput']:>8.2f} {latency['p50']:>7.2f} {latency['p95']:>7.2f} "
+                f"{latency['p99']:>7.2f} {level['errors']:>6} {level['retries']:>7} {peak:>8} {level['rss_mb']:>7.1f}")
+        before = previous.get((level["concurrency"], level.get("processes", 1)))
+        if before and before["throughput"] and before["latency"]["p95"]:
+            line += (f"   vs {baseline['label']}: throughput {level['throughput'] / before['throughput'] - 1:+.0%}, "
+                     f"p95 {latency['p95'] / before['latency']['p95'] - 1:+.0%}")
+        print(line)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the TIM IQ tools against local mock servers.")
+    parser.add_argument("--concurrency", default=DEFAULT_CONCURRENCY, help="comma-separated worker counts, e.g. 1,4,16")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes per level (threads per process = concurrency)")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="requests per concurrency level")
+    parser.add_argument("--tool", action="append", choices=list(TOOL_PROMPTS), help="tool to run (default: all ten)")
+    parser.add_argument("--articles", type=int, default=20, help="number of fixture articles")
+    parser.add_argument("--latency", type=float, default=DEFAULT_LATENCY, help="mock seconds before the first token")
+    parser.add_argument("--token-rate", type=float, default=DEFAULT_TOKEN_RATE, help="mock tokens generated per second")
+    parser.add_argument("--completion-tokens", type=int, default=DEFAULT_COMPLETION_TOKENS, help="mock tokens per completion")
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_ERROR_RATE, help="fraction of mock requests failing with 429/500")
+    parser.add_argument("--rpm", type=int, default=llm_client.REQUESTS_PER_MINUTE, help="client request budget per minute")
+    parser.add_argument("--tpm", type=int, default=llm_client.TOKENS_PER_MINUTE, help="client token budget per minute")
+    parser.add_argument("--batch-share", type=float, default=0.0, help="fraction of requests run at batch priority")
+    parser.add_argument("--trace-memory", action="store_true", help="also record the peak Python heap with tracemalloc")
+    parser.add_argument("--label", default=time.strftime("%Y%m%d-%H%M%S"), help="name of this run in the results file")
+    parser.add_argument("--baseline", help="label of the run to compare with (default: the previous run)")
+    parser.add_argument("--results", default=DEFAULT_RESULTS_PATH, help="JSONL file the runs are appended to")
+    args = parser.parse_args(argv)
+
+    tools = args.tool or list(TOOL_PROMPTS)
+    levels = [int(value) for value in args.concurrency.split(",") if value.strip()]
+    config = {key: value for key, value in vars(args).items() if key not in ("label", "baseline", "results")}
+    config["tool"] = tools
+
+    llm_client.rate_limiter = llm_client.make_rate_limiter(args.rpm, args.tpm)
+    mock = MockOpenAIServer(latency=args.latency, token_rate=args.token_rate,
+                            completion_tokens=args.completion_tokens, error_rate=args.error_rate)
+    articles = ArticleFixtureServer(fixture_articles(args.articles))
+    with mock, articles:
+        openai.api_base = mock.api_base
+        openai.api_key = "sk-benchmark"
+        run = {"label": args.label, "started_at": time.time(), "config": config, "levels": []}
+        for concurrency in levels:
+            print(f"Running {args.requests} requests at concurrency {concurrency}...", file=sys.stderr)
+            run["levels"].append(run_level(concurrency, tools, articles.urls, args.requests, args.trace_memory,
+                                           args.processes, (mock.api_base, args.rpm, args.tpm), args.batch_share))
+        run["mock_requests"], run["mock_errors"] = mock.requests, mock.errors
+
+    runs = load_runs(args.results)
+    baseline = next((r for r in reversed(runs) if r["label"] == args.baseline), None) if args.baseline else (runs[-1] if runs else None)
+    print_run(run, baseline)
+    if args.batch_share:
+        for level in run["levels"]:
+            interactive, batch = level["per_priority"][INTERACTIVE], level["per_priority"][BATCH]
+            print(f"concurrency {level['concurrency']}: interactive p95 {interactive['p95']:.2f} s, "
+                  f"p99 {interactive['p99']:.2f} s; batch p95 {batch['p95']:.2f} s, p99 {batch['p99']:.2f} s")
+    for level in run["levels"]:
+        if level.get("first_error"):
+            print(f"concurrency {level['concurrency']}: {level['errors']} errors, first: {level['first_error']}", file=sys.stderr)
+
+    directory = os.path.dirname(args.results)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(args.results, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run) + "\n")
+    print(f"Saved run {args.label!r} to {args.results}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,83 @@
+import os
+import re
+import threading
+
+# Token budgets for splitting long articles (override with environment variables)
+CHUNK_THRESHOLD_TOKENS = int(os.environ.get("TIM_CHUNK_THRESHOLD_TOKENS", "1200"))
+CHUNK_TOKENS = int(os.environ.get("TIM_CHUNK_TOKENS", "900"))
+CHARS_PER_TOKEN = 4  # rough average for English text when tiktoken is not installed
+
+PARAGRAPH_BREAK = re.compile(r"\n\s*\n")
+SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+
+# tiktoken is optional; without it token counts are estimated from the character count.
+# The encoding is loaded on first use because building it is slow and may hit the network.
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+# Function to get the tiktoken encoding for the model, or None when tiktoken is unavailable
+def get_encoding():
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    try:
+                        _encoding = tiktoken.encoding_for_model("gpt-4o-mini")
+                    except KeyError:
+                        _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception:
+                    _encoding = None
+                _encoding_loaded = True
+    return _encoding
+
+# Function to count (or estimate) the tokens in a text
+def estimate_tokens(text):
+    encoding = get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+# Function to split text into paragraphs, falling back to single line breaks
+def split_paragraphs(text):
+    paragraphs = [p.strip() for p in PARAGRAPH_BREAK.split(text) if p.strip()]
+    if len(paragraphs) <= 1:
+        paragraphs = [p.strip() for p in text.splitlines() if p.strip()]
+    return paragraphs
+
+# Function to split a paragraph that is too long on its own at sentence boundaries
+def split_long_paragraph(paragraph, max_tokens):
+    pieces, current, current_tokens = [], [], 0
+    for sentence in SENTENCE_END.split(paragraph):
+        tokens = estimate_tokens(sentence)
+        if current and current_tokens + tokens > max_tokens:
+            pieces.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(sentence)
+        current_tokens += tokens
+    if current:
+        pieces.append(" ".join(current))
+    return pieces
+
+# Function to pack paragraphs into chunks of at most max_tokens tokens each
+def split_into_chunks(text, max_tokens=CHUNK_TOKENS):
+    chunks, current, current_tokens = [], [], 0
+    for paragraph in split_paragraphs(text):
+        tokens = estimate_tokens(paragraph)
+        pieces = [paragraph] if tokens <= max_tokens else split_long_paragraph(paragraph, max_tokens)
+        for piece in pieces:
+            piece_tokens = tokens if len(pieces) == 1 else estimate_tokens(piece)
+            if current and current_tokens + piece_tokens > max_tokens:
+                chunks.append("\n\n".join(current))
+                current, current_tokens = [], 0
+            current.append(piece)
+            current_tokens += piece_tokens
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+# Function to check whether a text is long enough to be processed in chunks
+def needs_chunking(text, threshold=CHUNK_THRESHOLD_TOKENS):
+    return estimate_tokens(text) > threshold
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from shared_state import connect_sqlite
+
+# Defaults for the near-duplicate index (override with environment variables; TIM_NEAR_DUPLICATES=0 disables)
+NEAR_DUPLICATES = os.environ.get("TIM_NEAR_DUPLICATES", "1") != "0"
+DEFAULT_DEDUP_PATH = os.environ.get("TIM_DEDUP_PATH", "./.tim_cache/near_duplicates.sqlite3")
+DEFAULT_THRESHOLD = float(os.environ.get("TIM_DEDUP_THRESHOLD", "0.95"))
+DEFAULT_MAX_ENTRIES = int(os.environ.get("TIM_DEDUP_MAX_ENTRIES", "20000"))
+
+FINGERPRINT_BITS = 64
+BANDS = 4  # four 16-bit bands: any two fingerprints within 3 bits share at least one band
+BAND_BITS = FINGERPRINT_BITS // BANDS
+SHINGLE_WORDS = 3
+WORD = re.compile(r"\w+")
+# Numbers and negations: two copies that differ in any of these say different things, however similar
+FACT_TOKEN = re.compile(r"\d+(?:[.,]\d+)*|\b(?:not|no|never|none|nobody|nothing|neither|nor|without|cannot)\b|n't\b",
+                        re.IGNORECASE)
+BIT_POSITIONS = np.arange(FINGERPRINT_BITS, dtype=np.uint64)
+
+# Function to compute the 64-bit SimHash of a text over overlapping word shingles
+def simhash(text):
+    words = WORD.findall(text.lower())
+    if len(words) <= SHINGLE_WORDS:
+        shingles = [" ".join(words)]
+    else:
+        shingles = [" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(shingle.encode("utf-8"), digest_size=8).digest(), "big") for shingle in shingles),
+        dtype=np.uint64, count=len(shingles),
+    )
+    bits = (hashes[:, None] >> BIT_POSITIONS) & np.uint64(1)
+    votes = bits.sum(axis=0, dtype=np.int64) * 2 - len(shingles)
+    return sum(1 << int(position) for position in np.flatnonzero(votes > 0))
+
+# Function to split a fingerprint into its LSH band values
+def bands(fingerprint):
+    mask = (1 << BAND_BITS) - 1
+    return [(fingerprint >> (band * BAND_BITS)) & mask for band in range(BANDS)]
+
+# Function to get a digest of the numbers and negations of a text, in order. Near-duplicates are
+# only reused when it matches, so "rose 3%" vs "rose 30%" or "did" vs "did not" are never merged.
+def fact_digest(text):
+    facts = [token.lower().replace(",", "") for token in FACT_TOKEN.findall(text.replace("\u2019", "'"))]
+    return hashlib.sha1(" ".join(facts).encode("utf-8")).hexdigest()
+
+# Function to get the similarity (1.0 = identical) of two fingerprints
+def similarity(a, b):
+    return 1 - bin(a ^ b).count("1") / FINGERPRINT_BITS
+
+# Function to build the scope key so results are only shared between identical tool settings
+def make_scope(*settings):
+    return hashlib.sha256(json.dumps(settings, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+# Persistent SimHash/LSH index of analysed articles and their results.
+# Only fingerprints, band values and results live in SQLite; nothing is held in memory.
+class DuplicateIndex:
+    def __init__(self, path=DEFAULT_DEDUP_PATH, threshold=DEFAULT_THRESHOLD, max_entries=DEFAULT_MAX_ENTRIES):
+        self.path = path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = connect_sqlite(path)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS near_duplicates ("
+            "id INTEGER PRIMARY KEY, scope TEXT NOT NULL, fingerprint INTEGER NOT NULL, "
+            "band0 INTEGER NOT NULL, band1 INTEGER NOT NULL, band2 INTEGER NOT NULL, band3 INTEGER NOT NULL, "
+            "result TEXT NOT NULL, created_at REAL NOT NULL, facts TEXT NOT NULL)"
+        )
+        for band in range(BANDS):
+            self._db.execute(f"CREATE INDEX IF NOT EXISTS near_duplicates_band{band} ON near_duplicates (scope, band{band})")
+        self._db.commit()
+
+    # SQLite integers are signed, so fingerprints are stored in two's complement
+    @staticmethod
+    def _to_signed(value):
+        return value - (1 << 64) if value >= 1 << 63 else value
+
+    @staticmethod
+    def _to_unsigned(value):
+        return value + (1 << 64) if value < 0 else value
+
+    # Return (result, similarity) for the closest stored article above the threshold with the same
+    # numbers and negations, or None
+    def find(self, scope, text):
+        fingerprint = simhash(text)
+        band_values = bands(fingerprint)
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT fingerprint, result FROM near_duplicates WHERE scope = ? AND facts = ? AND ("
+                + " OR ".join(f"band{band} = ?" for band in range(BANDS)) + ")",
+                [scope, fact_digest(text)] + band_values,
+            ).fetchall()
+            best = None
+            for stored, result in rows:
+                score = similarity(fingerprint, self._to_unsigned(stored))
+                if score >= self.threshold and (best is None or score > best[1]):
+                    best = (json.loads(result), score)
+            if best is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return best
+
+    def add(self, scope, text, result):
+        fingerprint = simhash(text)
+        with self._lock:
+            self._db.execute(
+                "INSERT INTO near_duplicates (scope, fingerprint, band0, band1, band2, band3, result, created_at, facts) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [scope, self._to_signed(fingerprint)] + bands(fingerprint)
+                + [json.dumps(result, ensure_ascii=False), time.time(), fact_digest(text)],
+            )
+            self._db.execute(
+                "DELETE FROM near_duplicates WHERE id IN ("
+                "SELECT id FROM near_duplicates ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._db.commit()
+
+    def clear(self):
+        with self._lock:
+            self._db.execute("DELETE FROM near_duplicates")
+            self._db.commit()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            entries = self._db.execute("SELECT COUNT(*) FROM near_duplicates").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries}
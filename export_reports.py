@@ -0,0 +1,34 @@
+import argparse
+import sys
+
+from reports import write_zip_export
+from result_store import DEFAULT_RESULTS_PATH, ResultStore
+from tim_tools import TOOL_PROMPTS, tool_labels
+
+# Bulk report export: python export_reports.py reports.zip --query "city council" --tool "Article Neutralizer"
+#
+# Streams the matching results from the history into a ZIP of HTML reports (sharing one
+# report.css) plus results.jsonl and results.csv, one result at a time.
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export stored TIM IQ results as a ZIP of HTML reports.")
+    parser.add_argument("output", help="ZIP file to write")
+    parser.add_argument("--query", help="full-text search over the stored texts and analyses")
+    parser.add_argument("--tool", choices=list(TOOL_PROMPTS), help="only export results of this tool")
+    parser.add_argument("--limit", type=int, help="export at most this many results (newest first)")
+    parser.add_argument("--no-jsonl", action="store_true", help="leave out results.jsonl")
+    parser.add_argument("--no-csv", action="store_true", help="leave out results.csv")
+    parser.add_argument("--store", default=DEFAULT_RESULTS_PATH, help="result history database")
+    args = parser.parse_args(argv)
+
+    store = ResultStore(args.store)
+    total = store.count(args.query, args.tool)
+    if args.limit is not None:
+        total = min(total, args.limit)
+    written = write_zip_export(args.output, store.iter_results(args.query, args.tool, args.limit), labels=tool_labels(),
+                               include_jsonl=not args.no_jsonl, include_csv=not args.no_csv)
+    print(f"Exported {total} reports ({written / 2 ** 20:.1f} MB) to {args.output}", file=sys.stderr)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
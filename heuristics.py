@@ -0,0 +1,180 @@
+import re
+from collections import Counter
+
+import numpy as np
+
+# Local sentence-level pre-pass for the Fact vs. Opinion and Rhetorical Device tools.
+# Local labels are final, so only high-precision cases are labelled here; every other
+# sentence is sent to the model.
+
+# A sentence is labelled locally only when its cues clear a threshold and none point the other way
+OPINION_THRESHOLD = 3.0
+FACT_THRESHOLD = -2.0
+MODEL_REVIEW_MARKER = "*[Model review]*"
+
+# A period after an initial ("J. Smith", "U.S.", "e.g.") or a common title or abbreviation does not end a sentence.
+# Lookbehinds must be fixed-width, so there is one per abbreviation length.
+SENTENCE_SPLIT = re.compile(
+    r"(?<=[.!?])(?<!\b[A-Za-z]\.)(?<!\b(?:Mr|Ms|Dr|St|Jr|Sr|Mt|vs)\.)(?<!\b(?:Mrs|Gen|Sen|Rep|Gov|Col|Sgt|Fig)\.)"
+    r"(?<!\b(?:Prof|Capt|Corp|Dept)\.)\s+|(?<=[.!?][\"'”’)\]])\s+|\n+"
+)
+
+# (name, pattern, weight) lexicon table; positive weights point to opinion, negative to fact
+FACT_OPINION_FEATURES = [
+    ("first-person belief", r"\b(?:i|we)\s+(?:believe|think|feel|suspect|doubt|hope|guess)\b|\bin (?:my|our) (?:view|opinion)\b|\bpersonally\b", 2.0),
+    ("certainty adverb", r"\b(?:clearly|obviously|undoubtedly|surely|certainly|of course|arguably|frankly)\b", 1.5),
+    ("evaluative word", r"\b(?:terrible|awful|amazing|wonderful|disgraceful|outrageous|brilliant|shameful|ridiculous|absurd|horrible|fantastic|disastrous|incredible|pathetic)\b", 1.5),
+    ("superlative", r"\b(?:best|worst|greatest|finest|biggest|smartest|dumbest|most important|least important)\b", 0.75),
+    ("prescriptive modal", r"\b(?:should|ought to|must|need to)\b", 1.0),
+    ("number or statistic", r"\b\d[\d,.]*(?:\s*(?:%|percent|million|billion|thousand))?", -1.0),
+    ("date", r"\b(?:january|february|march|april|may|june|july|august|september|october|november|december|monday|tuesday|wednesday|thursday|friday|saturday|sunday|(?:19|20)\d\d)\b", -0.75),
+    ("attribution", r"\b(?:according to|said|says|stated|reported|announced|told|confirmed)\b", -1.25),
+]
+
+# (device, pattern, explanation) table for rhetorical devices that a regex can spot reliably.
+# "like a" and words such as "never" are too often literal, so they are left to the model;
+# "as <adjective> as a" comparisons of quantities ("as much as a") are not similes.
+RHETORICAL_DEVICES = [
+    ("Simile", r"\bas (?!(?:much|many|little|few|long|soon|far|well|early|late|high|low|often|recently)\b)[a-z]+ as (?:a|an)\b",
+     "compares two unlike things with \"like\" or \"as\" to make an idea vivid."),
+]
+DEVICE_EXPLANATIONS = dict((name, explanation) for name, _, explanation in RHETORICAL_DEVICES)
+DEVICE_EXPLANATIONS["Rhetorical question"] = "asks a question that is not meant to be answered, inviting the reader to supply the writer's conclusion."
+DEVICE_EXPLANATIONS["Repetition"] = "repeats an opening or a key phrase to build rhythm and make the point stick."
+# Questions that open like these expect no answer ("Isn't it obvious?", "Who could blame them?")
+RHETORICAL_QUESTION = re.compile(
+    r"^(?:isn't|aren't|wasn't|weren't|don't|doesn't|didn't|can't|won't|shouldn't|wouldn't|"
+    r"who (?:would|could|can|cares)|how (?:could|can|dare)|why (?:would|should) (?:anyone|we|you)|"
+    r"what (?:kind|sort) of|is it any wonder)\b", re.IGNORECASE)
+QUOTES = "\"“”"
+ANAPHORA_RUN = 3  # consecutive sentences with the same opening that make a repetition
+
+COMPILED_FEATURES = [(name, re.compile(pattern, re.IGNORECASE), weight) for name, pattern, weight in FACT_OPINION_FEATURES]
+COMPILED_DEVICES = [(name, re.compile(pattern, re.IGNORECASE)) for name, pattern, _ in RHETORICAL_DEVICES]
+FEATURE_WEIGHTS = np.array([weight for _, _, weight in FACT_OPINION_FEATURES])
+
+# Function to split text into sentences, returning them with their start offsets
+def split_sentences(text):
+    sentences, starts, position = [], [], 0
+    for match in SENTENCE_SPLIT.finditer(text + "\n"):
+        sentence = text[position:match.start()].strip()
+        if sentence:
+            sentences.append(sentence)
+            starts.append(position)
+        position = match.end()
+    return sentences, np.array(starts, dtype=np.int64)
+
+# Function to count each pattern's matches per sentence in one pass over the whole text
+def count_matches(text, starts, patterns):
+    counts = np.zeros((len(starts), len(patterns)), dtype=np.int64)
+    if not len(starts):
+        return counts
+    for column, pattern in enumerate(patterns):
+        positions = np.fromiter((m.start() for m in pattern.finditer(text)), dtype=np.int64)
+        if positions.size:
+            rows = np.searchsorted(starts, positions, side="right") - 1
+            counts[:, column] = np.bincount(rows[rows >= 0], minlength=len(starts))
+    return counts
+
+# Function to score every sentence at once (positive leans opinion, negative leans fact)
+def fact_opinion_scores(text, sentences=None, starts=None):
+    if sentences is None:
+        sentences, starts = split_sentences(text)
+    counts = count_matches(text, starts, [pattern for _, pattern, _ in COMPILED_FEATURES])
+    # Cap each cue at two hits so one long list of numbers does not dominate
+    return np.minimum(counts, 2) @ FEATURE_WEIGHTS, counts
+
+# Function to join sentences back into a passage for the model
+def join_sentences(sentences):
+    return "\n".join(sentences)
+
+# Function to classify the clear Fact vs. Opinion cases locally
+def classify_fact_opinion(text):
+    sentences, starts = split_sentences(text)
+    scores, counts = fact_opinion_scores(text, sentences, starts)
+    opinion_cues = counts[:, FEATURE_WEIGHTS > 0].any(axis=1)
+    fact_cues = counts[:, FEATURE_WEIGHTS < 0].any(axis=1)
+    labels = np.where((scores >= OPINION_THRESHOLD) & ~fact_cues, "Opinion",
+                      np.where((scores <= FACT_THRESHOLD) & ~opinion_cues, "Fact", ""))
+
+    annotated, explanations, ambiguous = [], [], []
+    for index, sentence in enumerate(sentences):
+        label = labels[index]
+        if not label:
+            ambiguous.append(sentence)
+            annotated.append(f"{MODEL_REVIEW_MARKER} {sentence}")
+            continue
+        cues = [COMPILED_FEATURES[column][0] for column in np.flatnonzero(counts[index])
+                if (FEATURE_WEIGHTS[column] > 0) == (label == "Opinion")]
+        annotated.append(f"**[{label}]** {sentence}")
+        explanations.append(f"- \"{sentence}\": {label}, based on: {', '.join(cues)}.")
+    return {
+        "annotated_text": "\n\n".join(annotated),
+        "explanations": "\n".join(explanations),
+        "ambiguous_text": join_sentences(ambiguous),
+        "sentences": len(sentences),
+        "ambiguous": len(ambiguous),
+    }
+
+# Function to tell whether a sentence is a question the writer does not answer: outside quotes, opening
+# like a rhetorical question, and not followed by a statement in the same paragraph
+def is_rhetorical_question(text, sentences, starts, index):
+    sentence = sentences[index]
+    if not sentence.endswith("?") or any(quote in sentence for quote in QUOTES):
+        return False
+    if not RHETORICAL_QUESTION.match(sentence):
+        return False
+    if index + 1 < len(sentences):
+        gap = text[text.find(sentence, starts[index]) + len(sentence):starts[index + 1]]
+        if "\n" not in gap and not sentences[index + 1].endswith("?"):
+            return False
+    return True
+
+# Function to find the sentences in runs of ANAPHORA_RUN or more that open with the same two words
+def anaphora_sentences(sentences):
+    openings = [" ".join(words[:2]) if len(words) >= 4 else None
+                for words in (re.findall(r"[\w']+", sentence.lower()) for sentence in sentences)]
+    repeated, run_start = set(), 0
+    for index in range(1, len(openings) + 1):
+        if index < len(openings) and openings[index] and openings[index] == openings[run_start]:
+            continue
+        if openings[run_start] and index - run_start >= ANAPHORA_RUN:
+            repeated.update(range(run_start, index))
+        run_start = index
+    return repeated
+
+# Function to spot the clear rhetorical devices locally
+def highlight_rhetorical_devices(text):
+    sentences, starts = split_sentences(text)
+    counts = count_matches(text, starts, [pattern for _, pattern in COMPILED_DEVICES])
+    repeated = anaphora_sentences(sentences)
+
+    annotated, explanations, ambiguous = [], [], []
+    for index, sentence in enumerate(sentences):
+        devices = [COMPILED_DEVICES[column][0] for column in np.flatnonzero(counts[index])]
+        if is_rhetorical_question(text, sentences, starts, index):
+            devices.append("Rhetorical question")
+        words = re.findall(r"[\w']+", sentence.lower())
+        phrases = Counter(zip(words, words[1:], words[2:]))
+        if index in repeated or (phrases and max(phrases.values()) >= 3):
+            devices.append("Repetition")
+
+        if devices:
+            annotated.append(f"**[{', '.join(devices)}]** {sentence}")
+            explanations.extend(f"- \"{sentence}\": {device} {DEVICE_EXPLANATIONS[device]}" for device in devices)
+        else:
+            ambiguous.append(sentence)
+            annotated.append(f"{MODEL_REVIEW_MARKER} {sentence}")
+    return {
+        "annotated_text": "\n\n".join(annotated),
+        "explanations": "\n".join(explanations),
+        "ambiguous_text": join_sentences(ambiguous),
+        "sentences": len(sentences),
+        "ambiguous": len(ambiguous),
+    }
+
+# Local pre-pass for each tool that supports one
+FAST_PATHS = {
+    "Fact vs. Opinion Analyzer": classify_fact_opinion,
+    "Rhetorical Device Highlighter": highlight_rhetorical_devices,
+}
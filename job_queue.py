@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from dedup_index import make_scope
+from model_router import session_context
+from scheduler import BATCH, priority_context
+from shared_state import connect_sqlite
+from tim_tools import run_tool, tool_scope
+
+# Defaults for background jobs (override with environment variables)
+DEFAULT_JOBS_PATH = os.environ.get("TIM_JOBS_PATH", "./.tim_cache/jobs.sqlite3")
+JOB_WORKERS = int(os.environ.get("TIM_JOB_WORKERS", "4"))
+MAX_FINISHED_JOBS = int(os.environ.get("TIM_MAX_FINISHED_JOBS", "1000"))
+JOB_LEASE_SECONDS = int(os.environ.get("TIM_JOB_LEASE_SECONDS", "3600"))  # running jobs older than this are retried
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+SUMMARY_COLUMNS = "id, owner, tool, status, error, created_at, started_at, finished_at"
+
+# Function to check whether a process on this host is still running
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        return True
+    return True
+
+# Process-wide job queue: tool runs become jobs whose status and results live in SQLite,
+# so they outlive Streamlit reruns and are picked up again after a restart.
+# Several app processes can share the file: each job is claimed by exactly one worker process.
+class JobQueue:
+    def __init__(self, path=DEFAULT_JOBS_PATH, max_workers=JOB_WORKERS, cache=None, duplicates=None, store=None,
+                 max_finished=MAX_FINISHED_JOBS):
+        self.path = path
+        self.cache = cache
+        self.duplicates = duplicates
+        self.store = store
+        self.max_finished = max_finished
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._lock = threading.Lock()
+        self._db = connect_sqlite(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, key TEXT NOT NULL, owner TEXT, tool TEXT NOT NULL, params TEXT NOT NULL, "
+            "original_text TEXT NOT NULL, source_url TEXT, use_cache INTEGER NOT NULL, status TEXT NOT NULL, result TEXT, error TEXT, "
+            "created_at REAL NOT NULL, started_at REAL, finished_at REAL, worker TEXT)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_key ON jobs (key, status)")
+        self._db.execute("CREATE INDEX IF NOT EXISTS jobs_owner ON jobs (owner, created_at)")
+        self._db.commit()
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="tim-job")
+        self.recover()
+
+    # Requeue jobs left running by a process that has exited (or whose lease ran out), then
+    # offer every queued job to this process's workers
+    def recover(self):
+        host = socket.gethostname()
+        with self._lock:
+            running = self._db.execute("SELECT id, worker, started_at FROM jobs WHERE status = ?", (RUNNING,)).fetchall()
+            for row in running:
+                worker_host, _, pid = (row["worker"] or "").rpartition(":")
+                if not row["worker"] or row["worker"] == self.worker:
+                    stale = True  # from before workers were recorded, or from an earlier process with our pid
+                elif worker_host == host:
+                    stale = not process_alive(int(pid))
+                else:
+                    stale = time.time() - (row["started_at"] or 0) > JOB_LEASE_SECONDS
+                if stale:
+                    self._db.execute("UPDATE jobs SET status = ?, started_at = NULL, worker = NULL WHERE id = ? AND status = ?",
+                                     (QUEUED, row["id"], RUNNING))
+            self._db.commit()
+            pending = [row["id"] for row in self._db.execute(
+                "SELECT id FROM jobs WHERE status = ? ORDER BY created_at", (QUEUED,))]
+        for job_id in pending:
+            self._executor.submit(self._run, job_id)
+
+    # Queue a tool run and return its job id. An identical request from the same owner that is still
+    # pending, or already finished successfully, returns the existing job; other owners get their own
+    # job, which the response cache and request coalescing keep from paying again.
+    def submit(self, tool_name, original_text, params=None, owner=None, use_cache=True, source_url=None):
+        params = params or {}
+        key = make_scope(tool_scope(tool_name, original_text, params), hashlib.sha256(original_text.encode("utf-8")).hexdigest())
+        with self._lock:
+            statuses = (QUEUED, RUNNING, DONE) if use_cache else (QUEUED, RUNNING)
+            existing = self._db.execute(
+                f"SELECT id FROM jobs WHERE key = ? AND owner IS ? AND status IN ({', '.join('?' * len(statuses))}) "
+                "ORDER BY created_at DESC LIMIT 1",
+                (key, owner) + statuses,
+            ).fetchone()
+            if existing is not None:
+                return existing["id"]
+            job_id = uuid.uuid4().hex[:12]
+            self._db.execute(
+                "INSERT INTO jobs (id, key, owner, tool, params, original_text, source_url, use_cache, status, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, key, owner, tool_name, json.dumps(params), original_text, source_url, int(use_cache), QUEUED,
+                 time.time()),
+            )
+            self._db.commit()
+        self._executor.submit(self._run, job_id)
+        return job_id
+
+    def _run(self, job_id):
+        with self._lock:
+            # Claim the job; another process may have claimed it first
+            claimed = self._db.execute(
+                "UPDATE jobs SET status = ?, started_at = ?, worker = ? WHERE id = ? AND status = ?",
+                (RUNNING, time.time(), self.worker, job_id, QUEUED),
+            ).rowcount
+            self._db.commit()
+            if not claimed:
+                return
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        try:
+            # Jobs are charged to the token budget of the session that submitted them, and yield to its clicks
+            with session_context(row["owner"]), priority_context(BATCH):
+                result = run_tool(row["tool"], row["original_text"], json.loads(row["params"]),
+                                  use_cache=bool(row["use_cache"]), cache=self.cache, duplicates=self.duplicates,
+                                  store=self.store, source_url=row["source_url"])
+            error = result.pop("error")
+        except Exception as e:
+            result, error = None, str(e)
+        with self._lock:
+            self._db.execute(
+                "UPDATE jobs SET status = ?, result = ?, error = ?, finished_at = ? WHERE id = ?",
+                (FAILED if error else DONE, json.dumps(result, ensure_ascii=False) if result else None, error,
+                 time.time(), job_id),
+            )
+            self._db.execute(
+                "DELETE FROM jobs WHERE id IN (SELECT id FROM jobs WHERE status IN (?, ?) "
+                "ORDER BY finished_at DESC LIMIT -1 OFFSET ?)",
+                (DONE, FAILED, self.max_finished),
+            )
+            self._db.commit()
+
+    # Return a job with its original text and result, or None
+    def get(self, job_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        job = dict(row)
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # Return the newest jobs of an owner without their (possibly large) texts
+    def list(self, owner, limit=50):
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {SUMMARY_COLUMNS} FROM jobs WHERE owner = ? ORDER BY created_at DESC LIMIT ?", (owner, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def stats(self, owner=None):
+        query = "SELECT status, COUNT(*) FROM jobs" + (" WHERE owner = ?" if owner else "") + " GROUP BY status"
+        with self._lock:
+            counts = dict(self._db.execute(query, (owner,) if owner else ()).fetchall())
+        return {status: counts.get(status, 0) for status in (QUEUED, RUNNING, DONE, FAILED)}
@@ -0,0 +1,139 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from shared_state import connect_sqlite
+
+# Defaults for the response cache (override with environment variables)
+DEFAULT_CACHE_PATH = os.environ.get("TIM_CACHE_PATH", "./.tim_cache/responses.sqlite3")
+DEFAULT_MAX_MEMORY_ENTRIES = int(os.environ.get("TIM_CACHE_MEMORY_ENTRIES", "256"))
+DEFAULT_MAX_DISK_ENTRIES = int(os.environ.get("TIM_CACHE_DISK_ENTRIES", "5000"))
+DEFAULT_TTL_SECONDS = int(os.environ.get("TIM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+# Function to build a content-addressed key for a chat completion request
+def make_cache_key(model, system_message, prompt, max_tokens):
+    payload = json.dumps([model, system_message, prompt, max_tokens], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+# Two-level cache for model responses: an in-memory LRU in front of a SQLite file.
+# Given a shared state backend (see shared_state.py), the second level is kept there instead, so
+# every app process reuses the others' responses; the backend's TTLs then replace the disk limit.
+class ResponseCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_memory_entries=DEFAULT_MAX_MEMORY_ENTRIES,
+                 max_disk_entries=DEFAULT_MAX_DISK_ENTRIES, ttl_seconds=DEFAULT_TTL_SECONDS, shared=None):
+        self.path = None if shared is not None else path
+        self.shared = shared
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if self.path:
+            self._db = connect_sqlite(self.path)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+                "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed_at)")
+            self._db.commit()
+
+    def _expired(self, created_at, now):
+        return bool(self.ttl_seconds) and now - created_at > self.ttl_seconds
+
+    def _remember(self, key, created_at, value):
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if not self._expired(entry[0], now):
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    self.memory_hits += 1
+                    return entry[1]
+                del self._memory[key]
+
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None:
+                    value, created_at = row
+                    if not self._expired(created_at, now):
+                        self._db.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                        self._db.commit()
+                        self._remember(key, created_at, value)
+                        self.hits += 1
+                        self.disk_hits += 1
+                        return value
+                    self._db.execute("DELETE FROM responses WHERE key = ?", (key,))
+                    self._db.commit()
+            elif self.shared is not None:
+                value = self.shared.get(f"cache:{key}")
+                if value is not None:
+                    self._remember(key, now, value)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return value
+
+            self.misses += 1
+            return None
+
+    def set(self, key, value):
+        now = time.time()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO responses (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                # Evict the least recently used rows once the disk limit is exceeded
+                self._db.execute(
+                    "DELETE FROM responses WHERE key IN ("
+                    "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_disk_entries,),
+                )
+                self._db.commit()
+            elif self.shared is not None:
+                self.shared.set(f"cache:{key}", value, self.ttl_seconds or None)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM responses")
+                self._db.commit()
+            elif self.shared is not None:
+                self.shared.clear("cache:")
+            self.hits = self.memory_hits = self.disk_hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            disk_entries = 0
+            if self._db is not None:
+                disk_entries = self._db.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "memory_entries": len(self._memory),
+                "disk_entries": disk_entries,
+            }
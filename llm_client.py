@@ -0,0 +1,511 @@
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import openai
+
+from chunking import estimate_tokens
+from llm_cache import make_cache_key
+from metrics import metrics
+from model_router import current_session, router
+from scheduler import scheduler
+from shared_state import SHARED, shared_state
+from structured_output import RESULT_FUNCTION
+
+# Model settings shared by every tool (the model and max_tokens of each request come from model_router)
+MODEL_NAME = "gpt-4o-mini"
+SYSTEM_MESSAGE = "You are an advanced text analysis,information quality expert, and manipulation assistant."
+
+# Process-wide API budgets and retry policy (override with environment variables)
+REQUESTS_PER_MINUTE = int(os.environ.get("TIM_OPENAI_RPM", "500"))
+TOKENS_PER_MINUTE = int(os.environ.get("TIM_OPENAI_TPM", "200000"))
+MAX_RETRIES = int(os.environ.get("TIM_OPENAI_MAX_RETRIES", "5"))
+BACKOFF_BASE_SECONDS = 1.0
+BACKOFF_MAX_SECONDS = 30.0
+SHARED_LIMIT_WINDOW_SECONDS = 60  # budget windows counted in the shared state when several processes run
+FLIGHT_LEASE_SECONDS = 180  # how long another process waits on an in-flight request before taking it over
+FLIGHT_RESULT_SECONDS = 15
+
+RETRYABLE_ERRORS = (
+    openai.error.RateLimitError,
+    openai.error.ServiceUnavailableError,
+    openai.error.APIConnectionError,
+    openai.error.Timeout,
+    openai.error.TryAgain,
+)
+
+# Token-bucket limiter on requests and tokens per minute that slows down after 429s
+class RateLimiter:
+    MIN_SCALE = 0.1
+
+    def __init__(self, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.scale = 1.0
+        self.paused_until = 0.0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+        self._requests = float(requests_per_minute)
+        self._tokens = float(tokens_per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self._updated
+        self._updated = now
+        self._requests = min(self.requests_per_minute, self._requests + elapsed * self.requests_per_minute * self.scale / 60)
+        self._tokens = min(self.tokens_per_minute, self._tokens + elapsed * self.tokens_per_minute * self.scale / 60)
+
+    # Block until one request costing `tokens` fits in both budgets
+    def acquire(self, tokens):
+        tokens = min(tokens, self.tokens_per_minute)
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                wait = max(
+                    self.paused_until - now,
+                    (1 - self._requests) * 60 / (self.requests_per_minute * self.scale),
+                    (tokens - self._tokens) * 60 / (self.tokens_per_minute * self.scale),
+                )
+                if wait <= 0:
+                    self._requests -= 1
+                    self._tokens -= tokens
+                    self.waited_seconds += now - started
+                    return now - started
+            time.sleep(min(wait, 1.0))
+
+    # Return the unused part of a token reservation once the real usage is known
+    def settle(self, reserved, used):
+        with self._lock:
+            self._tokens = min(self.tokens_per_minute, self._tokens + max(0, reserved - used))
+
+    def on_success(self):
+        with self._lock:
+            self.scale = min(1.0, self.scale + 0.05)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.throttled += 1
+            self.scale = max(self.MIN_SCALE, self.scale / 2)
+            if retry_after:
+                self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scale": self.scale,
+                "throttled": self.throttled,
+                "waited_seconds": self.waited_seconds,
+            }
+
+# Shares one upstream call between identical requests that are in flight at the same time
+class SingleFlight:
+    def __init__(self):
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+            else:
+                self.coalesced += 1
+        if not leader:
+            return future.result()
+        try:
+            result = fn()
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+class StreamAbandoned(Exception):
+    pass
+
+# Deltas of one stream as they arrive, replayed to every caller sharing it
+class SharedStream:
+    def __init__(self):
+        self.deltas = []
+        self.done = False
+        self.error = None
+        self._cond = threading.Condition()
+
+    def publish(self, delta):
+        with self._cond:
+            self.deltas.append(delta)
+            self._cond.notify_all()
+
+    def finish(self, error=None):
+        with self._cond:
+            self.done, self.error = True, error
+            self._cond.notify_all()
+
+    def __iter__(self):
+        index = 0
+        while True:
+            with self._cond:
+                while index == len(self.deltas) and not self.done:
+                    self._cond.wait()
+                deltas, done, error = self.deltas[index:], self.done, self.error
+            index += len(deltas)
+            yield from deltas
+            if done and index == len(self.deltas):
+                if error is not None:
+                    raise error
+                return
+
+# Shares one upstream stream between identical streamed requests that are in flight at the same time:
+# the first caller streams, and the others replay its deltas as they arrive. When the first caller
+# stops reading part way (e.g. its page was rerun), a caller that has not received anything yet starts
+# again on its own; one that has received part of the text gets StreamAbandoned.
+class StreamFlight:
+    def __init__(self):
+        self.coalesced = 0
+        self._streams = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn):
+        received = False
+        while True:
+            with self._lock:
+                stream = self._streams.get(key)
+                leader = stream is None
+                if leader:
+                    stream = self._streams[key] = SharedStream()
+                else:
+                    self.coalesced += 1
+            if leader:
+                break
+            try:
+                for delta in stream:
+                    received = True
+                    yield delta
+                return
+            except StreamAbandoned:
+                if received:
+                    raise
+        upstream = fn()
+        try:
+            for delta in upstream:
+                stream.publish(delta)
+                yield delta
+        except GeneratorExit:
+            self._end(key, stream, StreamAbandoned("The shared stream was stopped before it finished; try again."))
+            raise
+        except BaseException as e:
+            self._end(key, stream, e)
+            raise
+        else:
+            self._end(key, stream)
+        finally:
+            upstream.close()
+
+    # Unregister a stream before ending it, so a caller that starts over does not find it again
+    def _end(self, key, stream, error=None):
+        with self._lock:
+            del self._streams[key]
+        stream.finish(error)
+
+# Rate limiter for several app processes: the per-minute budgets are split into fixed windows whose
+# request and token counts live in the shared state, so the processes together stay within them
+class SharedRateLimiter:
+    def __init__(self, state, requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE,
+                 window_seconds=SHARED_LIMIT_WINDOW_SECONDS):
+        self.state = state
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.window_seconds = window_seconds
+        self.scale = 1.0
+        self.throttled = 0
+        self.waited_seconds = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()  # window of this thread's last reservation
+
+    def _limits(self):
+        share = self.window_seconds / 60 * self.scale
+        return max(1, int(self.requests_per_minute * share)), max(1, int(self.tokens_per_minute * share))
+
+    # Block until one request costing `tokens` fits in the current window of both budgets
+    def acquire(self, tokens):
+        started = time.monotonic()
+        ttl = self.window_seconds * 2
+        while True:
+            now = time.time()
+            paused_until = float(self.state.get("limiter:paused_until") or 0)
+            if paused_until > now:
+                time.sleep(min(paused_until - now, 1.0))
+                continue
+            window = int(now // self.window_seconds)
+            max_requests, max_tokens = self._limits()
+            cost = min(tokens, max_tokens)
+            requests = self.state.incr(f"limiter:requests:{window}", 1, ttl)
+            used = self.state.incr(f"limiter:tokens:{window}", cost, ttl)
+            if requests <= max_requests and used <= max_tokens:
+                self._local.window = window
+                waited = time.monotonic() - started
+                with self._lock:
+                    self.waited_seconds += waited
+                return waited
+            self.state.incr(f"limiter:requests:{window}", -1, ttl)
+            self.state.incr(f"limiter:tokens:{window}", -cost, ttl)
+            # Jitter keeps the waiting processes from all retrying at the start of the next window
+            time.sleep((window + 1) * self.window_seconds - now + random.uniform(0, 0.2))
+
+    # Return the unused part of a token reservation to the window it was taken from (the one this
+    # thread last acquired in), so a request that finishes after the window rolls over does not
+    # credit the next window with tokens it never charged
+    def settle(self, reserved, used):
+        window = getattr(self._local, "window", None)
+        if reserved > used and window is not None:
+            self.state.incr(f"limiter:tokens:{window}", used - reserved, self.window_seconds * 2)
+
+    def on_success(self):
+        with self._lock:
+            self.scale = min(1.0, self.scale + 0.05)
+
+    def on_throttle(self, retry_after=None):
+        with self._lock:
+            self.throttled += 1
+            self.scale = max(RateLimiter.MIN_SCALE, self.scale / 2)
+        if retry_after:
+            self.state.set("limiter:paused_until", time.time() + retry_after, retry_after + 1)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "scale": self.scale,
+                "throttled": self.throttled,
+                "waited_seconds": self.waited_seconds,
+            }
+
+# SingleFlight across processes: the first process to claim a request's lease in the shared state
+# makes the call and publishes the result; the others wait for it. A lease left by a process that
+# died expires, and a leader that fails publishes nothing, so a waiting process then takes over.
+class SharedSingleFlight:
+    def __init__(self, state, lease_seconds=FLIGHT_LEASE_SECONDS):
+        self.state = state
+        self.lease_seconds = lease_seconds
+        self.remote_coalesced = 0
+        self._local = SingleFlight()
+
+    @property
+    def coalesced(self):
+        return self._local.coalesced + self.remote_coalesced
+
+    def run(self, key, fn):
+        return self._local.run(key, lambda: self._run_shared(key, fn))
+
+    def _run_shared(self, key, fn):
+        while True:
+            if self.state.add(f"flight:{key}", os.getpid(), self.lease_seconds):
+                try:
+                    result = fn()
+                    self.state.set(f"flight-result:{key}", result, FLIGHT_RESULT_SECONDS)
+                    return result
+                finally:
+                    self.state.delete(f"flight:{key}")
+            result = self.state.get(f"flight-result:{key}")
+            if result is not None:
+                self.remote_coalesced += 1
+                return result
+            time.sleep(0.1)
+
+# Function to make the rate limiter for this process, shared with the other processes when TIM_SHARED_STATE is set
+def make_rate_limiter(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE):
+    if SHARED:
+        return SharedRateLimiter(shared_state, requests_per_minute, tokens_per_minute)
+    return RateLimiter(requests_per_minute, tokens_per_minute)
+
+# Process-wide client state shared by every Streamlit session and worker thread
+# (and, with TIM_SHARED_STATE set, by the other app processes)
+rate_limiter = make_rate_limiter()
+single_flight = SharedSingleFlight(shared_state) if SHARED else SingleFlight()
+stream_flight = StreamFlight()
+retry_count = 0
+retry_lock = threading.Lock()  # worker threads retry concurrently, and += is not atomic
+
+# Function to read the Retry-After header (in seconds) from an OpenAI error, if any
+def retry_after_seconds(error):
+    headers = getattr(error, "headers", None) or {}
+    value = headers.get("retry-after") or headers.get("Retry-After")
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+# Function to decide whether an OpenAI error is worth retrying
+def is_retryable(error):
+    if isinstance(error, RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, openai.error.APIError) and (error.http_status or 500) >= 500
+
+# Generator that passes a streamed response through while timing the first token and the whole generation.
+# Only the time spent waiting on the API counts, not the caller's work between chunks.
+# Streams carry no usage, so once the stream ends (or is abandoned) the rate limiter's reservation is
+# settled on the input tokens plus the estimated tokens of the text streamed so far.
+def timed_stream(response, started, reserved, input_tokens):
+    waiting = time.monotonic() - started
+    first_token = True
+    resumed = time.monotonic()
+    streamed = []
+    try:
+        for chunk in response:
+            waiting += time.monotonic() - resumed
+            delta = chunk['choices'][0]['delta']
+            if first_token and (delta.get('content') or delta.get('function_call')):
+                metrics.observe("ttft", waiting)
+                first_token = False
+            streamed.append(delta.get('content') or (delta.get('function_call') or {}).get('arguments') or "")
+            yield chunk
+            resumed = time.monotonic()
+        metrics.observe("generation", waiting + time.monotonic() - resumed)
+    finally:
+        rate_limiter.settle(reserved, input_tokens + estimate_tokens("".join(streamed)))
+
+# Function to call the chat completion endpoint with rate limiting, jittered backoff and retries.
+# Requests take their turn at the rate limiter in the fair scheduler's order; when too many are
+# already waiting, QueueFull is raised without sending anything.
+def create_chat_completion(messages, max_tokens, model=MODEL_NAME, **kwargs):
+    global retry_count
+    input_tokens = count_message_tokens(messages)
+    reserved = input_tokens + max_tokens
+    waited = 0.0
+    for attempt in range(MAX_RETRIES + 1):
+        with scheduler.slot(reserved, current_session.get()):
+            waited += rate_limiter.acquire(reserved)
+        started = time.monotonic()
+        try:
+            response = openai.ChatCompletion.create(model=model, messages=messages, max_tokens=max_tokens, **kwargs)
+        except Exception as e:
+            if attempt >= MAX_RETRIES or not is_retryable(e):
+                metrics.observe("queue_wait", waited)
+                raise
+            retry_after = retry_after_seconds(e)
+            if isinstance(e, openai.error.RateLimitError):
+                rate_limiter.on_throttle(retry_after)
+            with retry_lock:
+                retry_count += 1
+            time.sleep(retry_after or random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** attempt)))
+            waited += time.monotonic() - started
+            continue
+        rate_limiter.on_success()
+        # Time spent in the limiter, failed attempts and backoff all count as queue wait
+        metrics.observe("queue_wait", waited)
+        metrics.count_request("api")
+        if kwargs.get("stream"):
+            return timed_stream(response, started, reserved, input_tokens)
+        usage = response.get("usage", {})
+        metrics.observe("generation", time.monotonic() - started)
+        metrics.add_tokens(usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0))
+        rate_limiter.settle(reserved, usage.get("total_tokens", reserved))
+        return response
+
+# Function to build the message list for a prompt
+def build_messages(prompt):
+    return [
+        {"role": "system", "content": SYSTEM_MESSAGE},
+        {"role": "user", "content": prompt}
+    ]
+
+# Function to count (or estimate) the input tokens of a message list
+def count_message_tokens(messages):
+    return sum(estimate_tokens(message["content"]) for message in messages)
+
+# Function to get the extra request arguments that force a function call:
+# structured=True forces the result function, a function schema dict forces that function
+def structured_kwargs(structured):
+    if not structured:
+        return {}
+    function = structured if isinstance(structured, dict) else RESULT_FUNCTION
+    return {"functions": [function], "function_call": {"name": function["name"]}}
+
+# Function to request a completion (raises on failure, so it is safe to call from worker threads).
+# With structured set the returned string is the JSON arguments of the forced function call.
+# The model and, unless given, max_tokens are routed on the tool and input size; a request that
+# would overrun the session or global token budget raises BudgetExceeded without being sent.
+def request_completion(prompt, max_tokens=None, use_cache=True, cache=None, structured=False):
+    messages = build_messages(prompt)
+    route = router.route(count_message_tokens(messages), max_tokens)
+    cache_key = make_cache_key(route.model, SYSTEM_MESSAGE, prompt, route.max_tokens)
+    if use_cache and cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            metrics.count_request("cache")
+            return cached
+
+    def call():
+        reservation = router.reserve(route)
+        try:
+            response = create_chat_completion(messages, route.max_tokens, route.model, **structured_kwargs(structured))
+        except Exception:
+            router.release(reservation)
+            raise
+        message = response['choices'][0]['message']
+        content = (message.get('function_call') or {}).get('arguments') or message.get('content') or ""
+        content = content.strip()
+        usage = response.get("usage") or {}
+        router.settle(reservation, usage.get("prompt_tokens", route.input_tokens),
+                      usage.get("completion_tokens", estimate_tokens(content)))
+        if cache is not None:
+            cache.set(cache_key, content)
+        return content
+
+    return single_flight.run(cache_key, call)
+
+# Function to stream a completion, yielding text deltas as they arrive (raises on failure).
+# Streamed responses carry no usage, so the budget is settled on the estimated output tokens.
+# Identical streams in flight at the same time share one upstream call.
+def stream_completion(prompt, max_tokens=None, use_cache=True, cache=None, structured=False):
+    messages = build_messages(prompt)
+    route = router.route(count_message_tokens(messages), max_tokens)
+    cache_key = make_cache_key(route.model, SYSTEM_MESSAGE, prompt, route.max_tokens)
+    if use_cache and cache is not None:
+        cached = cache.get(cache_key)
+        if cached is not None:
+            metrics.count_request("cache")
+            yield cached
+            return
+
+    def stream():
+        reservation = router.reserve(route)
+        chunks = []
+        try:
+            response = create_chat_completion(messages, route.max_tokens, route.model, stream=True,
+                                              **structured_kwargs(structured))
+            for chunk in response:
+                delta = chunk['choices'][0]['delta']
+                delta = (delta.get('function_call') or {}).get('arguments') or delta.get('content')
+                if delta:
+                    chunks.append(delta)
+                    yield delta
+        except BaseException:
+            # A stream that failed or was abandoned part way still used the tokens it produced
+            if chunks:
+                router.settle(reservation, route.input_tokens, estimate_tokens("".join(chunks)))
+            else:
+                router.release(reservation)
+            raise
+        content = "".join(chunks).strip()
+        tokens_out = estimate_tokens(content)
+        router.settle(reservation, route.input_tokens, tokens_out)
+        metrics.add_tokens(route.input_tokens, tokens_out)
+        if cache is not None:
+            cache.set(cache_key, content)
+
+    yield from stream_flight.run(cache_key, stream)
+
+# Function to report the shared client's limiter, retry and coalescing counters
+def client_stats():
+    return dict(rate_limiter.stats(), retries=retry_count,
+                coalesced=single_flight.coalesced + stream_flight.coalesced)
@@ -0,0 +1,215 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+# Per-stage latency and token instrumentation, shared by every session and worker thread.
+# Export with TIM_METRICS_FILE (Prometheus text, or JSONL when the name ends in .jsonl)
+# and/or TIM_METRICS_PORT (serves GET /metrics).
+METRICS_FILE = os.environ.get("TIM_METRICS_FILE")
+METRICS_PORT = int(os.environ.get("TIM_METRICS_PORT", "0"))
+SAMPLE_WINDOW = int(os.environ.get("TIM_METRICS_WINDOW", "2048"))  # recent samples kept per series for percentiles
+
+STAGES = ("fetch", "parse", "prompt_build", "schedule_wait", "queue_wait", "ttft", "generation", "render")
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+QUANTILES = (50, 95, 99)
+UNLABELLED = "-"
+
+# Tool the current thread is working for; metrics recorded without an explicit tool use it
+current_tool = contextvars.ContextVar("current_tool", default=UNLABELLED)
+# Token totals of the tool run in progress (shared with the chunk workers it starts)
+current_usage = contextvars.ContextVar("current_usage", default=None)
+
+# Fixed-bucket histogram plus a window of recent samples for percentiles
+class Histogram:
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.buckets = np.zeros(len(BUCKETS) + 1, dtype=np.int64)
+        self.count = 0
+        self.sum = 0.0
+        self.samples = deque(maxlen=window)
+
+    def observe(self, value):
+        self.buckets[np.searchsorted(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.samples.append(value)
+
+    def percentiles(self):
+        if not self.samples:
+            return dict.fromkeys(QUANTILES, 0.0)
+        values = np.percentile(np.fromiter(self.samples, dtype=float), QUANTILES)
+        return {quantile: float(value) for quantile, value in zip(QUANTILES, values)}
+
+class MetricsRegistry:
+    def __init__(self):
+        self._latency = defaultdict(Histogram)  # (stage, tool) -> Histogram
+        self._tokens = defaultdict(int)  # (tool, "in" | "out") -> tokens
+        self._requests = defaultdict(int)  # (tool, "api" | "cache") -> requests
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, tool=None):
+        with self._lock:
+            self._latency[(stage, tool or current_tool.get())].observe(seconds)
+
+    @contextmanager
+    def timer(self, stage, tool=None):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.monotonic() - started, tool)
+
+    # Streamed responses carry no usage block, so their counts are tiktoken estimates
+    def add_tokens(self, prompt_tokens, completion_tokens, tool=None):
+        tool = tool or current_tool.get()
+        usage = current_usage.get()
+        with self._lock:
+            self._tokens[(tool, "in")] += prompt_tokens
+            self._tokens[(tool, "out")] += completion_tokens
+            if usage is not None:
+                usage["tokens_in"] += prompt_tokens
+                usage["tokens_out"] += completion_tokens
+
+    # Upstream ("api") requests also count towards the tool run in progress
+    def count_request(self, source, tool=None):
+        usage = current_usage.get()
+        with self._lock:
+            self._requests[(tool or current_tool.get(), source)] += 1
+            if usage is not None and source == "api":
+                usage["requests"] += 1
+
+    def reset(self):
+        with self._lock:
+            self._latency.clear()
+            self._tokens.clear()
+            self._requests.clear()
+
+    # Return latency rows (stage, tool, count, mean, p50/p95/p99) and per-tool token/request rows
+    def snapshot(self):
+        with self._lock:
+            latency = []
+            for (stage, tool), histogram in sorted(self._latency.items()):
+                row = {"stage": stage, "tool": tool, "count": histogram.count,
+                       "mean": histogram.sum / histogram.count if histogram.count else 0.0}
+                row.update((f"p{quantile}", value) for quantile, value in histogram.percentiles().items())
+                latency.append(row)
+            tools = sorted({tool for tool, _ in self._tokens} | {tool for tool, _ in self._requests})
+            usage = [{
+                "tool": tool,
+                "api_requests": self._requests.get((tool, "api"), 0),
+                "cache_hits": self._requests.get((tool, "cache"), 0),
+                "tokens_in": self._tokens.get((tool, "in"), 0),
+                "tokens_out": self._tokens.get((tool, "out"), 0),
+            } for tool in tools]
+        return {"timestamp": time.time(), "latency": latency, "usage": usage}
+
+    def to_prometheus(self):
+        lines = [
+            "# HELP tim_stage_seconds Latency of each pipeline stage.",
+            "# TYPE tim_stage_seconds histogram",
+        ]
+        with self._lock:
+            latency = sorted(self._latency.items())
+            tokens = sorted(self._tokens.items())
+            requests = sorted(self._requests.items())
+            for (stage, tool), histogram in latency:
+                labels = f'stage="{escape_label(stage)}",tool="{escape_label(tool)}"'
+                cumulative = np.cumsum(histogram.buckets)
+                for bound, count in zip(BUCKETS, cumulative):
+                    lines.append(f'tim_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'tim_stage_seconds_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f"tim_stage_seconds_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"tim_stage_seconds_count{{{labels}}} {histogram.count}")
+            lines += ["# HELP tim_stage_seconds_quantile Recent latency percentiles of each pipeline stage.",
+                      "# TYPE tim_stage_seconds_quantile gauge"]
+            for (stage, tool), histogram in latency:
+                for quantile, value in histogram.percentiles().items():
+                    lines.append(f'tim_stage_seconds_quantile{{stage="{escape_label(stage)}",tool="{escape_label(tool)}",'
+                                 f'quantile="0.{quantile}"}} {value}')
+        lines += ["# HELP tim_tokens_total Tokens sent to and received from the model.",
+                  "# TYPE tim_tokens_total counter"]
+        lines += [f'tim_tokens_total{{tool="{escape_label(tool)}",direction="{direction}"}} {value}'
+                  for (tool, direction), value in tokens]
+        lines += ["# HELP tim_requests_total Model requests answered by the API or the response cache.",
+                  "# TYPE tim_requests_total counter"]
+        lines += [f'tim_requests_total{{tool="{escape_label(tool)}",source="{source}"}} {value}'
+                  for (tool, source), value in requests]
+        return "\n".join(lines) + "\n"
+
+    def to_jsonl(self):
+        return json.dumps(self.snapshot(), ensure_ascii=False) + "\n"
+
+    # Append a JSONL snapshot, or atomically replace a Prometheus textfile
+    def write(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if path.lower().endswith(".jsonl"):
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(self.to_jsonl())
+            return
+        temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus())
+        os.replace(temporary, path)
+
+# Function to escape a Prometheus label value
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Context manager that labels the metrics recorded inside it with a tool name and totals its tokens.
+# A nested run (e.g. the chunked part of a UI run) adds to the outer run's totals.
+@contextmanager
+def tool_context(tool_name):
+    tool_token = current_tool.set(tool_name)
+    usage_token = current_usage.set(current_usage.get() or {"tokens_in": 0, "tokens_out": 0, "requests": 0})
+    try:
+        yield
+    finally:
+        current_usage.reset(usage_token)
+        current_tool.reset(tool_token)
+
+# Function to get the tokens used and upstream requests made so far by the tool run in progress
+def run_usage():
+    return dict(current_usage.get() or {"tokens_in": 0, "tokens_out": 0, "requests": 0})
+
+# Decorator that labels the metrics recorded by a function with its first argument, the tool name
+def labelled_by_tool(fn):
+    @functools.wraps(fn)
+    def wrapper(tool_name, *args, **kwargs):
+        with tool_context(tool_name):
+            return fn(tool_name, *args, **kwargs)
+    return wrapper
+
+# Function to serve the registry in Prometheus text format on GET /metrics from a daemon thread
+def start_http_exporter(port, registry=None, host="127.0.0.1"):
+    registry = registry or metrics
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.to_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-exporter", daemon=True).start()
+    return server
+
+# Process-wide registry
+metrics = MetricsRegistry()
@@ -0,0 +1,360 @@
+import fnmatch
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from socketserver import StreamRequestHandler, ThreadingTCPServer
+
+from chunking import estimate_tokens
+from shared_state import REDIS_INCR_SCRIPT
+
+# Local stand-ins for the OpenAI API, for news sites and for a Redis server, used by benchmark.py.
+# Point the client at the mock with openai.api_base = server.api_base.
+
+DEFAULT_LATENCY = 0.4  # seconds before the first token
+DEFAULT_TOKEN_RATE = 80.0  # generated tokens per second
+DEFAULT_COMPLETION_TOKENS = 300
+DEFAULT_ERROR_RATE = 0.0  # fraction of requests answered with an injected error
+
+SENTENCES = [
+    "The city council approved the new transit budget after a lengthy public hearing on Tuesday.",
+    "Officials said the plan would add twelve bus routes and extend service hours on weekends.",
+    "Critics argued that the proposal ignores the neighborhoods that need better service the most.",
+    "According to the transportation department, ridership has grown by 8 percent since last year.",
+    "Several residents told reporters they were worried about rising fares and longer commutes.",
+    "The mayor called the vote a historic step toward a cleaner and more connected city.",
+    "Independent analysts noted that similar programs in other cities took years to show results.",
+    "Business owners near the downtown corridor expect more foot traffic once construction ends.",
+    "Environmental groups welcomed the decision but said it does not go far enough.",
+    "The budget includes 40 million dollars for electric buses over the next five years.",
+    "Some council members questioned whether the projected savings were realistic.",
+    "Union leaders said drivers had not been consulted on the new schedules.",
+]
+
+# Shared server plumbing: a threading server running on a daemon thread
+class LocalServer:
+    def __init__(self, handler, host="127.0.0.1", port=0, server_class=ThreadingHTTPServer):
+        self.server = server_class((host, port), handler)
+        self.server.daemon_threads = True
+        self.server.owner = self
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name=type(self).__name__, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+class QuietHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+# Function to make deterministic fake completion text of about `tokens` tokens from the prompt's own words
+def fake_completion_words(prompt, tokens, seed):
+    words = [word for word in prompt.split() if word.isalpha()] or ["lorem", "ipsum"]
+    rng = random.Random(seed)
+    return [rng.choice(words) for _ in range(max(1, tokens))]
+
+class MockOpenAIHandler(QuietHandler):
+    def do_POST(self):
+        mock = self.server.owner
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        error = mock.pick_error()
+        if error == 429:
+            self.send_json(429, {"error": {"message": "Rate limit reached (injected).", "type": "rate_limit_error"}},
+                           {"Retry-After": str(mock.retry_after)})
+            return
+        if error == 500:
+            self.send_json(500, {"error": {"message": "Server error (injected).", "type": "server_error"}})
+            return
+
+        messages = request.get("messages", [])
+        prompt = "\n".join(message.get("content") or "" for message in messages)
+        prompt_tokens = sum(estimate_tokens(message.get("content") or "") for message in messages)
+        completion_tokens = min(request.get("max_tokens") or mock.completion_tokens, mock.completion_tokens)
+        seed = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        words = fake_completion_words(prompt, completion_tokens, seed)
+        half = len(words) // 2
+        text, analysis = " ".join(words[:half]), " ".join(words[half:])
+        function = (request.get("function_call") or {}).get("name") if request.get("functions") else None
+        body = json.dumps({"text": text, "analysis": analysis}) if function else f"{text}\n---\n{analysis}"
+        if function == "submit_variants":
+            # One entry per numbered task of a multi-variant prompt, splitting the words between them
+            tasks = re.findall(r"^Task \d+ \([^:]*: (.*)\):$", prompt, re.MULTILINE)
+            size = max(1, len(words) // max(1, len(tasks)))
+            body = json.dumps({"variants": [
+                {"variant": task, "text": " ".join(words[index * size:index * size + size // 2]),
+                 "analysis": " ".join(words[index * size + size // 2:(index + 1) * size])}
+                for index, task in enumerate(tasks)
+            ]})
+
+        time.sleep(mock.latency * random.uniform(0.8, 1.2))
+        if request.get("stream"):
+            self.stream(request, function, body, len(words))
+            return
+        time.sleep(len(words) / mock.token_rate)
+        message = {"role": "assistant", "content": None if function else body}
+        if function:
+            message["function_call"] = {"name": function, "arguments": body}
+        self.send_json(200, {
+            "id": f"chatcmpl-mock-{seed[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model"),
+            "choices": [{"index": 0, "message": message, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": len(words),
+                      "total_tokens": prompt_tokens + len(words)},
+        })
+
+    # Send the body as server-sent events, a few characters at a time, paced by the token rate
+    def stream(self, request, function, body, tokens):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        pieces = [body[index:index + 4] for index in range(0, len(body), 4)]
+        delay = tokens / self.server.owner.token_rate / max(1, len(pieces))
+        base = {"id": "chatcmpl-mock", "object": "chat.completion.chunk", "created": int(time.time()),
+                "model": request.get("model")}
+
+        def send(delta, finish_reason=None):
+            event = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": finish_reason}])
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        send({"role": "assistant", "content": None, "function_call": {"name": function, "arguments": ""}}
+             if function else {"role": "assistant", "content": ""})
+        for piece in pieces:
+            time.sleep(delay)
+            send({"function_call": {"arguments": piece}} if function else {"content": piece})
+        send({}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+# Mock chat completions endpoint with configurable latency, token rate and error injection
+class MockOpenAIServer(LocalServer):
+    def __init__(self, latency=DEFAULT_LATENCY, token_rate=DEFAULT_TOKEN_RATE, completion_tokens=DEFAULT_COMPLETION_TOKENS,
+                 error_rate=DEFAULT_ERROR_RATE, server_error_share=0.5, retry_after=0.5, seed=0, **kwargs):
+        super().__init__(MockOpenAIHandler, **kwargs)
+        self.latency = latency
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.error_rate = error_rate
+        self.server_error_share = server_error_share
+        self.retry_after = retry_after
+        self.requests = 0
+        self.errors = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    @property
+    def api_base(self):
+        return f"{self.base_url}/v1"
+
+    # Return 429, 500 or None for the next request
+    def pick_error(self):
+        with self._lock:
+            self.requests += 1
+            if self._random.random() >= self.error_rate:
+                return None
+            self.errors += 1
+            return 500 if self._random.random() < self.server_error_share else 429
+
+# Function to build a deterministic corpus of (title, paragraphs) articles; every fourth one is long
+def fixture_articles(count=20, seed=0):
+    rng = random.Random(seed)
+    articles = []
+    for index in range(count):
+        paragraphs = 40 if index % 4 == 3 else rng.randint(4, 8)
+        articles.append((
+            f"Fixture article {index + 1}: {rng.choice(SENTENCES)[:-1]}",
+            [" ".join(rng.sample(SENTENCES, 4)) for _ in range(paragraphs)],
+        ))
+    return articles
+
+# Function to render a fixture article as a news-style HTML page
+def render_article_html(title, paragraphs):
+    body = "\n".join(f"<p>{paragraph}</p>" for paragraph in paragraphs)
+    return f"""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>{title}</title>
+<meta property="og:title" content="{title}"><meta name="author" content="TIM Fixture Desk"></head>
+<body><nav><a href="/">Home</a> | <a href="/news">News</a></nav>
+<article><h1>{title}</h1><p class="byline">By TIM Fixture Desk</p>
+{body}
+</article><footer>Copyright TIM fixtures</footer></body></html>"""
+
+class ArticleHandler(QuietHandler):
+    def do_GET(self):
+        pages = self.server.owner.pages
+        page = pages.get(self.path.split("?")[0])
+        if page is None:
+            self.send_error(404)
+            return
+        body, etag = page
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+# Serves the fixture corpus at /articles/<n>.html, with ETags so revalidation is exercised too
+class ArticleFixtureServer(LocalServer):
+    def __init__(self, articles=None, **kwargs):
+        super().__init__(ArticleHandler, **kwargs)
+        self.pages = {}
+        for index, (title, paragraphs) in enumerate(articles or fixture_articles(), 1):
+            body = render_article_html(title, paragraphs).encode("utf-8")
+            self.pages[f"/articles/{index}.html"] = (body, f'"{hashlib.sha256(body).hexdigest()[:16]}"')
+
+    @property
+    def urls(self):
+        return [f"{self.base_url}{path}" for path in self.pages]
+
+class RedisHandler(StreamRequestHandler):
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        args = []
+        for _ in range(int(line[1:])):
+            length = int(self.rfile.readline()[1:])
+            args.append(self.rfile.read(length + 2)[:-2].decode("utf-8"))
+        return args
+
+    def reply(self, value):
+        if value is None:
+            data = b"$-1\r\n"
+        elif isinstance(value, Exception):
+            data = f"-{value}\r\n".encode("utf-8")
+        elif isinstance(value, bool):
+            data = b"+OK\r\n" if value else b"$-1\r\n"
+        elif isinstance(value, int):
+            data = b":%d\r\n" % value
+        elif isinstance(value, list):
+            data = b"*%d\r\n" % len(value)
+            self.wfile.write(data)
+            for item in value:
+                self.reply(item)
+            return
+        else:
+            encoded = str(value).encode("utf-8")
+            data = b"$%d\r\n%s\r\n" % (len(encoded), encoded)
+        self.wfile.write(data)
+
+    def handle(self):
+        store = self.server.owner
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            name = args[0].upper()
+            handler = getattr(store, f"cmd_{name.lower()}", None)
+            if handler is None:
+                self.wfile.write(f"-ERR unknown command '{name}'\r\n".encode("utf-8"))
+                continue
+            with store.lock:
+                self.reply(handler(*args[1:]))
+
+# In-memory server for the subset of the Redis protocol that shared_state.RedisState uses
+# (GET, SET with PX/NX, DEL, INCRBY, PEXPIRE, SCAN, and EVAL of the counter script), e.g. TIM_SHARED_STATE=redis://127.0.0.1:PORT/0
+class MockRedisServer(LocalServer):
+    def __init__(self, **kwargs):
+        super().__init__(RedisHandler, server_class=ThreadingTCPServer, **kwargs)
+        self.data = {}
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"redis://{self.host}:{self.port}/0"
+
+    def live(self, key):
+        entry = self.data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= time.time():
+            del self.data[key]
+            return None
+        return entry
+
+    def cmd_ping(self, *args):
+        return True
+
+    def cmd_select(self, database):
+        return True
+
+    def cmd_get(self, key):
+        entry = self.live(key)
+        return None if entry is None else entry[0]
+
+    def cmd_set(self, key, value, *options):
+        options = [option.upper() for option in options]
+        if "NX" in options and self.live(key) is not None:
+            return None
+        expires_at = time.time() + int(options[options.index("PX") + 1]) / 1000 if "PX" in options else None
+        self.data[key] = (value, expires_at)
+        return True
+
+    def cmd_del(self, *keys):
+        return sum(self.data.pop(key, None) is not None for key in keys)
+
+    def cmd_incrby(self, key, amount):
+        entry = self.live(key)
+        value = (int(entry[0]) if entry else 0) + int(amount)
+        self.data[key] = (str(value), entry[1] if entry else None)
+        return value
+
+    def cmd_pexpire(self, key, milliseconds):
+        entry = self.live(key)
+        if entry is None:
+            return 0
+        self.data[key] = (entry[0], time.time() + int(milliseconds) / 1000)
+        return 1
+
+    # Only the counter script RedisState.incr sends is understood, run natively rather than as Lua
+    def cmd_eval(self, script, numkeys, *args):
+        if script != REDIS_INCR_SCRIPT:
+            return RuntimeError("ERR only the shared state counter script is supported")
+        key, amount, milliseconds = args
+        value = self.cmd_incrby(key, amount)
+        if int(milliseconds) > 0 and self.live(key)[1] is None:
+            self.cmd_pexpire(key, milliseconds)
+        return value
+
+    def cmd_scan(self, cursor, *options):
+        pattern = options[options.index("MATCH") + 1] if "MATCH" in options else "*"
+        return ["0", [key for key in list(self.data) if fnmatch.fnmatchcase(key, pattern) and self.live(key)]]
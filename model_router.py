@@ -0,0 +1,194 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from metrics import current_tool
+from scheduler import current_priority, priority_context
+from shared_state import shared_state
+
+# Token budgets (override with environment variables; 0 disables a budget)
+SESSION_TOKEN_BUDGET = int(os.environ.get("TIM_SESSION_TOKEN_BUDGET", "200000"))
+GLOBAL_TOKEN_BUDGET = int(os.environ.get("TIM_GLOBAL_TOKEN_BUDGET", "5000000"))
+BATCH_TOKEN_BUDGET = int(os.environ.get("TIM_BATCH_TOKEN_BUDGET", "0"))
+BUDGET_WINDOW_SECONDS = int(os.environ.get("TIM_BUDGET_WINDOW_SECONDS", "86400"))
+ROUTES_FILE = os.environ.get("TIM_MODEL_ROUTES")  # optional JSON file in the same shape as ROUTES
+
+# Routing table: for each tool, rows of [largest input in tokens, model, max output tokens],
+# checked in order; None means no upper bound. Tools without rows of their own use "default".
+# Short snippets go to a cheap, fast model; long inputs (merge prompts, or whole articles when the
+# chunking threshold is raised) go to a long-context model. Rewrites produce roughly as many tokens
+# as they read plus an analysis, so the output budget grows with the input.
+ROUTES = {
+    "default": [
+        [300, "gpt-4.1-nano", 800],
+        [1400, "gpt-4o-mini", 1800],
+        [None, "gpt-4.1-mini", 4000],
+    ],
+    # Annotated copies of the text plus per-sentence explanations need extra room, and labelling
+    # every sentence is too subtle for the smallest model
+    "Fact vs. Opinion Analyzer": [
+        [300, "gpt-4o-mini", 1000],
+        [1400, "gpt-4o-mini", 2600],
+        [None, "gpt-4.1-mini", 4000],
+    ],
+    "Rhetorical Device Highlighter": [
+        [300, "gpt-4o-mini", 1000],
+        [1400, "gpt-4o-mini", 2600],
+        [None, "gpt-4.1-mini", 4000],
+    ],
+}
+
+Route = namedtuple("Route", "tool model max_tokens input_tokens")
+Reservation = namedtuple("Reservation", "route session tokens window")
+
+# Session the current request is charged to (set by the app for each browser session)
+current_session = contextvars.ContextVar("current_session", default=None)
+# Session of headless batch runs: they are charged to a budget of their own instead of the shared
+# one, so an overnight corpus run is not cut off part way by the app's daily limit
+BATCH_RUN = "batch-run"
+
+class BudgetExceeded(Exception):
+    pass
+
+# Function to load the routing table, merging the optional TIM_MODEL_ROUTES file over the defaults
+def load_routes(path=ROUTES_FILE):
+    routes = dict(ROUTES)
+    if path:
+        with open(path, encoding="utf-8") as f:
+            routes.update(json.load(f))
+    return routes
+
+# Context manager that charges the requests made inside it to a session
+@contextmanager
+def session_context(session):
+    token = current_session.set(session)
+    try:
+        yield
+    finally:
+        current_session.reset(token)
+
+# Function to wrap a callable so it runs under the caller's session and priority, e.g. in a worker thread
+def bind_session(fn):
+    session = current_session.get()
+    priority = current_priority.get()
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with session_context(session), priority_context(priority):
+            return fn(*args, **kwargs)
+    return wrapper
+
+# Picks the model and output budget of each request, enforces the per-session and global token
+# budgets over fixed windows, and keeps estimated vs actual token counts per tool and model.
+# Requests reserve their estimated input plus max_tokens up front and settle on the real usage.
+# Budget counters live in the shared state, so with TIM_SHARED_STATE set they hold across processes.
+class ModelRouter:
+    def __init__(self, routes=None, session_budget=SESSION_TOKEN_BUDGET, global_budget=GLOBAL_TOKEN_BUDGET,
+                 window_seconds=BUDGET_WINDOW_SECONDS, state=None, batch_budget=BATCH_TOKEN_BUDGET):
+        self.routes = routes if routes is not None else load_routes()
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.batch_budget = batch_budget
+        self.window_seconds = window_seconds
+        self.state = state if state is not None else shared_state
+        self._lock = threading.Lock()
+        self._report = {}
+
+    # Choose the model and output budget of a request; an explicit max_tokens overrides the table's
+    def route(self, input_tokens, max_tokens=None, tool=None):
+        tool = tool or current_tool.get() or "default"
+        for limit, model, row_max_tokens in self.routes.get(tool) or self.routes["default"]:
+            if limit is None or input_tokens <= limit:
+                break
+        return Route(tool, model, max_tokens or row_max_tokens, input_tokens)
+
+    def _window(self, now):
+        return int(now // self.window_seconds) if self.window_seconds else 0
+
+    def _resets_in(self, now):
+        return (self._window(now) + 1) * self.window_seconds - now if self.window_seconds else 0.0
+
+    # Budgets that apply to a session, as (counter scope, budget, description)
+    def _scopes(self, session):
+        if session == BATCH_RUN:
+            return [(BATCH_RUN, self.batch_budget, "The batch run token budget")]
+        scopes = [("global", self.global_budget, "The shared token budget")]
+        if session:
+            scopes.append((f"session:{session}", self.session_budget, "This session's token budget"))
+        return scopes
+
+    # Reserve the worst-case cost of a request, or raise BudgetExceeded before anything is sent
+    def reserve(self, route):
+        session = current_session.get()
+        tokens = route.input_tokens + route.max_tokens
+        now = time.time()
+        window = self._window(now)
+        ttl = self.window_seconds * 2 or None
+        reserved = []
+        for scope, budget, description in self._scopes(session):
+            committed = self.state.incr(f"budget:{window}:{scope}:committed", tokens, ttl)
+            reserved.append(scope)
+            if budget and committed > budget:
+                for taken in reserved:
+                    self.state.incr(f"budget:{window}:{taken}:committed", -tokens, ttl)
+                raise BudgetExceeded(f"{description} of {budget:,} tokens is used up; "
+                                     f"try again in {self._resets_in(now) / 60:.0f} minutes.")
+        return Reservation(route, session, tokens, window)
+
+    def _unreserve(self, reservation, used):
+        ttl = self.window_seconds * 2 or None
+        for scope, _, _ in self._scopes(reservation.session):
+            prefix = f"budget:{reservation.window}:{scope}"
+            self.state.incr(f"{prefix}:committed", used - reservation.tokens, ttl)
+            if used:
+                self.state.incr(f"{prefix}:used", used, ttl)
+
+    # Replace a reservation with the tokens actually used, and record them against the estimate
+    def settle(self, reservation, tokens_in, tokens_out):
+        route = reservation.route
+        self._unreserve(reservation, tokens_in + tokens_out)
+        with self._lock:
+            row = self._report.setdefault((route.tool, route.model), {
+                "tool": route.tool, "model": route.model, "requests": 0, "estimated_in": 0, "actual_in": 0,
+                "max_tokens": 0, "actual_out": 0,
+            })
+            row["requests"] += 1
+            row["estimated_in"] += route.input_tokens
+            row["actual_in"] += tokens_in
+            row["max_tokens"] += route.max_tokens
+            row["actual_out"] += tokens_out
+
+    # Give back a reservation whose request failed before using any tokens
+    def release(self, reservation):
+        self._unreserve(reservation, 0)
+
+    # Return the tokens used in the current window by a session (or by everyone) against its budget
+    def usage(self, session=None):
+        now = time.time()
+        scope, budget, _ = self._scopes(session)[-1]
+        prefix = f"budget:{self._window(now)}:{scope}"
+        committed = int(self.state.get(f"{prefix}:committed") or 0)
+        used = int(self.state.get(f"{prefix}:used") or 0)
+        return {
+            "used": used,
+            "reserved": max(0, committed - used),
+            "budget": budget,
+            "resets_in": self._resets_in(now),
+        }
+
+    # Return estimated vs actual tokens per tool and model, with the share of the output budget used
+    def report(self):
+        with self._lock:
+            rows = [dict(row) for row in self._report.values()]
+        for row in rows:
+            row["input_error"] = (row["estimated_in"] - row["actual_in"]) / row["actual_in"] if row["actual_in"] else 0.0
+            row["output_used"] = row["actual_out"] / row["max_tokens"] if row["max_tokens"] else 0.0
+        return sorted(rows, key=lambda row: (row["tool"], row["model"]))
+
+# Process-wide router shared by every Streamlit session and worker thread
+router = ModelRouter()
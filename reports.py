@@ -0,0 +1,188 @@
+import csv
+import io
+import json
+import re
+import tempfile
+import time
+import zipfile
+from html import escape
+from string import Template
+
+from text_diff import render_diff_html, summarize_changes
+
+# HTML report rendering and bulk export.
+# Templates are compiled once at import; every value is HTML-escaped before substitution, so
+# article text containing markup cannot break the layout.
+
+DIFF_CSS = """
+    .diff {font-size: 14px; white-space: pre-wrap; word-wrap: break-word;}
+    .diff ins {background-color: #d4f5d0; text-decoration: none;}
+    .diff del {background-color: #f9d0d0; color: #8a1f11;}
+    """
+REPORT_CSS = """
+    body {font-family: Arial, sans-serif; padding: 20px; background-color: #F0F4F8; color: #2C3E50; line-height: 1.6;}
+    h1 {color: #3498DB; text-align: center;}
+    h2 {color: #2C3E50; margin-top: 40px;}
+    .container {display: flex; justify-content: space-between; margin-top: 20px;}
+    .text-box {width: 48%; padding: 15px; background-color: white; border: 1px solid #ddd; border-radius: 8px;}
+    pre {font-size: 14px; white-space: pre-wrap; word-wrap: break-word;}
+    .original {background-color: #eef4ff;}
+    .modified {background-color: #eaf3e8;}
+    .analysis {margin-top: 20px; padding: 15px; background-color: #fff3cd; border-radius: 8px; color: #856404;}
+    .changes {margin-top: 20px; padding: 15px; background-color: white; border: 1px solid #ddd; border-radius: 8px;}
+    """ + DIFF_CSS
+STYLESHEET_NAME = "report.css"
+
+PAGE_TEMPLATE = Template("""<!DOCTYPE html>
+<html>
+<head>
+<meta charset="utf-8">
+<title>$title</title>
+$style
+</head>
+<body>
+<h1>$title</h1>
+$body
+</body>
+</html>
+""")
+
+REPORT_TEMPLATE = Template("""<div class="container">
+    <div class="text-box original">
+        <h2>Original Text</h2>
+        <pre>$original_text</pre>
+    </div>
+    <div class="text-box modified">
+        <h2>$text_label</h2>
+        <pre>$modified_text</pre>
+    </div>
+</div>
+<div class="analysis">
+    <h2>$analysis_label</h2>
+    <pre>$analysis</pre>
+</div>""")
+
+CHANGES_TEMPLATE = Template("""<div class="changes">
+    <h2>Changes</h2>
+    <p>$summary</p>
+    <div class="diff">$diff</div>
+</div>""")
+
+COMBINED_ORIGINAL_TEMPLATE = Template("""<div class="text-box original" style="width: auto;">
+    <h2>Original Text</h2>
+    <pre>$original_text</pre>
+</div>""")
+
+COMBINED_SECTION_TEMPLATE = Template("""<h1>$tool</h1>
+<div class="container">
+    <div class="text-box modified">
+        <h2>$text_label</h2>
+        <pre>$text</pre>
+    </div>
+    <div class="text-box analysis">
+        <h2>$analysis_label</h2>
+        <pre>$analysis</pre>
+    </div>
+</div>""")
+
+INLINE_STYLE = f"<style>{REPORT_CSS}</style>"
+LINKED_STYLE = f'<link rel="stylesheet" href="{STYLESHEET_NAME}">'
+EXPORT_FIELDS = ["id", "created_at", "tool", "source_url", "params", "tokens_in", "tokens_out",
+                 "original_text", "modified_text", "analysis", "changes"]
+
+# Function to fill a template with HTML-escaped values
+def fill(template, **values):
+    return template.substitute({key: escape(str(value)) for key, value in values.items()})
+
+# Function to render one tool report; linked=True references report.css instead of inlining it.
+# Given change statistics (text_diff.change_stats), the report also shows the changes inline.
+def render_report(title, original_text, modified_text, analysis, text_label="Modified Text",
+                  analysis_label="Analysis", linked=False, changes=None):
+    body = fill(REPORT_TEMPLATE, original_text=original_text, modified_text=modified_text, analysis=analysis,
+                text_label=text_label, analysis_label=analysis_label)
+    if changes:
+        # The diff markup escapes the text itself
+        body += "\n" + CHANGES_TEMPLATE.substitute(summary=escape(summarize_changes(changes)),
+                                                   diff=render_diff_html(original_text, modified_text))
+    return PAGE_TEMPLATE.substitute(title=escape(title), style=LINKED_STYLE if linked else INLINE_STYLE, body=body)
+
+# Function to render several tool results over the same original text as one report
+def render_combined_report(title, original_text, results, linked=False):
+    sections = [fill(COMBINED_ORIGINAL_TEMPLATE, original_text=original_text)]
+    sections += [fill(COMBINED_SECTION_TEMPLATE, tool=result["tool"], text_label=result["text_label"],
+                      text=result["text"], analysis_label=result["analysis_label"], analysis=result["analysis"])
+                 for result in results]
+    return PAGE_TEMPLATE.substitute(title=escape(title), style=LINKED_STYLE if linked else INLINE_STYLE,
+                                    body="\n".join(sections))
+
+# Function to make a file-name-safe slug
+def slugify(text, max_length=60):
+    return re.sub(r"[^a-z0-9]+", "-", text.lower()).strip("-")[:max_length] or "report"
+
+# Write-only file object that hands whatever zipfile wrote to the caller in pieces
+class ChunkSink(io.RawIOBase):
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b"".join(self._chunks)
+        self._chunks = []
+        return data
+
+# Generator that builds a ZIP of HTML reports on the fly and yields it in byte chunks.
+# `results` is any iterable of stored results (see ResultStore.get), consumed one at a time;
+# report.css is written once, and the optional JSONL/CSV manifests are spooled to a temporary
+# file rather than kept in memory. The output can be written to a file or a response as it comes.
+def iter_zip_export(results, labels=None, include_jsonl=True, include_csv=True):
+    labels = labels or {}
+    sink = ChunkSink()
+    jsonl = tempfile.SpooledTemporaryFile(max_size=1 << 20, mode="w+", encoding="utf-8")
+    table = tempfile.SpooledTemporaryFile(max_size=1 << 20, mode="w+", encoding="utf-8", newline="")
+    writer = csv.DictWriter(table, fieldnames=EXPORT_FIELDS, extrasaction="ignore")
+    writer.writeheader()
+    with jsonl, table, zipfile.ZipFile(sink, "w", zipfile.ZIP_DEFLATED) as archive:
+        archive.writestr(STYLESHEET_NAME, REPORT_CSS)
+        yield sink.drain()
+        for index, result in enumerate(results, 1):
+            text_label, analysis_label = labels.get(result["tool"], ("Modified Text", "Analysis"))
+            title = f"{result['tool']} - {time.strftime('%Y-%m-%d %H:%M', time.localtime(result['created_at']))}"
+            html = render_report(title, result["original_text"], result["modified_text"], result["analysis"],
+                                 text_label, analysis_label, linked=True, changes=result.get("changes"))
+            archive.writestr(f"{index:05d}-{slugify(result['tool'])}.html", html)
+            row = dict(result, params=result.get("params") or {}, changes=result.get("changes") or None)
+            if include_jsonl:
+                jsonl.write(json.dumps({key: row.get(key) for key in EXPORT_FIELDS}, ensure_ascii=False) + "\n")
+            if include_csv:
+                # CSV cells are flat, so the nested fields are written there as JSON text
+                writer.writerow(dict(row, params=json.dumps(row["params"], ensure_ascii=False),
+                                     changes=json.dumps(row["changes"]) if row["changes"] else None))
+            yield sink.drain()
+        for name, spool, included in (("results.jsonl", jsonl, include_jsonl), ("results.csv", table, include_csv)):
+            if not included:
+                continue
+            spool.seek(0)
+            with archive.open(name, "w") as entry:
+                for block in iter(lambda: spool.read(1 << 16), ""):
+                    entry.write(block.encode("utf-8"))
+                    yield sink.drain()
+    yield sink.drain()
+
+# Function to write a ZIP export to a path or binary file object; returns the number of bytes written
+def write_zip_export(target, results, **kwargs):
+    written = 0
+    handle = open(target, "wb") if isinstance(target, str) else target
+    try:
+        for chunk in iter_zip_export(results, **kwargs):
+            handle.write(chunk)
+            written += len(chunk)
+    finally:
+        if handle is not target:
+            handle.close()
+    return written
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from shared_state import connect_sqlite
+
+# Defaults for the result history (override with environment variables; TIM_RESULT_HISTORY=0 disables)
+RESULT_HISTORY = os.environ.get("TIM_RESULT_HISTORY", "1") != "0"
+DEFAULT_RESULTS_PATH = os.environ.get("TIM_RESULTS_PATH", "./.tim_cache/results.sqlite3")
+PAGE_SIZE = 20
+
+SUMMARY_COLUMNS = "results.id, results.created_at, results.tool, sources.url, results.tokens_in, results.tokens_out"
+
+# Function to hash an original text, which identifies its row in the sources table
+def text_hash(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+# Function to turn free text into an FTS5 query that matches all of its words
+def fts_query(query):
+    return " ".join('"{}"'.format(word.replace('"', '""')) for word in query.split())
+
+# Indexed history of every completed analysis.
+# Each original text is stored once in `sources`; an FTS5 index over a view of results joined
+# with their source makes tool, original, modified text and analysis searchable without a
+# second copy of the text. Older SQLite builds without FTS5 fall back to LIKE.
+class ResultStore:
+    def __init__(self, path=DEFAULT_RESULTS_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = connect_sqlite(path)
+        self._db.row_factory = sqlite3.Row
+        self._db.executescript(
+            "CREATE TABLE IF NOT EXISTS sources ("
+            "hash TEXT PRIMARY KEY, url TEXT, text TEXT NOT NULL);"
+            "CREATE TABLE IF NOT EXISTS results ("
+            "id INTEGER PRIMARY KEY, created_at REAL NOT NULL, tool TEXT NOT NULL, params TEXT NOT NULL, "
+            "source_hash TEXT NOT NULL REFERENCES sources (hash), modified_text TEXT NOT NULL, analysis TEXT NOT NULL, "
+            "tokens_in INTEGER NOT NULL DEFAULT 0, tokens_out INTEGER NOT NULL DEFAULT 0, seconds REAL, changes TEXT);"
+            "CREATE INDEX IF NOT EXISTS results_tool ON results (tool, id);"
+            "CREATE VIEW IF NOT EXISTS result_documents AS "
+            "SELECT results.id AS id, results.tool AS tool, sources.text AS original_text, "
+            "results.modified_text AS modified_text, results.analysis AS analysis "
+            "FROM results JOIN sources ON sources.hash = results.source_hash;"
+        )
+        try:
+            self._db.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS results_fts USING fts5("
+                "tool, original_text, modified_text, analysis, content='result_documents', content_rowid='id')"
+            )
+            self.full_text = True
+        except sqlite3.OperationalError:
+            self.full_text = False
+        self._db.commit()
+
+    # `changes` holds the result's change statistics (see text_diff.change_stats), kept so
+    # reports and exports need not diff the texts again
+    def add(self, tool_name, params, original_text, modified_text, analysis, source_url=None,
+            tokens_in=0, tokens_out=0, seconds=None, changes=None):
+        source_hash = text_hash(original_text)
+        with self._lock:
+            self._db.execute("INSERT OR IGNORE INTO sources (hash, url, text) VALUES (?, ?, ?)",
+                             (source_hash, source_url, original_text))
+            if source_url:
+                self._db.execute("UPDATE sources SET url = ? WHERE hash = ? AND url IS NULL", (source_url, source_hash))
+            cursor = self._db.execute(
+                "INSERT INTO results (created_at, tool, params, source_hash, modified_text, analysis, tokens_in, tokens_out, "
+                "seconds, changes) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), tool_name, json.dumps(params or {}, sort_keys=True), source_hash, modified_text, analysis,
+                 tokens_in, tokens_out, seconds, json.dumps(changes) if changes else None),
+            )
+            if self.full_text:
+                self._db.execute(
+                    "INSERT INTO results_fts (rowid, tool, original_text, modified_text, analysis) VALUES (?, ?, ?, ?, ?)",
+                    (cursor.lastrowid, tool_name, original_text, modified_text, analysis),
+                )
+            self._db.commit()
+            return cursor.lastrowid
+
+    def _where(self, query, tool_name):
+        clauses, args = [], []
+        if query and query.strip():
+            if self.full_text:
+                clauses.append("results.id IN (SELECT rowid FROM results_fts WHERE results_fts MATCH ?)")
+                args.append(fts_query(query))
+            else:
+                clauses.append("(results.modified_text LIKE ? OR results.analysis LIKE ? OR sources.text LIKE ?)")
+                args += [f"%{query.strip()}%"] * 3
+        if tool_name:
+            clauses.append("results.tool = ?")
+            args.append(tool_name)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", args
+
+    # Return one page of result summaries, newest first. Pass the last id of a page as
+    # `before_id` to get the next one, so only the rows on screen are ever loaded.
+    def search(self, query=None, tool_name=None, before_id=None, limit=PAGE_SIZE):
+        where, args = self._where(query, tool_name)
+        if before_id is not None:
+            where += (" AND " if where else " WHERE ") + "results.id < ?"
+            args.append(before_id)
+        with self._lock:
+            rows = self._db.execute(
+                f"SELECT {SUMMARY_COLUMNS}, substr(sources.text, 1, 120) AS preview "
+                f"FROM results JOIN sources ON sources.hash = results.source_hash{where} "
+                "ORDER BY results.id DESC LIMIT ?",
+                args + [limit],
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def count(self, query=None, tool_name=None):
+        where, args = self._where(query, tool_name)
+        with self._lock:
+            return self._db.execute(
+                f"SELECT COUNT(*) FROM results JOIN sources ON sources.hash = results.source_hash{where}", args
+            ).fetchone()[0]
+
+    # Generator over the full matching results, newest first, loaded one page at a time
+    def iter_results(self, query=None, tool_name=None, limit=None):
+        before_id, produced = None, 0
+        while limit is None or produced < limit:
+            rows = self.search(query, tool_name, before_id)
+            if not rows:
+                return
+            for row in rows[:None if limit is None else limit - produced]:
+                yield self.get(row["id"])
+                produced += 1
+            before_id = rows[-1]["id"]
+
+    # Return one full result with its original text, or None
+    def get(self, result_id):
+        with self._lock:
+            row = self._db.execute(
+                "SELECT results.*, sources.url AS source_url, sources.text AS original_text "
+                "FROM results JOIN sources ON sources.hash = results.source_hash WHERE results.id = ?",
+                (result_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        result = dict(row)
+        result["params"] = json.loads(result["params"])
+        result["changes"] = json.loads(result["changes"]) if result["changes"] else None
+        return result
@@ -0,0 +1,225 @@
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from metrics import Histogram, metrics
+
+# Admission limits for OpenAI requests in this process (override with environment variables)
+SCHEDULER_SLOTS = int(os.environ.get("TIM_SCHEDULER_SLOTS", "4"))  # requests at the rate limiter at once
+INTERACTIVE_SLOTS = int(os.environ.get("TIM_INTERACTIVE_SLOTS", "1"))  # slots batch work never takes
+MAX_QUEUED_PER_USER = int(os.environ.get("TIM_MAX_QUEUED_PER_USER", "64"))
+MAX_QUEUED = int(os.environ.get("TIM_MAX_QUEUED", "1000"))
+POSITION_INTERVAL_SECONDS = 0.5  # how often a waiting request reports its queue position
+FINISH_TAGS_KEPT = 1024
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+PRIORITIES = (INTERACTIVE, BATCH)
+UNATTRIBUTED = "-"
+
+# Priority of the requests made by the current thread: clicks in the app are interactive,
+# background jobs and batch runs are batch
+current_priority = contextvars.ContextVar("current_priority", default=INTERACTIVE)
+# (thread id, callback) told the queue position of this thread's waiting requests
+queue_listener = contextvars.ContextVar("queue_listener", default=None)
+
+class QueueFull(Exception):
+    pass
+
+# Context manager that gives the requests made inside it a priority
+@contextmanager
+def priority_context(priority):
+    token = current_priority.set(priority)
+    try:
+        yield
+    finally:
+        current_priority.reset(token)
+
+# Context manager that reports the queue position of requests this thread waits on to
+# listener(position, waiting), and listener(None, 0) once they are sent.
+# Worker threads that inherit the context do not report, so the listener may touch the UI.
+@contextmanager
+def queue_position_listener(listener):
+    token = queue_listener.set((threading.get_ident(), listener))
+    try:
+        yield
+    finally:
+        queue_listener.reset(token)
+
+class Ticket:
+    __slots__ = ("user", "priority", "start", "seq", "admitted", "cancelled")
+
+    def __init__(self, user, priority, start, seq):
+        self.user = user
+        self.priority = priority
+        self.start = start
+        self.seq = seq
+        self.admitted = False
+        self.cancelled = False
+
+# Admission control and fair queuing in front of the OpenAI rate limiter.
+# The API quota is the shared resource, so requests hold a slot only while they wait for the rate
+# limiter: at most `slots` wait there at once, and the rest queue here in a fair order. Interactive
+# requests always go before batch ones, and batch requests never take the last `interactive_slots`
+# slots, so a click waits behind at most a few requests however much batch work is queued. Within
+# each priority, users (sessions) share the quota by start-time fair queuing weighted on estimated
+# tokens: a user with many or large requests queued does not delay a user with one small request.
+# Interactive requests from users over their queue-depth limit, or from anyone when the interactive
+# queue is full, are refused at once with QueueFull; batch requests wait for room instead. When the
+# quota is not exhausted nobody waits.
+class FairScheduler:
+    def __init__(self, slots=SCHEDULER_SLOTS, interactive_slots=INTERACTIVE_SLOTS,
+                 max_queued_per_user=MAX_QUEUED_PER_USER, max_queued=MAX_QUEUED):
+        self.slots = max(1, slots)
+        self.interactive_slots = min(max(0, interactive_slots), self.slots - 1)
+        self.max_queued_per_user = max_queued_per_user
+        self.max_queued = max_queued
+        self.rejected = 0
+        self._cond = threading.Condition()
+        self._queues = {priority: [] for priority in PRIORITIES}  # heaps of (start tag, seq, ticket)
+        self._virtual = dict.fromkeys(PRIORITIES, 0.0)  # start tag of the last request sent
+        self._finish = {}  # (priority, user) -> finish tag of the user's last request
+        self._queued = {}  # (priority, user) -> waiting requests
+        self._waiting = dict.fromkeys(PRIORITIES, 0)
+        self._running = dict.fromkeys(PRIORITIES, 0)
+        self._seq = itertools.count()
+        self._waits = {priority: Histogram() for priority in PRIORITIES}
+
+    # Return why a user's next request of a priority cannot queue yet, or None if it can
+    def _full(self, user, priority):
+        if self._queued.get((priority, user), 0) >= self.max_queued_per_user:
+            return f"You already have {self.max_queued_per_user} requests waiting; try again later."
+        if self._waiting[priority] >= self.max_queued:
+            return "The server is busy; try again later."
+        return None
+
+    # Queue a request (called with the lock held). Interactive requests are refused when there is no room;
+    # batch requests wait until there is.
+    def _submit(self, user, priority, cost):
+        reason = self._full(user, priority)
+        if reason and priority == INTERACTIVE:
+            self.rejected += 1
+            raise QueueFull(reason)
+        while self._full(user, priority):
+            self._cond.wait(POSITION_INTERVAL_SECONDS)
+        if len(self._finish) > FINISH_TAGS_KEPT:
+            self._finish = {key: tag for key, tag in self._finish.items() if tag > self._virtual[key[0]]}
+        start = max(self._virtual[priority], self._finish.get((priority, user), 0.0))
+        self._finish[(priority, user)] = start + max(1, cost)
+        ticket = Ticket(user, priority, start, next(self._seq))
+        heapq.heappush(self._queues[priority], (start, ticket.seq, ticket))
+        self._queued[(priority, user)] = self._queued.get((priority, user), 0) + 1
+        self._waiting[priority] += 1
+        return ticket
+
+    def _dequeued(self, ticket):
+        key = (ticket.priority, ticket.user)
+        self._waiting[ticket.priority] -= 1
+        self._queued[key] -= 1
+        if not self._queued[key]:
+            del self._queued[key]
+
+    def _can_run(self, priority):
+        if sum(self._running.values()) >= self.slots:
+            return False
+        return priority == INTERACTIVE or self._running[BATCH] < self.slots - self.interactive_slots
+
+    # Send as many waiting requests as the free slots allow, interactive ones first
+    def _dispatch(self):
+        for priority in PRIORITIES:
+            queue = self._queues[priority]
+            while queue and self._can_run(priority):
+                start, _, ticket = heapq.heappop(queue)
+                if ticket.cancelled:
+                    continue
+                self._virtual[priority] = start
+                self._running[priority] += 1
+                self._dequeued(ticket)
+                ticket.admitted = True
+            if queue:
+                break
+        self._cond.notify_all()
+
+    # Return a waiting request's 1-based place in line
+    def _position(self, ticket):
+        ahead = sum(1 for _, seq, other in self._queues[ticket.priority]
+                    if not other.cancelled and (other.start, seq) < (ticket.start, ticket.seq))
+        if ticket.priority == BATCH:
+            ahead += self._waiting[INTERACTIVE]
+        return ahead + 1
+
+    # Context manager that holds a slot for one request costing about `cost` tokens, waiting for its turn.
+    # Interactive requests raise QueueFull at once when the queue is too deep; batch ones wait for room.
+    @contextmanager
+    def slot(self, cost, user=None, priority=None):
+        priority = priority or current_priority.get()
+        listener = queue_listener.get()
+        if listener is not None and listener[0] != threading.get_ident():
+            listener = None
+        started = time.monotonic()
+        with self._cond:
+            ticket = self._submit(user or UNATTRIBUTED, priority, cost)
+            self._dispatch()
+        try:
+            reported = False
+            while True:
+                with self._cond:
+                    while listener is None and not ticket.admitted:
+                        self._cond.wait(POSITION_INTERVAL_SECONDS)
+                    if ticket.admitted:
+                        break
+                    position, waiting = self._position(ticket), sum(self._waiting.values())
+                # The listener may take a while (it updates the UI), so it runs without the lock
+                listener[1](position, waiting)
+                reported = True
+                with self._cond:
+                    if not ticket.admitted:
+                        self._cond.wait(POSITION_INTERVAL_SECONDS)
+            if reported:
+                listener[1](None, 0)
+        except BaseException:
+            # The caller gave up (e.g. the page was rerun) before or just as its turn came
+            with self._cond:
+                if ticket.admitted:
+                    self._running[priority] -= 1
+                    self._dispatch()
+                else:
+                    ticket.cancelled = True
+                    self._dequeued(ticket)
+            raise
+        waited = time.monotonic() - started
+        with self._cond:
+            self._waits[priority].observe(waited)
+        metrics.observe("schedule_wait", waited)
+        try:
+            yield waited
+        finally:
+            with self._cond:
+                self._running[priority] -= 1
+                self._dispatch()
+
+    # Return where a user's waiting requests stand: how many, and the best place in line
+    def user_status(self, user):
+        with self._cond:
+            positions = [self._position(ticket) for queue in self._queues.values() for _, _, ticket in queue
+                         if ticket.user == user and not ticket.cancelled]
+            return {"waiting": len(positions), "position": min(positions) if positions else None,
+                    "queued": sum(self._waiting.values())}
+
+    def stats(self):
+        with self._cond:
+            stats = {"slots": self.slots, "rejected": self.rejected,
+                     "users_waiting": len({user for _, user in self._queued})}
+            for priority in PRIORITIES:
+                stats[f"{priority}_running"] = self._running[priority]
+                stats[f"{priority}_waiting"] = self._waiting[priority]
+                for quantile, value in self._waits[priority].percentiles().items():
+                    stats[f"{priority}_wait_p{quantile}"] = value
+            return stats
+
+# Process-wide scheduler shared by every Streamlit session, background job and worker thread
+scheduler = FairScheduler()
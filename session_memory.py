@@ -0,0 +1,162 @@
+import hashlib
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+# Byte budgets for results kept in server memory (override with environment variables)
+SESSION_MEMORY_BYTES = int(os.environ.get("TIM_SESSION_MEMORY_BYTES", str(2 * 1024 * 1024)))
+GLOBAL_MEMORY_BYTES = int(os.environ.get("TIM_GLOBAL_MEMORY_BYTES", str(256 * 1024 * 1024)))
+INTERN_MIN_CHARS = 256  # shorter strings stay in the record itself
+COMPRESS_MIN_BYTES = 4096  # bodies at least this large are stored zlib-compressed
+COMPRESSION_LEVEL = 6
+
+# Function to get the content hash a body is interned under
+def text_digest(text):
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+# Bounded memory for the results of each browser session.
+# Large strings (article text, rewrites, analyses) are interned by content hash, so an article pasted
+# in many sessions is held once, and bodies of COMPRESS_MIN_BYTES or more are kept zlib-compressed.
+# Each session is charged the stored size of the bodies it references; when a session goes over its
+# budget its oldest results are dropped, and when the process goes over the global budget the oldest
+# results of the least recently active sessions go first. A session's newest result is always kept.
+class SessionMemory:
+    def __init__(self, session_budget=SESSION_MEMORY_BYTES, global_budget=GLOBAL_MEMORY_BYTES):
+        self.session_budget = session_budget
+        self.global_budget = global_budget
+        self.evicted = 0
+        self._lock = threading.Lock()
+        self._bodies = {}  # digest -> [stored text or bytes, stored bytes, raw bytes, references]
+        self._sessions = OrderedDict()  # session -> {"results": OrderedDict(key -> record), "refs": {}, "bytes": 0}
+        self._stored_bytes = 0
+        self._raw_bytes = 0
+
+    def _intern(self, text):
+        digest = text_digest(text)
+        body = self._bodies.get(digest)
+        if body is None:
+            data = text.encode("utf-8")
+            raw = len(data)
+            if raw >= COMPRESS_MIN_BYTES:
+                compressed = zlib.compress(data, COMPRESSION_LEVEL)
+                stored = compressed if len(compressed) < raw else text
+            else:
+                stored = text
+            size = len(stored) if isinstance(stored, bytes) else raw
+            body = self._bodies[digest] = [stored, size, raw, 0]
+            self._stored_bytes += size
+            self._raw_bytes += raw
+        body[3] += 1
+        return digest
+
+    def _unintern(self, digest):
+        body = self._bodies[digest]
+        body[3] -= 1
+        if not body[3]:
+            del self._bodies[digest]
+            self._stored_bytes -= body[1]
+            self._raw_bytes -= body[2]
+
+    def _text(self, digest):
+        stored = self._bodies[digest][0]
+        return zlib.decompress(stored).decode("utf-8") if isinstance(stored, bytes) else stored
+
+    def _reference(self, session, digest):
+        count = session["refs"].get(digest, 0)
+        if not count:
+            session["bytes"] += self._bodies[digest][1]
+        session["refs"][digest] = count + 1
+
+    def _dereference(self, session, digest):
+        session["refs"][digest] -= 1
+        if not session["refs"][digest]:
+            del session["refs"][digest]
+            session["bytes"] -= self._bodies[digest][1]
+
+    # Drop one stored result and the bodies nobody else references
+    def _drop(self, session_id, key):
+        session = self._sessions[session_id]
+        record = session["results"].pop(key)
+        for digest in record["bodies"].values():
+            self._dereference(session, digest)
+            self._unintern(digest)
+        if not session["results"]:
+            del self._sessions[session_id]
+
+    def _evict(self, session_id, key):
+        session = self._sessions[session_id]
+        while session["bytes"] > self.session_budget and len(session["results"]) > 1:
+            self._drop(session_id, next(iter(session["results"])))
+            self.evicted += 1
+        while self._stored_bytes > self.global_budget:
+            oldest_session = next(iter(self._sessions))
+            oldest_key = next(iter(self._sessions[oldest_session]["results"]))
+            if (oldest_session, oldest_key) == (session_id, key):
+                break
+            self._drop(oldest_session, oldest_key)
+            self.evicted += 1
+
+    # Keep a result for a session under a key (e.g. the tool name), replacing any earlier one
+    def put(self, session_id, key, fields):
+        with self._lock:
+            if key in self._sessions.get(session_id, {}).get("results", {}):
+                self._drop(session_id, key)
+            session = self._sessions.setdefault(session_id, {"results": OrderedDict(), "refs": {}, "bytes": 0})
+            self._sessions.move_to_end(session_id)
+            record = {"fields": {}, "bodies": {}, "stored_at": time.time()}
+            for name, value in fields.items():
+                if isinstance(value, str) and len(value) >= INTERN_MIN_CHARS:
+                    digest = self._intern(value)
+                    self._reference(session, digest)
+                    record["bodies"][name] = digest
+                else:
+                    record["fields"][name] = value
+            session["results"][key] = record
+            self._evict(session_id, key)
+
+    # Return a session's result for a key with its texts restored, or None if it was never kept or was evicted
+    def get(self, session_id, key):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            record = session["results"].get(key) if session else None
+            if record is None:
+                return None
+            self._sessions.move_to_end(session_id)
+            session["results"].move_to_end(key)
+            fields = dict(record["fields"])
+            fields.update((name, self._text(digest)) for name, digest in record["bodies"].items())
+            return fields
+
+    # Release everything a session holds
+    def forget(self, session_id):
+        with self._lock:
+            for key in list(self._sessions.get(session_id, {}).get("results", ())):
+                self._drop(session_id, key)
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+            self._sessions.clear()
+            self._stored_bytes = self._raw_bytes = 0
+            self.evicted = 0
+
+    # Return memory usage for the whole process, plus one session's share when given
+    def usage(self, session_id=None):
+        with self._lock:
+            usage = {
+                "sessions": len(self._sessions),
+                "results": sum(len(session["results"]) for session in self._sessions.values()),
+                "bodies": len(self._bodies),
+                "stored_bytes": self._stored_bytes,
+                "raw_bytes": self._raw_bytes,
+                "budget": self.global_budget,
+                "evicted": self.evicted,
+            }
+            if session_id is not None:
+                session = self._sessions.get(session_id)
+                usage["session_results"] = len(session["results"]) if session else 0
+                usage["session_bytes"] = session["bytes"] if session else 0
+                usage["session_budget"] = self.session_budget
+            return usage
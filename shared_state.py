@@ -0,0 +1,250 @@
+import os
+import socket
+import sqlite3
+import threading
+import time
+from urllib.parse import unquote, urlparse
+
+# Backend for state shared between app processes (override with TIM_SHARED_STATE):
+#   ""                           this process only (the default; nothing is shared)
+#   sqlite:///.tim_cache/shared.sqlite3   a SQLite file in WAL mode, for processes on one host
+#   redis://host:6379/0          any server speaking the Redis protocol, for several hosts
+SHARED_STATE_URL = os.environ.get("TIM_SHARED_STATE", "")
+SQLITE_BUSY_TIMEOUT_SECONDS = 10.0
+REDIS_KEY_PREFIX = "tim:"
+# Adds to a counter and, if the counter has no expiry yet, sets one, in a single atomic step
+REDIS_INCR_SCRIPT = (
+    "local value = redis.call('INCRBY', KEYS[1], ARGV[1]) "
+    "if tonumber(ARGV[2]) > 0 and redis.call('PTTL', KEYS[1]) == -1 then "
+    "redis.call('PEXPIRE', KEYS[1], ARGV[2]) end "
+    "return value"
+)
+PURGE_EVERY_WRITES = 500
+
+# Function to open a SQLite database that several processes can use at once:
+# WAL lets readers run alongside a writer, and writers wait for the lock instead of failing
+def connect_sqlite(path):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    db = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT_SECONDS)
+    db.execute("PRAGMA journal_mode=WAL")
+    db.execute("PRAGMA synchronous=NORMAL")
+    return db
+
+# Every backend stores string values under string keys and offers the same operations:
+# get, set (with an optional TTL in seconds), add (set only if absent, for locks), delete,
+# incr (atomic, returning the new value; the TTL applies when the key is created) and clear
+# (every key with a prefix).
+
+# In-process backend, used when nothing is shared
+class MemoryState:
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _live(self, key, now):
+        entry = self._data.get(key)
+        if entry is not None and entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry
+
+    def get(self, key):
+        with self._lock:
+            entry = self._live(key, time.time())
+            return None if entry is None else entry[0]
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (str(value), time.time() + ttl if ttl else None)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            now = time.time()
+            if self._live(key, now) is not None:
+                return False
+            self._data[key] = (str(value), now + ttl if ttl else None)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def incr(self, key, amount=1, ttl=None):
+        with self._lock:
+            now = time.time()
+            entry = self._live(key, now)
+            value = (int(entry[0]) if entry else 0) + amount
+            self._data[key] = (str(value), entry[1] if entry else (now + ttl if ttl else None))
+            return value
+
+    def clear(self, prefix=""):
+        with self._lock:
+            for key in [key for key in self._data if key.startswith(prefix)]:
+                del self._data[key]
+
+# SQLite backend: one key-value table in a WAL-mode file that every process on the host opens
+class SQLiteState:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db = connect_sqlite(path)
+        self._db.execute("CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+        self._db.commit()
+
+    def _write(self, query, args):
+        with self._lock:
+            cursor = self._db.execute(query, args)
+            row = cursor.fetchone() if cursor.description else None
+            changed = cursor.rowcount
+            self._writes += 1
+            if self._writes % PURGE_EVERY_WRITES == 0:
+                self._db.execute("DELETE FROM state WHERE expires_at <= ?", (time.time(),))
+            self._db.commit()
+        return row, changed
+
+    def get(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM state WHERE key = ? AND (expires_at IS NULL OR expires_at > ?)",
+                                   (key, time.time())).fetchone()
+        return row[0] if row else None
+
+    def set(self, key, value, ttl=None):
+        self._write("INSERT OR REPLACE INTO state (key, value, expires_at) VALUES (?, ?, ?)",
+                    (key, str(value), time.time() + ttl if ttl else None))
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        _, changed = self._write(
+            "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+            "value = excluded.value, expires_at = excluded.expires_at WHERE state.expires_at <= ?",
+            (key, str(value), now + ttl if ttl else None, now),
+        )
+        return changed == 1
+
+    def delete(self, key):
+        self._write("DELETE FROM state WHERE key = ?", (key,))
+
+    def incr(self, key, amount=1, ttl=None):
+        now = time.time()
+        row, _ = self._write(
+            "INSERT INTO state (key, value, expires_at) VALUES (?, ?, ?) ON CONFLICT (key) DO UPDATE SET "
+            "value = CASE WHEN state.expires_at <= ? THEN excluded.value ELSE CAST(state.value AS INTEGER) + ? END, "
+            "expires_at = CASE WHEN state.expires_at <= ? THEN excluded.expires_at ELSE state.expires_at END "
+            "RETURNING value",
+            (key, str(amount), now + ttl if ttl else None, now, amount, now),
+        )
+        return int(row[0])
+
+    def clear(self, prefix=""):
+        self._write("DELETE FROM state WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+
+class RedisError(Exception):
+    pass
+
+# Redis backend over a minimal RESP client (no extra dependency), one connection per thread.
+# Keys are namespaced with REDIS_KEY_PREFIX so the app can share a server with others.
+class RedisState:
+    def __init__(self, url, timeout=5.0):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.password = unquote(parsed.password) if parsed.password else None
+        self.database = int(parsed.path.strip("/") or 0)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        connection = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        self._local.connection = connection
+        self._local.reader = connection.makefile("rb")
+        if self.password:
+            self._send("AUTH", self.password)
+        if self.database:
+            self._send("SELECT", self.database)
+
+    def _send(self, *args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            data = arg if isinstance(arg, bytes) else str(arg).encode("utf-8")
+            parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+        self._local.connection.sendall(b"".join(parts))
+        return self._read()
+
+    def _read(self):
+        line = self._local.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by the shared state server")
+        kind, payload = line[:1], line[1:-2]
+        if kind == b"+":
+            return payload.decode("utf-8")
+        if kind == b"-":
+            raise RedisError(payload.decode("utf-8"))
+        if kind == b":":
+            return int(payload)
+        if kind == b"$":
+            length = int(payload)
+            if length < 0:
+                return None
+            data = self._local.reader.read(length + 2)[:-2]
+            return data.decode("utf-8")
+        if kind == b"*":
+            length = int(payload)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise RedisError(f"Unexpected reply from the shared state server: {line!r}")
+
+    # Send one command, reconnecting once if the connection has gone away
+    def command(self, *args):
+        for attempt in range(2):
+            try:
+                if getattr(self._local, "connection", None) is None:
+                    self._connect()
+                return self._send(*args)
+            except (OSError, ConnectionError):
+                self._local.connection = None
+                if attempt:
+                    raise
+
+    def get(self, key):
+        return self.command("GET", REDIS_KEY_PREFIX + key)
+
+    def set(self, key, value, ttl=None):
+        expiry = ("PX", int(ttl * 1000)) if ttl else ()
+        self.command("SET", REDIS_KEY_PREFIX + key, value, *expiry)
+
+    def add(self, key, value, ttl=None):
+        expiry = ("PX", int(ttl * 1000)) if ttl else ()
+        return self.command("SET", REDIS_KEY_PREFIX + key, value, "NX", *expiry) == "OK"
+
+    def delete(self, key):
+        self.command("DEL", REDIS_KEY_PREFIX + key)
+
+    def incr(self, key, amount=1, ttl=None):
+        # One script, so a process that dies between the two steps cannot leave a counter that never expires
+        return self.command("EVAL", REDIS_INCR_SCRIPT, 1, REDIS_KEY_PREFIX + key, amount, int(ttl * 1000) if ttl else 0)
+
+    def clear(self, prefix=""):
+        cursor = "0"
+        while True:
+            cursor, keys = self.command("SCAN", cursor, "MATCH", f"{REDIS_KEY_PREFIX}{prefix}*", "COUNT", 500)
+            if keys:
+                self.command("DEL", *keys)
+            if cursor == "0":
+                return
+
+# Function to open the shared state backend named by a TIM_SHARED_STATE-style URL
+def open_state(url=SHARED_STATE_URL):
+    if not url or url == "memory":
+        return MemoryState()
+    scheme = urlparse(url).scheme
+    if scheme == "sqlite":
+        return SQLiteState(url.split(":///", 1)[1] if ":///" in url else url.split("://", 1)[1])
+    if scheme == "redis":
+        return RedisState(url)
+    raise ValueError(f"Unsupported TIM_SHARED_STATE backend: {url}")
+
+# Process-wide backend; SHARED tells whether other processes see it
+shared_state = open_state()
+SHARED = not isinstance(shared_state, MemoryState)
@@ -1,53 +1,144 @@
+import time
+SCRIPT_STARTED = time.perf_counter()
+
 import streamlit as st
+import streamlit.components.v1 as components
 import openai
-import json
 import os
 import random
-from newspaper import Article
-from urllib.parse import urlparse
-from PIL import Image
+import uuid
+from llm_cache import ResponseCache
+from llm_client import client_stats, request_completion, stream_completion
+from article_fetcher import ArticleFetcher, is_url
+from chunking import needs_chunking
+from dedup_index import NEAR_DUPLICATES, DuplicateIndex
+from sweeps import (
+    DEFAULT_VARIABLE_VALUE, MATRIX_CONCURRENCY, MATRIX_MAX_COMBINATIONS, SWEEP_MAX_POINTS, SWEEP_TOKEN_CAP, VARIABLES,
+    expand_grid, expand_matrix, run_points, sweep_table,
+)
+from heuristics import FAST_PATHS
+from job_queue import DONE, FAILED, JobQueue
+from reports import DIFF_CSS, render_combined_report, render_report, write_zip_export
+from result_store import PAGE_SIZE, RESULT_HISTORY, ResultStore
+from metrics import METRICS_FILE, METRICS_PORT, labelled_by_tool, metrics, run_usage, start_http_exporter
+from model_router import current_session, router
+from scheduler import BATCH, QueueFull, priority_context, queue_position_listener, scheduler
+from session_memory import SessionMemory
+from shared_state import SHARED, shared_state
+from variants import run_variants
+from tim_tools import (
+    FANOUT_CONCURRENCY, LOCAL_FAST_PATH, STRUCTURED_OUTPUT, TOOL_PROMPTS, VARIANT_OPTIONS, WHAT_IF_OPTIONS,
+    build_tool_prompt, make_response_parser, merge_fast_path, result_changes, run_tool, run_tools_concurrently, tool_labels,
+    tool_params, tool_scope,
+)
+from text_diff import render_diff_html, summarize_changes
 
 # Constants for the app
 APP_NAME = "Trust In Media (TIM) IQ Playground Toolkit"
-
-# Function to interact with GPT-4 API
-def gpt4_interaction(prompt, max_tokens=1800):
+STREAM_RENDER_INTERVAL = 0.05  # seconds between incremental redraws while streaming
+JOB_POLL_SECONDS = 2  # how often the Background Jobs page refreshes itself
+EXPORT_DIRECTORY = "./.tim_cache/exports"
+EXPORT_MAX_RESULTS = int(os.environ.get("TIM_EXPORT_MAX_RESULTS", "500"))  # cap for exports built in the app
+DIFF_VIEW_HEIGHT = 500  # pixels; the inline change view scrolls beyond this on Streamlit versions without st.html
+LOGO_PATH = "./tim_logo.png"  # Update this path if your logo is located elsewhere
+
+# Function to get the process-wide response cache (shared by all sessions, and with
+# TIM_SHARED_STATE set by all app processes)
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(shared=shared_state if SHARED else None)
+
+# Function to get the process-wide near-duplicate article index, or None when disabled
+@st.cache_resource
+def get_duplicate_index():
+    return DuplicateIndex() if NEAR_DUPLICATES else None
+
+# Function to get the process-wide result history, or None when disabled
+@st.cache_resource
+def get_result_store():
+    return ResultStore() if RESULT_HISTORY else None
+
+# Function to get the process-wide background job queue (jobs outlive reruns and sessions)
+@st.cache_resource
+def get_job_queue():
+    return JobQueue(cache=get_response_cache(), duplicates=get_duplicate_index(), store=get_result_store())
+
+# Function to get the process-wide memory for each session's latest results
+@st.cache_resource
+def get_session_memory():
+    return SessionMemory()
+
+# Tools whose response was rendered in this script run (their last result is not shown again)
+rendered_tools = set()
+
+# Function to get a stable id for this browser session, used as the owner of its jobs
+def session_id():
+    if 'session_id' not in st.session_state:
+        st.session_state['session_id'] = uuid.uuid4().hex
+    return st.session_state['session_id']
+
+# Function to start the process-wide /metrics endpoint once, when TIM_METRICS_PORT is set
+@st.cache_resource
+def start_metrics_exporter():
+    return start_http_exporter(METRICS_PORT) if METRICS_PORT else None
+
+# Function to interact with GPT-4 API (stream=True returns a generator of text deltas)
+def gpt4_interaction(prompt, max_tokens=None, use_cache=None, stream=False, structured=False):
+    if use_cache is None:
+        use_cache = not st.session_state.get('bypass_cache', False)
+    if stream:
+        return gpt4_stream(prompt, max_tokens, use_cache, structured)
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "You are an advanced text analysis,information quality expert, and manipulation assistant."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=max_tokens
-        )
-        return response['choices'][0]['message']['content'].strip()
+        return request_completion(prompt, max_tokens, use_cache, get_response_cache(), structured)
+    except QueueFull as e:
+        st.warning(str(e))
+        return None
     except Exception as e:
         st.error(f"Error interacting with OpenAI: {e}")
         return None
 
-# Function to get text from input (either URL or plain text)
+# Function to stream a GPT-4 response, yielding text deltas as they arrive
+def gpt4_stream(prompt, max_tokens=None, use_cache=True, structured=False):
+    try:
+        yield from stream_completion(prompt, max_tokens, use_cache, get_response_cache(), structured)
+    except QueueFull as e:
+        st.warning(str(e))
+    except Exception as e:
+        st.error(f"Error interacting with OpenAI: {e}")
+
+# Function to get the process-wide article fetcher (shared by all sessions)
+@st.cache_resource
+def get_article_fetcher():
+    return ArticleFetcher()
+
+# Function to get text from input (either URL or plain text, or a list of them)
 def get_text_from_input(input_text):
+    if isinstance(input_text, (list, tuple)):
+        fetcher = get_article_fetcher()
+        urls = [item for item in input_text if is_url(item)]
+        fetched = dict(zip(urls, fetcher.fetch_many(urls)))
+        texts = []
+        for item in input_text:
+            if item not in fetched:
+                texts.append(item)
+                continue
+            text, error = fetched[item]
+            if error is not None:
+                st.error(f"Failed to fetch article from URL {item}: {str(error)}")
+            texts.append(text)
+        return texts
+
+    # Remember where the text came from for the result history
+    st.session_state['source_url'] = input_text if is_url(input_text) else None
     if is_url(input_text):
         try:
-            article = Article(input_text)
-            article.download()
-            article.parse()
-            return article.text
+            return get_article_fetcher().fetch(input_text)
         except Exception as e:
             st.error(f"Failed to fetch article from URL: {str(e)}")
             return None
     else:
         return input_text
 
-# Function to check if input is a URL
-def is_url(text):
-    try:
-        result = urlparse(text)
-        return all([result.scheme, result.netloc])
-    except ValueError:
-        return False
-
 # Function to handle API key input
 def api_key_input():
     st.sidebar.header("API Key Configuration")
@@ -58,13 +149,22 @@ def api_key_input():
         st.sidebar.success("API key set for this session!")
     return api_key
 
+# Function to decode the logo once per process instead of on every rerun
+@st.cache_resource
+def load_logo(path):
+    if not os.path.exists(path):
+        return None
+    from PIL import Image
+    logo_img = Image.open(path)
+    logo_img.load()
+    return logo_img
+
 # Main application
 st.title(APP_NAME)
 
 # Load and display logo
-logo_path = "./tim_logo.png"  # Update this path if your logo is located elsewhere
-if os.path.exists(logo_path):
-    logo_img = Image.open(logo_path)
+logo_img = load_logo(LOGO_PATH)
+if logo_img is not None:
     st.image(logo_img, width=200)
 else:
     st.warning("Logo image not found.")
@@ -78,80 +178,287 @@ if 'api_key' not in st.session_state or not st.session_state['api_key']:
 else:
     openai.api_key = st.session_state['api_key']
 
-# Define the tools
-tools = [
-    "What If? Scenario Analyzer",
-    "Debate Counter-Argument Generator",
-    "Article Neutralizer",
-    "Emotion Amplifier/Reducer",
-    "Narrative Perspective Changer",
-    "Fact vs. Opinion Analyzer",
-    "Information Complexity Mixer",
-    "Rhetorical Device Highlighter",
-    "Cross-Cultural Interpretation Tool",
-    "Variable Adjustment"
-]
-
-# Sidebar for tool selection
-selected_tool = st.sidebar.selectbox("Select a Tool", tools)
-
 # Function definitions for each tool
 
-def save_report_as_html(title, original_text, modified_text, analysis):
-    html_content = f"""
-    <html>
-    <head>
-    <title>{title}</title>
-    <style>
-    body {{font-family: Arial, sans-serif; padding: 20px; background-color: #F0F4F8; color: #2C3E50; line-height: 1.6;}}
-    h1 {{color: #3498DB; text-align: center;}}
-    h2 {{color: #2C3E50; margin-top: 40px;}}
-    .container {{display: flex; justify-content: space-between; margin-top: 20px;}}
-    .text-box {{width: 48%; padding: 15px; background-color: white; border: 1px solid #ddd; border-radius: 8px;}}
-    pre {{font-size: 14px; white-space: pre-wrap; word-wrap: break-word;}}
-    .original {{background-color: #eef4ff;}}
-    .modified {{background-color: #eaf3e8;}}
-    .analysis {{margin-top: 20px; padding: 15px; background-color: #fff3cd; border-radius: 8px; color: #856404;}}
-    </style>
-    </head>
-    <body>
-    <h1>{title}</h1>
-    <div class="container">
-        <div class="text-box original">
-            <h2>Original Text</h2>
-            <pre>{original_text}</pre>
-        </div>
-        <div class="text-box modified">
-            <h2>Modified Text</h2>
-            <pre>{modified_text}</pre>
-        </div>
-    </div>
-    <div class="analysis">
-        <h2>Analysis</h2>
-        <pre>{analysis}</pre>
-    </div>
-    </body>
-    </html>
-    """
-
-    # Create a download button
+# Function to offer one tool report as an HTML download, with the changes inline when their statistics are given
+def save_report_as_html(title, original_text, modified_text, analysis, text_label="Modified Text", analysis_label="Analysis",
+                        changes=None):
     st.download_button(
         label="Download Report as HTML",
-        data=html_content,
+        data=render_report(title, original_text, modified_text, analysis, text_label, analysis_label, changes=changes),
         file_name=f"{title}.html",
         mime="text/html"
     )
 
+# Combined report for several tools run over the same original text
+def save_combined_report_as_html(title, original_text, results):
+    st.download_button(
+        label="Download Combined Report as HTML",
+        data=render_combined_report(title, original_text, results),
+        file_name=f"{title}.html",
+        mime="text/html"
+    )
+
+# Function to summarize what a rewrite changed and show the original with the changes marked inline.
+# Returns the change statistics (None for tools that write new text), computing them unless given.
+def show_changes(tool_name, original_text, text, changes=None):
+    changes = changes or result_changes(tool_name, original_text, text)
+    if not changes:
+        return None
+    st.caption(summarize_changes(changes))
+    with st.expander("Show changes"):
+        markup = f'<style>{DIFF_CSS}</style><div class="diff">{render_diff_html(original_text, text)}</div>'
+        if hasattr(st, "html"):
+            st.html(markup)
+        else:
+            components.html(markup, height=DIFF_VIEW_HEIGHT, scrolling=True)
+    return changes
+
+# Function to record a finished result in the history and session memory and, given its scope, the near-duplicate index
+def record_result(tool_name, params, original_text, text, analysis, scope=None, changes=None):
+    duplicates = get_duplicate_index()
+    if duplicates is not None and scope is not None:
+        duplicates.add(scope, original_text, {"text": text, "analysis": analysis})
+    params = tool_params(tool_name, params)
+    get_session_memory().put(session_id(), tool_name, {"params": params, "original_text": original_text, "text": text,
+                                                      "analysis": analysis, "changes": changes})
+    store = get_result_store()
+    if store is not None:
+        usage = run_usage()
+        store.add(tool_name, params, original_text, text, analysis,
+                  st.session_state.get('source_url'), usage["tokens_in"], usage["tokens_out"], changes=changes)
+
+# Function to stream a tool response into the page, then offer the report download
+@labelled_by_tool
+def render_tool_response(tool_name, original_text, params=None):
+    rendered_tools.add(tool_name)
+    spec = TOOL_PROMPTS[tool_name]
+    text_label = spec.get("text_label", "Modified Text")
+    analysis_label = spec.get("analysis_label", "Analysis")
+    use_cache = not st.session_state.get('bypass_cache', False)
+
+    # In background mode the run becomes a job, so reruns and widget clicks cannot abandon it
+    if st.session_state.get('background_jobs'):
+        job_id = get_job_queue().submit(tool_name, original_text, params, owner=session_id(), use_cache=use_cache,
+                                        source_url=st.session_state.get('source_url'))
+        st.success(f"Queued as job {job_id}. Follow it on the Background Jobs page.")
+        return
+
+    # A near-duplicate of an article already processed with the same settings reuses its result
+    duplicates = get_duplicate_index()
+    scope = tool_scope(tool_name, original_text, params)
+    match = duplicates.find(scope, original_text) if duplicates is not None and use_cache else None
+    if match is not None:
+        stored, score = match
+        st.info(f"Reusing the result for a near-duplicate article ({score:.0%} similar).")
+        st.subheader(text_label)
+        st.write(stored["text"])
+        st.subheader(analysis_label)
+        st.write(stored["analysis"])
+        changes = show_changes(tool_name, original_text, stored["text"])
+        record_result(tool_name, params, original_text, stored["text"], stored["analysis"], changes=changes)
+        save_report_as_html(spec["title"], original_text, stored["text"], stored["analysis"], text_label, analysis_label,
+                            changes)
+        return
+
+    # Clear-cut sentences are labelled locally right away; only the ambiguous ones go to the model
+    local = None
+    prompt_text = original_text
+    if LOCAL_FAST_PATH and tool_name in FAST_PATHS:
+        local = FAST_PATHS[tool_name](original_text)
+        st.subheader("Local Pre-pass")
+        st.caption(f"{local['sentences'] - local['ambiguous']} of {local['sentences']} sentences labelled locally; "
+                   f"{local['ambiguous']} sent to the model.")
+        st.markdown(local["annotated_text"])
+        if not local["ambiguous"]:
+            text, analysis = merge_fast_path(local)
+            st.subheader(analysis_label)
+            st.write(analysis)
+            changes = show_changes(tool_name, original_text, text)
+            record_result(tool_name, params, original_text, text, analysis, scope, changes)
+            save_report_as_html(spec["title"], original_text, text, analysis, text_label, analysis_label, changes)
+            return
+        prompt_text = local["ambiguous_text"]
+
+    # Long articles are rewritten chunk by chunk in parallel instead of streamed as one response
+    if needs_chunking(prompt_text):
+        progress = st.progress(0.0, text="Processing article in parts...")
+        result = run_tool(
+            tool_name, prompt_text, params,
+            use_cache=use_cache,
+            cache=get_response_cache(),
+            on_progress=lambda done, total: progress.progress(done / total, text=f"Processed part {done} of {total}"),
+            fast_path=False,
+        )
+        progress.empty()
+        if result["error"]:
+            st.error(f"Error interacting with OpenAI: {result['error']}")
+            return
+        text, analysis = result["text"], result["analysis"]
+        if local is not None:
+            text, analysis = merge_fast_path(local, text, analysis)
+        st.subheader(text_label)
+        st.write(text)
+        st.subheader(analysis_label)
+        st.write(analysis)
+        changes = show_changes(tool_name, original_text, text)
+        record_result(tool_name, params, original_text, text, analysis, scope, changes)
+        save_report_as_html(spec["title"], original_text, text, analysis, text_label, analysis_label, changes)
+        return
+
+    st.subheader(text_label)
+    text_placeholder = st.empty()
+    analysis_header = st.empty()
+    analysis_placeholder = st.empty()
+
+    parser = make_response_parser(STRUCTURED_OUTPUT)
+    prompt = build_tool_prompt(tool_name, prompt_text, params, STRUCTURED_OUTPUT)
+    received = False
+    last_render = 0.0
+    rendering = 0.0  # time spent parsing and redrawing, recorded as the render stage
+    for delta in gpt4_interaction(prompt, stream=True, structured=STRUCTURED_OUTPUT):
+        received = True
+        started = time.monotonic()
+        if started - last_render < STREAM_RENDER_INTERVAL:
+            parser.feed(delta)
+            rendering += time.monotonic() - started
+            continue
+        text, analysis, found = parser.feed(delta)
+        text_placeholder.write(text)
+        if found:
+            analysis_header.subheader(analysis_label)
+            analysis_placeholder.write(analysis)
+        last_render = time.monotonic()
+        rendering += last_render - started
+
+    if not received:
+        st.error("There was an issue processing the text with the OpenAI API.")
+        return
+
+    started = time.monotonic()
+    text, analysis, found = parser.parts(final=True)
+    text = text.strip()
+    analysis = analysis.strip() if found else f"No separate {analysis_label.lower()} provided."
+    if local is not None:
+        text, analysis = merge_fast_path(local, text, analysis)
+    text_placeholder.write(text)
+    analysis_header.subheader(analysis_label)
+    analysis_placeholder.write(analysis)
+    metrics.observe("render", rendering + time.monotonic() - started)
+
+    changes = show_changes(tool_name, original_text, text)
+    if found:
+        record_result(tool_name, params, original_text, text, analysis, scope, changes)
+
+    # Provide the download button immediately after displaying results
+    save_report_as_html(spec["title"], original_text, text, analysis, text_label, analysis_label, changes)
+
+# Function to show this session's last result of a tool again, e.g. after the report download reruns the page
+def show_last_result(tool_name):
+    result = get_session_memory().get(session_id(), tool_name)
+    if result is None:
+        return
+    spec = TOOL_PROMPTS[tool_name]
+    text_label, analysis_label = tool_labels()[tool_name]
+    st.caption("Last result" + (": " + ", ".join(f"{key}={value}" for key, value in result["params"].items())
+                                if result["params"] else ""))
+    st.subheader(text_label)
+    st.write(result["text"])
+    st.subheader(analysis_label)
+    st.write(result["analysis"])
+    changes = show_changes(tool_name, result["original_text"], result["text"], result["changes"])
+    save_report_as_html(spec["title"], result["original_text"], result["text"], result["analysis"], text_label,
+                        analysis_label, changes)
+
+# Widget labels for the What If? dimensions
+WHAT_IF_LABELS = {
+    "sentiment": "Sentiment:",
+    "context": "Context:",
+    "source": "Source:",
+    "demographic": "Demographic:",
+    "socioeconomic": "Socio-Economic:",
+    "cultural": "Cultural Context:",
+}
+
+# Function to show scenario results as a grid over (at most) the two dimensions that vary
+def render_scenario_grid(rows):
+    varying = [name for name in WHAT_IF_OPTIONS if len({row[name] for row in rows}) > 1]
+    if len(varying) > 2:
+        table = sweep_table(rows)
+        st.dataframe(table)
+        st.download_button("Download Scenarios as CSV", table.to_csv(index=False), "what_if_matrix.csv", "text/csv")
+        return
+
+    row_dim = varying[0] if varying else None
+    col_dim = varying[1] if len(varying) > 1 else None
+    row_values = [value for value in WHAT_IF_OPTIONS[row_dim] if any(r[row_dim] == value for r in rows)] if row_dim else [None]
+    col_values = [value for value in WHAT_IF_OPTIONS[col_dim] if any(r[col_dim] == value for r in rows)] if col_dim else [None]
+    by_cell = {(row.get(row_dim), row.get(col_dim)): row for row in rows}
+
+    for row_value in row_values:
+        if row_dim:
+            st.markdown(f"**{WHAT_IF_LABELS[row_dim]} {row_value}**")
+        for column, col_value in zip(st.columns(len(col_values)), col_values):
+            cell = by_cell.get((row_value if row_dim else None, col_value if col_dim else None))
+            with column:
+                if col_dim:
+                    st.caption(f"{WHAT_IF_LABELS[col_dim]} {col_value}")
+                if cell is None:
+                    continue
+                if cell["error"]:
+                    st.error(cell["error"])
+                    continue
+                st.write(cell["text"])
+                with st.expander("Analysis"):
+                    st.write(cell["analysis"])
+
+# Function to run every option of a tool over one text in as few requests as possible and compare them side by side
+def compare_all_variants(tool_name, input_text):
+    if not input_text:
+        st.warning("Please paste an article or URL into the text area.")
+        return
+
+    options = VARIANT_OPTIONS[tool_name][1]
+    with st.spinner(f"Generating all {len(options)} options..."):
+        original_text = get_text_from_input(input_text)
+        if not original_text:
+            return
+
+        # Fan-outs run at batch priority, so other users' single clicks go first
+        try:
+            with priority_context(BATCH):
+                results, requests = run_variants(
+                    tool_name, original_text,
+                    use_cache=not st.session_state.get('bypass_cache', False),
+                    cache=get_response_cache(),
+                    store=get_result_store(),
+                    source_url=st.session_state.get('source_url'),
+                )
+        except Exception as e:
+            st.error(f"Error interacting with OpenAI: {e}")
+            return
+
+    st.caption(f"Generated {len(results)} options with {requests} request{'s' if requests != 1 else ''}.")
+    for tab, result in zip(st.tabs([str(result["variant"]) for result in results]), results):
+        with tab:
+            if result["error"]:
+                st.error(f"Error interacting with OpenAI: {result['error']}")
+                continue
+            st.subheader(result["text_label"])
+            st.write(result["text"])
+            st.subheader(result["analysis_label"])
+            st.write(result["analysis"])
+            show_changes(tool_name, original_text, result["text"], result.get("changes"))
+
+    completed = [dict(result, tool=f"{tool_name}: {result['variant']}") for result in results if not result["error"]]
+    if completed:
+        save_combined_report_as_html(f"{TOOL_PROMPTS[tool_name]['title']} - All Options", original_text, completed)
+
 def what_if_scenario_analyzer():
     st.header("What If? Scenario Analyzer")
     input_text = st.text_area("Paste an article or URL here:")
 
-    sentiment = st.selectbox("Sentiment:", ["positive", "neutral", "negative"])
-    context = st.selectbox("Context:", ["current", "historical", "future", "economic boom", "economic downturn"])
-    source = st.selectbox("Source:", ["neutral", "left-leaning", "right-leaning", "academic", "tabloid"])
-    demographic = st.selectbox("Demographic:", ["general", "youth", "elderly", "urban", "rural"])
-    socioeconomic = st.selectbox("Socio-Economic:", ["middle class", "upper class", "working class", "unemployed"])
-    cultural = st.selectbox("Cultural Context:", ["mainstream", "conservative", "liberal", "traditional", "modern"])
+    scenario = {name: st.selectbox(label, WHAT_IF_OPTIONS[name]) for name, label in WHAT_IF_LABELS.items()}
 
     if st.button("Apply What If? Scenario"):
         if not input_text:
@@ -163,35 +470,45 @@ def what_if_scenario_analyzer():
             if not original_text:
                 return
 
-            prompt = f"""Original Text: {original_text}
-
-Modify the text based on the following parameters:
-Sentiment: {sentiment}
-Context: {context}
-Source: {source}
-Demographic: {demographic}
-Socio-Economic Background: {socioeconomic}
-Cultural Context: {cultural}
-
-Provide the modified text below, and include a brief analysis of how the information has been manipulated. Separate the modified text and analysis with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    modified_text, analysis = parts
-                else:
-                    modified_text = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Modified Text")
-                st.write(modified_text.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
-
-                # Provide the download button immediately after displaying results
-                save_report_as_html("What If? Scenario Analysis", original_text, modified_text.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+            render_tool_response("What If? Scenario Analyzer", original_text, scenario)
+
+    # Matrix mode: every combination of the chosen values, run concurrently and compared side by side
+    with st.expander("Scenario Matrix"):
+        selections = {
+            name: st.multiselect(label, WHAT_IF_OPTIONS[name], default=[scenario[name]], key=f"matrix_{name}")
+            for name, label in WHAT_IF_LABELS.items()
+        }
+        try:
+            combinations = expand_matrix(selections)
+            st.caption(f"{len(combinations)} scenario combinations (limit {MATRIX_MAX_COMBINATIONS}).")
+        except ValueError as e:
+            combinations = []
+            st.warning(str(e))
+
+        if st.button("Run Scenario Matrix", disabled=not combinations):
+            if not input_text:
+                st.warning("Please paste an article or URL into the text area.")
+                return
+            original_text = get_text_from_input(input_text)
+            if not original_text:
+                return
+
+            progress = st.progress(0.0, text="Running scenarios...")
+            try:
+                with priority_context(BATCH):
+                    rows = run_points(
+                        "What If? Scenario Analyzer", original_text, combinations,
+                        max_workers=MATRIX_CONCURRENCY,
+                        use_cache=not st.session_state.get('bypass_cache', False),
+                        cache=get_response_cache(),
+                        on_progress=lambda done, total: progress.progress(done / total, text=f"Completed {done} of {total} scenarios"),
+                    )
+            except ValueError as e:
+                progress.empty()
+                st.error(str(e))
+                return
+            progress.empty()
+            render_scenario_grid(rows)
 
 def debate_counter_argument_generator():
     st.header("Debate Counter-Argument Generator")
@@ -207,29 +524,7 @@ def debate_counter_argument_generator():
             if not original_text:
                 return
 
-            prompt = f"""Assuming the role of a seasoned debater, create a comprehensive, logically sound, and persuasive counter-narrative to the following text:
-
-{original_text}
-
-Provide a well-structured counter-argument, and include an analysis of the rhetorical techniques and logical fallacies (if any) used in the original text. Separate the counter-argument and analysis with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    counter_argument, analysis = parts
-                else:
-                    counter_argument = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Counter-Argument")
-                st.write(counter_argument.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
-
-                # Provide the download button
-                save_report_as_html("Debate Counter-Argument Report", original_text, counter_argument.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+            render_tool_response("Debate Counter-Argument Generator", original_text)
 
 def article_neutralizer():
     st.header("Article Neutralizer")
@@ -245,38 +540,12 @@ def article_neutralizer():
             if not original_text:
                 return
 
-            prompt = f"""Neutralize the following text by removing any bias, emotional language, or subjective statements. 
-Present only factual information in a neutral tone. If claims are made without evidence, indicate that they are unverified.
-Maintain the overall structure and length of the original text as much as possible.
-After neutralizing the text, provide a brief analysis of what changes were made and why.
-
-Original text:
-{original_text}
-
-Please provide the neutralized version of the text, followed by an analysis of the changes made. Separate the neutralized text and analysis with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    neutralized_text, analysis = parts
-                else:
-                    neutralized_text = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Neutralized Text")
-                st.write(neutralized_text.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
-
-                # Provide the download button
-                save_report_as_html("Text Neutralization Report", original_text, neutralized_text.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+            render_tool_response("Article Neutralizer", original_text)
 
 def emotion_amplifier_reducer():
     st.header("Emotion Amplifier/Reducer")
     input_text = st.text_area("Paste an article or URL here:")
-    emotion_intensity = st.selectbox("Emotion Intensity:", ["amplify", "reduce"])
+    emotion_intensity = st.selectbox("Emotion Intensity:", VARIANT_OPTIONS["Emotion Amplifier/Reducer"][1])
 
     if st.button("Apply Emotion Change"):
         if not input_text:
@@ -288,32 +557,15 @@ def emotion_amplifier_reducer():
             if not original_text:
                 return
 
-            prompt = f"""Original Text: {original_text}
-
-Please rewrite the text with a focus on {emotion_intensity} the emotional intensity. If the text is neutral, make it more emotionally charged, or tone it down to be more analytical. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
+            render_tool_response("Emotion Amplifier/Reducer", original_text, {"emotion_intensity": emotion_intensity})
 
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    modified_text, analysis = parts
-                else:
-                    modified_text = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Modified Text")
-                st.write(modified_text.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
-
-                # Provide the download button
-                save_report_as_html("Emotion Amplifier/Reducer Report", original_text, modified_text.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+    if st.button("Compare Both Intensities"):
+        compare_all_variants("Emotion Amplifier/Reducer", input_text)
 
 def narrative_perspective_changer():
     st.header("Narrative Perspective Changer")
     input_text = st.text_area("Paste an article or URL here:")
-    perspective = st.selectbox("New Perspective:", ["first-person", "third-person", "antagonist", "protagonist"])
+    perspective = st.selectbox("New Perspective:", VARIANT_OPTIONS["Narrative Perspective Changer"][1])
 
     if st.button("Change Perspective"):
         if not input_text:
@@ -325,27 +577,10 @@ def narrative_perspective_changer():
             if not original_text:
                 return
 
-            prompt = f"""Original Text: {original_text}
-
-Please rewrite the text from a {perspective} perspective. Change pronouns, restructure sentences, and adjust the tone to match the new perspective. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    modified_text, analysis = parts
-                else:
-                    modified_text = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Modified Text")
-                st.write(modified_text.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
+            render_tool_response("Narrative Perspective Changer", original_text, {"perspective": perspective})
 
-                # Provide the download button
-                save_report_as_html("Narrative Perspective Changer Report", original_text, modified_text.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+    if st.button("Compare All Perspectives"):
+        compare_all_variants("Narrative Perspective Changer", input_text)
 
 def fact_vs_opinion_analyzer():
     st.header("Fact vs. Opinion Analyzer")
@@ -361,35 +596,12 @@ def fact_vs_opinion_analyzer():
             if not original_text:
                 return
 
-            prompt = f"""Analyze the following text and distinguish between veifiable factual statements and inferred opinions. Isolate and highlight Facts Vs. Opinions. Provide explanations for the categorization.
-
-Original text:
-{original_text}
-
-Please provide the analyzed text with explanations. Separate the analyzed text and explanations with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    analyzed_text, explanations = parts
-                else:
-                    analyzed_text = parts[0]
-                    explanations = "No separate explanations provided."
-                st.subheader("Analyzed Text")
-                st.write(analyzed_text.strip())
-                st.subheader("Explanations")
-                st.write(explanations.strip())
-
-                # Provide the download button
-                save_report_as_html("Fact vs. Opinion Analyzer Report", original_text, analyzed_text.strip(), explanations.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+            render_tool_response("Fact vs. Opinion Analyzer", original_text)
 
 def information_complexity_mixer():
     st.header("Information Complexity Mixer")
     input_text = st.text_area("Paste an article or URL here:")
-    complexity_level = st.selectbox("Complexity Level:", ["simplified", "complexified"])
+    complexity_level = st.selectbox("Complexity Level:", VARIANT_OPTIONS["Information Complexity Mixer"][1])
 
     if st.button("Apply Complexity Change"):
         if not input_text:
@@ -401,27 +613,10 @@ def information_complexity_mixer():
             if not original_text:
                 return
 
-            prompt = f"""Original Text: {original_text}
-
-Please rewrite the text to make it {complexity_level}. Either simplify the content for a general audience or add more complexity and detail. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    modified_text, analysis = parts
-                else:
-                    modified_text = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Modified Text")
-                st.write(modified_text.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
+            render_tool_response("Information Complexity Mixer", original_text, {"complexity_level": complexity_level})
 
-                # Provide the download button
-                save_report_as_html("Information Complexity Mixer Report", original_text, modified_text.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+    if st.button("Compare Both Levels"):
+        compare_all_variants("Information Complexity Mixer", input_text)
 
 def rhetorical_device_highlighter():
     st.header("Rhetorical Device Highlighter")
@@ -437,35 +632,12 @@ def rhetorical_device_highlighter():
             if not original_text:
                 return
 
-            prompt = f"""Analyze the following text for rhetorical devices. Highlight devices like metaphors, similes, hyperbole, etc., and provide explanations on how they impact the reader.
-
-Original text:
-{original_text}
-
-Please provide the highlighted text with explanations. Separate the highlighted text and explanations with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    highlighted_text, explanations = parts
-                else:
-                    highlighted_text = parts[0]
-                    explanations = "No separate explanations provided."
-                st.subheader("Highlighted Text")
-                st.write(highlighted_text.strip())
-                st.subheader("Explanations")
-                st.write(explanations.strip())
-
-                # Provide the download button
-                save_report_as_html("Rhetorical Device Highlighter Report", original_text, highlighted_text.strip(), explanations.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+            render_tool_response("Rhetorical Device Highlighter", original_text)
 
 def cross_cultural_interpretation_tool():
     st.header("Cross-Cultural Interpretation Tool")
     input_text = st.text_area("Paste an article or URL here:")
-    culture = st.selectbox("Culture:", ["Western", "Eastern", "Middle Eastern", "African", "South American"])
+    culture = st.selectbox("Culture:", VARIANT_OPTIONS["Cross-Cultural Interpretation Tool"][1])
 
     if st.button("Apply Cultural Interpretation"):
         if not input_text:
@@ -477,43 +649,17 @@ def cross_cultural_interpretation_tool():
             if not original_text:
                 return
 
-            prompt = f"""Original Text: {original_text}
-
-Please reinterpret the text from the perspective of {culture} culture. Adjust language, idioms, and cultural references to simulate how the text might be perceived in that cultural context. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
+            render_tool_response("Cross-Cultural Interpretation Tool", original_text, {"culture": culture})
 
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    modified_text, analysis = parts
-                else:
-                    modified_text = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Modified Text")
-                st.write(modified_text.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
-
-                # Provide the download button
-                save_report_as_html("Cross-Cultural Interpretation Report", original_text, modified_text.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+    if st.button("Compare All Cultures"):
+        compare_all_variants("Cross-Cultural Interpretation Tool", input_text)
 
 def variable_adjustment():
     st.header("Variable Adjustment Analysis")
     input_text = st.text_area("Paste an article or URL here:")
 
     # Sliders for each variable
-    accuracy = st.slider("Accuracy", 0, 100, 50)
-    completeness = st.slider("Completeness", 0, 100, 50)
-    relevance = st.slider("Relevance", 0, 100, 50)
-    timeliness = st.slider("Timeliness", 0, 100, 50)
-    consistency = st.slider("Consistency", 0, 100, 50)
-    objectivity = st.slider("Objectivity", 0, 100, 50)
-    credibility = st.slider("Credibility", 0, 100, 50)
-    clarity = st.slider("Clarity", 0, 100, 50)
-    accessibility = st.slider("Accessibility", 0, 100, 50)
-    value = st.slider("Value", 0, 100, 50)
+    variables = {name: st.slider(name.title(), 0, 100, DEFAULT_VARIABLE_VALUE) for name in VARIABLES}
 
     if st.button("Analyze with Variables"):
         if not input_text:
@@ -525,51 +671,243 @@ def variable_adjustment():
             if not original_text:
                 return
 
-            prompt = f"""Original Text: {original_text}
-
-Please rewrite the text based on the following criteria adjustments:
-Accuracy: {accuracy}%
-Completeness: {completeness}%
-Relevance: {relevance}%
-Timeliness: {timeliness}%
-Consistency: {consistency}%
-Objectivity: {objectivity}%
-Credibility: {credibility}%
-Clarity: {clarity}%
-Accessibility: {accessibility}%
-Value: {value}%
-
-Modify the text to reflect these adjustments. For example, if accuracy is set to a low percentage, introduce some inaccuracies. If clarity is high, make the text more straightforward and easy to understand.
-
-After rewriting the text, provide a brief analysis of the changes made and how they reflect the adjusted variables.
-
-Separate the rewritten text and the analysis with three dashes (---) on a new line."""
-
-            response = gpt4_interaction(prompt)
-            if response:
-                parts = response.split("\n---\n")
-                if len(parts) == 2:
-                    rewritten_text, analysis = parts
-                else:
-                    rewritten_text = parts[0]
-                    analysis = "No separate analysis provided."
-                st.subheader("Rewritten Text")
-                st.write(rewritten_text.strip())
-                st.subheader("Analysis")
-                st.write(analysis.strip())
-
-                # Provide the download button
-                save_report_as_html("Variable Adjustment Analysis Report", original_text, rewritten_text.strip(), analysis.strip())
-            else:
-                st.error("There was an issue processing the text with the OpenAI API.")
+            render_tool_response("Variable Adjustment", original_text, variables)
+
+    # Sweep mode: a grid over some variables while the others keep their slider values
+    with st.expander("Parameter Sweep"):
+        sweep_variables = st.multiselect("Variables to sweep:", VARIABLES, format_func=str.title)
+        ranges = {}
+        for name in sweep_variables:
+            low, high = st.slider(f"{name.title()} range", 0, 100, (0, 100), key=f"sweep_range_{name}")
+            step = st.number_input(f"{name.title()} step", 1, 100, 10, key=f"sweep_step_{name}")
+            ranges[name] = (low, high, int(step))
+        points = expand_grid(ranges, variables) if ranges else []
+        st.caption(f"{len(points)} unique parameter points (limit {SWEEP_MAX_POINTS}).")
+        token_cap = st.number_input("Token cap for the sweep", 1000, 10_000_000, SWEEP_TOKEN_CAP, step=10000)
+
+        if st.button("Run Sweep"):
+            if not input_text:
+                st.warning("Please paste an article or URL into the text area.")
+                return
+            if not points:
+                st.warning("Please select at least one variable to sweep.")
+                return
+            original_text = get_text_from_input(input_text)
+            if not original_text:
+                return
+
+            progress = st.progress(0.0, text="Running sweep...")
+            try:
+                with priority_context(BATCH):
+                    rows = run_points(
+                        "Variable Adjustment", original_text, points,
+                        use_cache=not st.session_state.get('bypass_cache', False),
+                        cache=get_response_cache(),
+                        token_cap=token_cap,
+                        on_progress=lambda done, total: progress.progress(done / total, text=f"Completed {done} of {total} points"),
+                    )
+            except ValueError as e:
+                progress.empty()
+                st.error(str(e))
+                return
+            progress.empty()
+
+            table = sweep_table(rows)
+            st.dataframe(table)
+            st.download_button(
+                label="Download Sweep as CSV",
+                data=table.to_csv(index=False),
+                file_name="variable_adjustment_sweep.csv",
+                mime="text/csv"
+            )
+
+def run_all_tools():
+    st.header("Run All Tools")
+    input_text = st.text_area("Paste an article or URL here:")
+    tool_names = list(TOOL_PROMPTS)
+    selected = st.multiselect("Tools to run:", tool_names, default=tool_names)
+    max_workers = st.slider("Max concurrent requests", 1, len(tool_names), min(FANOUT_CONCURRENCY, len(tool_names)))
+    st.caption("Each tool runs with its default settings.")
+
+    if st.button("Run Selected Tools"):
+        if not input_text:
+            st.warning("Please paste an article or URL into the text area.")
+            return
+        if not selected:
+            st.warning("Please select at least one tool.")
+            return
+
+        with st.spinner(f"Running {len(selected)} tools..."):
+            original_text = get_text_from_input(input_text)
+            if not original_text:
+                return
+
+            started = time.monotonic()
+            with priority_context(BATCH):
+                results = run_tools_concurrently(
+                    original_text, selected, max_workers,
+                    use_cache=not st.session_state.get('bypass_cache', False),
+                    cache=get_response_cache(),
+                    duplicates=get_duplicate_index(),
+                    store=get_result_store(),
+                    source_url=st.session_state.get('source_url'),
+                )
+            elapsed = time.monotonic() - started
+
+        st.success(f"Completed {len(results)} tools in {elapsed:.1f}s "
+                   f"(slowest single call {max(result['seconds'] for result in results):.1f}s).")
+        for result in results:
+            with st.expander(result["tool"], expanded=False):
+                if result["error"]:
+                    st.error(f"Error interacting with OpenAI: {result['error']}")
+                    continue
+                if result.get("near_duplicate"):
+                    st.caption(f"Reused the result for a near-duplicate article ({result['near_duplicate']:.0%} similar).")
+                st.subheader(result["text_label"])
+                st.write(result["text"])
+                st.subheader(result["analysis_label"])
+                st.write(result["analysis"])
+
+        completed = [result for result in results if not result["error"]]
+        if completed:
+            save_combined_report_as_html("Combined Tool Report", original_text, completed)
+
+# Function to show one finished job's results and report download
+def render_job(job):
+    if job["status"] == FAILED:
+        st.error(f"Error interacting with OpenAI: {job['error']}")
+        return
+    result = job["result"]
+    st.subheader(result["text_label"])
+    st.write(result["text"])
+    st.subheader(result["analysis_label"])
+    st.write(result["analysis"])
+    changes = show_changes(job["tool"], job["original_text"], result["text"], result.get("changes"))
+    save_report_as_html(TOOL_PROMPTS[job["tool"]]["title"], job["original_text"], result["text"], result["analysis"],
+                        result["text_label"], result["analysis_label"], changes)
+
+# Function to list this session's jobs; re-runs on its own every few seconds where Streamlit supports it
+def render_jobs():
+    queue = get_job_queue()
+    jobs = queue.list(session_id())
+    if not jobs:
+        st.info("No background jobs yet. Tick \"Run analyses in background\" in the sidebar, then run any tool.")
+        return
+    st.dataframe([{
+        "Job": job["id"],
+        "Tool": job["tool"],
+        "Status": job["status"],
+        "Queued": time.strftime("%H:%M:%S", time.localtime(job["created_at"])),
+        "Seconds": round((job["finished_at"] or time.time()) - (job["started_at"] or job["created_at"]), 1),
+    } for job in jobs])
+    finished = [job for job in jobs if job["status"] in (DONE, FAILED)]
+    if finished:
+        selected = st.selectbox("Show results for", finished, format_func=lambda job: f"{job['id']} - {job['tool']}")
+        job = queue.get(selected["id"])
+        # Finished jobs beyond the kept limit can be pruned between listing them and reading one
+        if job is None:
+            st.info("This job is no longer available.")
+        else:
+            render_job(job)
+
+if hasattr(st, "fragment"):
+    render_jobs = st.fragment(run_every=JOB_POLL_SECONDS)(render_jobs)
+
+def background_jobs():
+    st.title("Background Jobs")
+    st.write("Analyses queued in the background keep running while you use other tools; their results stay here.")
+    render_jobs()
+    if not hasattr(st, "fragment"):
+        st.button("Refresh")
+
+# History page: full-text search over past results, one page of summaries at a time
+def result_history():
+    st.title("Result History")
+    store = get_result_store()
+    if store is None:
+        st.info("The result history is disabled (TIM_RESULT_HISTORY=0).")
+        return
+    query = st.text_input("Search past analyses:", key='history_query')
+    tool_name = st.selectbox("Tool:", ["All tools"] + list(TOOL_PROMPTS), key='history_tool')
+    tool_name = None if tool_name == "All tools" else tool_name
+
+    # Only the ids that start each page are kept in the session, never the results themselves
+    filters = (query, tool_name)
+    if st.session_state.get('history_filters') != filters:
+        st.session_state['history_filters'] = filters
+        st.session_state['history_pages'] = [None]
+    pages = st.session_state['history_pages']
+    rows = store.search(query, tool_name, before_id=pages[-1])
+    total = store.count(query, tool_name)
+    if not rows:
+        st.info("No matching results.")
+        return
+
+    first = (len(pages) - 1) * PAGE_SIZE + 1
+    st.caption(f"Results {first}-{first + len(rows) - 1} of {total}")
+    selected = st.radio(
+        "Result:", rows, key='history_selected',
+        format_func=lambda row: f"{time.strftime('%Y-%m-%d %H:%M', time.localtime(row['created_at']))} | "
+                                f"{row['tool']} | {row['url'] or row['preview'][:60]}",
+    )
+    newer, older = st.columns(2)
+    if newer.button("Newer", disabled=len(pages) == 1):
+        pages.pop()
+        st.rerun()
+    if older.button("Older", disabled=len(rows) < PAGE_SIZE):
+        pages.append(rows[-1]["id"])
+        st.rerun()
+
+    result = store.get(selected["id"])
+    if result["params"]:
+        st.caption("Settings: " + ", ".join(f"{key}={value}" for key, value in result["params"].items()))
+    if result["tokens_in"] or result["tokens_out"]:
+        st.caption(f"Tokens: {result['tokens_in']} in, {result['tokens_out']} out")
+    spec = TOOL_PROMPTS.get(result["tool"], {})
+    with st.expander("Original Text"):
+        st.write(result["original_text"])
+    st.subheader(spec.get("text_label", "Modified Text"))
+    st.write(result["modified_text"])
+    st.subheader(spec.get("analysis_label", "Analysis"))
+    st.write(result["analysis"])
+    changes = result["changes"]
+    if result["tool"] in TOOL_PROMPTS:
+        changes = show_changes(result["tool"], result["original_text"], result["modified_text"], changes)
+    save_report_as_html(spec.get("title", result["tool"]), result["original_text"], result["modified_text"], result["analysis"],
+                        spec.get("text_label", "Modified Text"), spec.get("analysis_label", "Analysis"), changes)
+    history_export(store, query, tool_name, total)
+
+# Function to export the current history search as a ZIP of reports. The archive is streamed
+# to a file under .tim_cache/exports, so it is only held in memory once, when downloaded.
+def history_export(store, query, tool_name, total):
+    with st.expander("Export"):
+        count = min(total, EXPORT_MAX_RESULTS)
+        st.write(f"Export {count} matching reports as a ZIP (HTML reports plus results.jsonl and results.csv).")
+        if st.button("Prepare ZIP Export"):
+            path = os.path.join(EXPORT_DIRECTORY, f"tim_reports_{session_id()}.zip")
+            os.makedirs(EXPORT_DIRECTORY, exist_ok=True)
+            with st.spinner("Building export..."):
+                write_zip_export(path, store.iter_results(query, tool_name, EXPORT_MAX_RESULTS), labels=tool_labels())
+            st.session_state['history_export'] = path
+        path = st.session_state.get('history_export')
+        if path and os.path.exists(path):
+            with open(path, "rb") as f:
+                st.download_button("Download ZIP Export", f, "tim_reports.zip", "application/zip")
+
+# Background job controls
+def job_queue_panel():
+    st.sidebar.checkbox("Run analyses in background", key='background_jobs')
+    stats = get_job_queue().stats(session_id())
+    if stats["queued"] or stats["running"]:
+        st.sidebar.caption(f"Jobs: {stats['running']} running, {stats['queued']} queued")
 
 # Clear all inputs
 def clear_all():
-    # Clear session state except for the API key
-    api_key = st.session_state.get('api_key')
+    # Clear session state except for the API key and the session id that owns background jobs
+    kept = {key: st.session_state[key] for key in ('api_key', 'session_id') if st.session_state.get(key)}
+    get_session_memory().forget(session_id())
     st.session_state.clear()
-    if api_key:
-        st.session_state['api_key'] = api_key
+    st.session_state.update(kept)
     st.rerun()
 
 # Fun Fact Function
@@ -588,28 +926,127 @@ def show_fun_fact():
     ]
     st.info(random.choice(facts))
 
-# Tool selection logic
-if selected_tool == "What If? Scenario Analyzer":
-    what_if_scenario_analyzer()
-elif selected_tool == "Debate Counter-Argument Generator":
-    debate_counter_argument_generator()
-elif selected_tool == "Article Neutralizer":
-    article_neutralizer()
-elif selected_tool == "Emotion Amplifier/Reducer":
-    emotion_amplifier_reducer()
-elif selected_tool == "Narrative Perspective Changer":
-    narrative_perspective_changer()
-elif selected_tool == "Fact vs. Opinion Analyzer":
-    fact_vs_opinion_analyzer()
-elif selected_tool == "Information Complexity Mixer":
-    information_complexity_mixer()
-elif selected_tool == "Rhetorical Device Highlighter":
-    rhetorical_device_highlighter()
-elif selected_tool == "Cross-Cultural Interpretation Tool":
-    cross_cultural_interpretation_tool()
-elif selected_tool == "Variable Adjustment":
-    variable_adjustment()
+# Response cache controls
+def response_cache_panel():
+    st.sidebar.checkbox("Bypass response cache", key='bypass_cache')
+    with st.sidebar.expander("Response Cache"):
+        stats = get_response_cache().stats()
+        st.write(f"Hits: {stats['hits']} (memory {stats['memory_hits']}, disk {stats['disk_hits']})")
+        st.write(f"Misses: {stats['misses']}")
+        st.write(f"Hit rate: {stats['hit_rate']:.0%}")
+        st.write(f"Entries: {stats['memory_entries']} in memory, {stats['disk_entries']} on disk")
+        article_stats = get_article_fetcher().stats()
+        st.write(f"Articles: {article_stats['entries']} cached, {article_stats['hits']} hits, "
+                 f"{article_stats['revalidated']} revalidated, {article_stats['misses']} fetched")
+        memory = get_session_memory().usage(session_id())
+        st.write(f"Session memory: {memory['session_bytes'] / 1024:.0f} KB of {memory['session_budget'] / 1024:.0f} KB "
+                 f"here; {memory['stored_bytes'] / 2**20:.1f} MB of {memory['budget'] / 2**20:.0f} MB for "
+                 f"{memory['sessions']} sessions ({memory['raw_bytes'] / 2**20:.1f} MB uncompressed)")
+        client = client_stats()
+        st.write(f"API client: {client['retries']} retries, {client['coalesced']} coalesced, "
+                 f"{client['throttled']} throttled, rate at {client['scale']:.0%}")
+        duplicates = get_duplicate_index()
+        if duplicates is not None:
+            duplicate_stats = duplicates.stats()
+            st.write(f"Near-duplicates: {duplicate_stats['hits']} reused, {duplicate_stats['entries']} articles indexed")
+        if st.button("Clear Response Cache"):
+            get_response_cache().clear()
+            get_article_fetcher().clear()
+            if duplicates is not None:
+                duplicates.clear()
+
+# Sidebar panel with this session's token budget
+def token_budget_panel():
+    usage = router.usage(session_id())
+    if not usage["budget"]:
+        return
+    used = usage["used"] + usage["reserved"]
+    st.sidebar.progress(min(1.0, used / usage["budget"]))
+    st.sidebar.caption(f"Tokens used: {used:,} of {usage['budget']:,} "
+                       f"(resets in {usage['resets_in'] / 3600:.1f}h)")
+
+# Sidebar line showing where this session's queued requests (e.g. from background jobs) stand
+def queue_status_panel():
+    status = scheduler.user_status(session_id())
+    if status["waiting"]:
+        st.sidebar.caption(f"Requests waiting: {status['waiting']}, next at position {status['position']} "
+                           f"of {status['queued']}")
+
+# Admin panel with per-stage latency percentiles and per-tool token usage
+def metrics_panel():
+    with st.sidebar.expander("Metrics"):
+        snapshot = metrics.snapshot()
+        if not snapshot["latency"]:
+            st.write("No requests recorded yet.")
+            return
+        st.write("Stage latency (seconds)")
+        st.dataframe(snapshot["latency"])
+        st.write("Requests and tokens per tool")
+        st.dataframe(snapshot["usage"])
+        st.write("Estimated vs actual tokens per route")
+        st.dataframe(router.report())
+        st.write("Request scheduler")
+        st.json(scheduler.stats())
+        st.write("Session memory")
+        st.json(get_session_memory().usage())
+        st.download_button("Download Prometheus Metrics", metrics.to_prometheus(), "tim_metrics.prom", "text/plain")
+        st.download_button("Download JSONL Snapshot", metrics.to_jsonl(), "tim_metrics.jsonl", "application/json")
+        if st.button("Reset Metrics"):
+            metrics.reset()
+
+# Tool pages, in sidebar order
+TOOL_PAGES = {
+    "What If? Scenario Analyzer": what_if_scenario_analyzer,
+    "Debate Counter-Argument Generator": debate_counter_argument_generator,
+    "Article Neutralizer": article_neutralizer,
+    "Emotion Amplifier/Reducer": emotion_amplifier_reducer,
+    "Narrative Perspective Changer": narrative_perspective_changer,
+    "Fact vs. Opinion Analyzer": fact_vs_opinion_analyzer,
+    "Information Complexity Mixer": information_complexity_mixer,
+    "Rhetorical Device Highlighter": rhetorical_device_highlighter,
+    "Cross-Cultural Interpretation Tool": cross_cultural_interpretation_tool,
+    "Variable Adjustment": variable_adjustment,
+    "Run All Tools": run_all_tools,
+    "Background Jobs": background_jobs,
+    "Result History": result_history,
+}
+
+start_metrics_exporter()
+# Charge this session's requests, including those made from worker threads, to its token budget
+current_session.set(session_id())
+
+# Sidebar for tool selection
+selected_tool = st.sidebar.selectbox("Select a Tool", list(TOOL_PAGES))
+# While this run's requests wait for the model, the sidebar shows their place in the queue
+queue_position = st.sidebar.empty()
+
+# Function to show (or, given None, clear) the place in the queue of a request this run waits on
+def show_queue_position(position, waiting):
+    if position is None:
+        queue_position.empty()
+    else:
+        queue_position.info(f"Busy: your request is number {position} of {waiting} in the queue.")
+
+with queue_position_listener(show_queue_position):
+    TOOL_PAGES[selected_tool]()
+if selected_tool in TOOL_PROMPTS and selected_tool not in rendered_tools:
+    show_last_result(selected_tool)
+
+job_queue_panel()
+queue_status_panel()
+token_budget_panel()
+response_cache_panel()
 
 # Add Clear All and Fun Fact buttons
 st.sidebar.button("Clear All", on_click=clear_all)
-st.sidebar.button("Show Fun Fact", on_click=show_fun_fact)
\ No newline at end of file
+st.sidebar.button("Show Fun Fact", on_click=show_fun_fact)
+
+# Admin metrics panel, enable with TIM_ADMIN=1
+if os.environ.get("TIM_ADMIN"):
+    metrics_panel()
+if METRICS_FILE:
+    metrics.write(METRICS_FILE)
+
+# Optional per-rerun timing, enable with TIM_SHOW_TIMINGS=1
+if os.environ.get("TIM_SHOW_TIMINGS"):
+    st.sidebar.caption(f"Script run: {(time.perf_counter() - SCRIPT_STARTED) * 1000:.0f} ms")
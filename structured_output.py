@@ -0,0 +1,174 @@
+import json
+
+# Function-calling schema the model fills in instead of separating its answer with "---"
+RESULT_FUNCTION = {
+    "name": "submit_result",
+    "description": "Submit the rewritten or analyzed text together with the analysis of the changes.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "text": {"type": "string", "description": "The modified, rewritten or annotated text."},
+            "analysis": {"type": "string", "description": "The analysis or explanations."},
+        },
+        "required": ["text", "analysis"],
+    },
+}
+
+# Function-calling schema for several variants of one tool answered in a single request
+VARIANTS_FUNCTION = {
+    "name": "submit_variants",
+    "description": "Submit one rewritten text and analysis per requested variant, in the order they were requested.",
+    "parameters": {
+        "type": "object",
+        "properties": {
+            "variants": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "variant": {"type": "string", "description": "The option this entry was written for."},
+                        "text": {"type": "string", "description": "The modified or rewritten text for this option."},
+                        "analysis": {"type": "string", "description": "The analysis of the changes for this option."},
+                    },
+                    "required": ["variant", "text", "analysis"],
+                },
+            },
+        },
+        "required": ["variants"],
+    },
+}
+
+ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+# Function to ask for the structured result in a tool prompt
+def build_structured_prompt(prompt, text_label="Modified Text", analysis_label="Analysis"):
+    return f"""{prompt}
+
+Instead of separating them with three dashes, return your answer by calling the {RESULT_FUNCTION["name"]} function with the {text_label.lower()} in "text" and the {analysis_label.lower()} in "analysis"."""
+
+# Tolerant incremental parser for the streamed function-call arguments.
+# It has the same feed()/parts() interface as ResponseSplitter, reads string fields as soon as their
+# characters arrive, survives escapes split across deltas, and hands plain-text replies to the
+# "---" splitter.
+class StructuredResponseParser:
+    def __init__(self, fallback):
+        self.buffer = ""
+        self.fallback = fallback
+        self.plain_text = False
+        self._fields = {}
+        self._key = []
+        self._state = "start"
+        self._escape = None
+        self._depth = 0
+        self._pos = 0
+
+    def feed(self, delta):
+        self.buffer += delta
+        if self.plain_text:
+            return self.fallback.feed(delta)
+        self._advance()
+        if self.plain_text:
+            return self.fallback.feed(self.buffer)
+        return self.parts()
+
+    def _append(self, chars):
+        if self._state == "key":
+            self._key.append(chars)
+        else:
+            self._fields["".join(self._key)].append(chars)
+
+    def _advance(self):
+        buffer = self.buffer
+        pos = self._pos
+        while pos < len(buffer):
+            ch = buffer[pos]
+            pos += 1
+            if self._escape is not None:
+                self._escape += ch
+                if self._escape[0] == "u":
+                    if len(self._escape) < 5:
+                        continue
+                    try:
+                        self._append(chr(int(self._escape[1:], 16)))
+                    except ValueError:
+                        pass
+                else:
+                    self._append(ESCAPES.get(ch, ch))
+                self._escape = None
+                continue
+
+            state = self._state
+            if state == "start":
+                if ch == "{":
+                    self._state = "key_or_end"
+                elif ch == "`":
+                    self._state = "fence"
+                elif not ch.isspace():
+                    # The model answered in prose; let the "---" splitter handle it
+                    self.plain_text = True
+                    break
+            elif state == "fence":
+                # Skip a markdown code fence such as ```json up to the end of its line
+                if ch == "\n":
+                    self._state = "start"
+            elif state == "key_or_end":
+                if ch == '"':
+                    self._state = "key"
+                    self._key = []
+                elif ch == "}":
+                    self._state = "done"
+            elif state in ("key", "string"):
+                if ch == "\\":
+                    self._escape = ""
+                elif ch == '"':
+                    self._state = "colon" if state == "key" else "key_or_end"
+                else:
+                    self._append(ch)
+            elif state == "colon":
+                if ch == ":":
+                    self._state = "value"
+            elif state == "value":
+                if ch == '"':
+                    self._fields["".join(self._key)] = []
+                    self._state = "string"
+                elif ch in "{[":
+                    self._depth = 1
+                    self._state = "nested"
+                elif ch == ",":
+                    self._state = "key_or_end"
+                elif ch == "}":
+                    self._state = "done"
+            elif state == "nested":
+                if ch == '"':
+                    self._state = "nested_string"
+                elif ch in "{[":
+                    self._depth += 1
+                elif ch in "}]":
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._state = "key_or_end"
+            elif state == "nested_string":
+                # Brackets and escaped quotes inside a nested string do not change the depth
+                if ch == "\\":
+                    self._state = "nested_escape"
+                elif ch == '"':
+                    self._state = "nested"
+            elif state == "nested_escape":
+                self._state = "nested_string"
+        self._pos = pos
+
+    def parts(self, final=False):
+        if self.plain_text or (final and self._state in ("start", "fence")):
+            return self.fallback.parts(final)
+        fields = {key: "".join(value) for key, value in self._fields.items()}
+        if final:
+            # Prefer a strict parse of the complete arguments when it succeeds
+            start, end = self.buffer.find("{"), self.buffer.rfind("}")
+            try:
+                parsed = json.loads(self.buffer[start:end + 1]) if 0 <= start < end else None
+                if isinstance(parsed, dict):
+                    fields = {key: value for key, value in parsed.items() if isinstance(value, str)}
+            except ValueError:
+                pass
+        analysis = fields.get("analysis", "")
+        return fields.get("text", ""), analysis, "analysis" in fields and (not final or bool(analysis.strip()))
@@ -0,0 +1,122 @@
+import itertools
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from model_router import SESSION_TOKEN_BUDGET, bind_session, current_session, router
+from tim_tools import WHAT_IF_OPTIONS, run_tool, tool_routes
+
+# Limits for parameter sweeps (override with environment variables)
+SWEEP_MAX_POINTS = int(os.environ.get("TIM_SWEEP_MAX_POINTS", "121"))
+SWEEP_CONCURRENCY = int(os.environ.get("TIM_SWEEP_CONCURRENCY", "6"))
+# A sweep can never use more than one session's budget, so the cap defaults to no more than that
+SWEEP_TOKEN_CAP = int(os.environ.get("TIM_SWEEP_TOKEN_CAP", str(min(500000, SESSION_TOKEN_BUDGET or 500000))))
+MATRIX_MAX_COMBINATIONS = int(os.environ.get("TIM_MATRIX_MAX_COMBINATIONS", "50"))
+MATRIX_CONCURRENCY = int(os.environ.get("TIM_MATRIX_CONCURRENCY", "16"))
+
+# The ten Variable Adjustment sliders, as prompt builder parameter names
+VARIABLES = [
+    "accuracy", "completeness", "relevance", "timeliness", "consistency",
+    "objectivity", "credibility", "clarity", "accessibility", "value",
+]
+DEFAULT_VARIABLE_VALUE = 50
+
+WORD = re.compile(r"\w+")
+SENTENCE = re.compile(r"[.!?]+(?:\s|$)")
+
+# Function to turn a (start, stop, step) range or an explicit list into sweep values
+def sweep_values(spec):
+    if isinstance(spec, tuple) and len(spec) == 3:
+        start, stop, step = spec
+        if step <= 0:
+            raise ValueError("Sweep step must be positive.")
+        values = list(range(start, stop + 1, step))
+        return values if values and values[-1] == stop else values + [stop]
+    return list(spec)
+
+# Function to expand per-variable ranges into unique parameter points, clamped to 0-100
+def expand_grid(ranges, base=None):
+    base = dict({name: DEFAULT_VARIABLE_VALUE for name in VARIABLES}, **(base or {}))
+    names = list(ranges)
+    points, seen = [], set()
+    for combination in itertools.product(*(sweep_values(ranges[name]) for name in names)):
+        point = dict(base, **{name: max(0, min(100, int(round(value)))) for name, value in zip(names, combination)})
+        key = tuple(sorted(point.items()))
+        if key not in seen:
+            seen.add(key)
+            points.append(point)
+    return points
+
+# Function to expand chosen What If? values per dimension into scenario combinations, under a hard cap
+def expand_matrix(selections, max_combinations=MATRIX_MAX_COMBINATIONS):
+    values = []
+    for name, options in WHAT_IF_OPTIONS.items():
+        chosen = [option for option in options if option in selections.get(name, ())] or options[:1]
+        values.append(chosen)
+    total = 1
+    for chosen in values:
+        total *= len(chosen)
+    if total > max_combinations:
+        raise ValueError(f"The scenario matrix has {total} combinations; the limit is {max_combinations}.")
+    return [dict(zip(WHAT_IF_OPTIONS, combination)) for combination in itertools.product(*values)]
+
+# Function to estimate the tokens a sweep will use before running it: every request of every point
+# (each chunk of a long article, and the merge of their analyses) at its worst-case cost
+def estimate_sweep_tokens(tool_name, original_text, points):
+    return sum(route.input_tokens + route.max_tokens
+               for point in points for route in tool_routes(tool_name, original_text, point))
+
+# Function to score a rewrite against the original with cheap local metrics
+def score_output(original_text, text):
+    original_words = WORD.findall(original_text.lower())
+    words = WORD.findall(text.lower())
+    original_set, word_set = set(original_words), set(words)
+    union = original_set | word_set
+    sentences = max(1, len(SENTENCE.findall(text)))
+    return {
+        "length_ratio": len(words) / len(original_words) if original_words else 0.0,
+        "word_overlap": len(original_set & word_set) / len(union) if union else 1.0,
+        "avg_sentence_words": len(words) / sentences,
+    }
+
+# Function to run one tool over every parameter point concurrently, under a point and token cap
+def run_points(tool_name, original_text, points, max_workers=SWEEP_CONCURRENCY, use_cache=True, cache=None,
+               max_points=SWEEP_MAX_POINTS, token_cap=SWEEP_TOKEN_CAP, on_progress=None):
+    if len(points) > max_points:
+        raise ValueError(f"The sweep has {len(points)} points; the limit is {max_points}.")
+    estimated = estimate_sweep_tokens(tool_name, original_text, points)
+    if estimated > token_cap:
+        raise ValueError(f"The sweep would use about {estimated:,} tokens; the cap is {token_cap:,}.")
+    # Refuse up front rather than fail part way once the session or shared budget runs out
+    session = current_session.get()
+    budgets = [(router.usage(), "the shared")]
+    if session is not None:
+        budgets.insert(0, (router.usage(session), "this session's"))
+    for usage, description in budgets:
+        remaining = usage["budget"] - usage["used"] - usage["reserved"]
+        if usage["budget"] and estimated > remaining:
+            raise ValueError(f"The sweep would use about {estimated:,} tokens, but {description} token budget has "
+                             f"only {max(0, remaining):,} left; try again in {usage['resets_in'] / 60:.0f} minutes "
+                             f"or with fewer points.")
+
+    def run_one(point):
+        result = run_tool(tool_name, original_text, point, use_cache=use_cache, cache=cache)
+        row = dict(point)
+        row.update(text=result["text"], analysis=result["analysis"], error=result["error"], seconds=result["seconds"])
+        if not result["error"]:
+            row.update(score_output(original_text, result["text"]))
+        return row
+
+    rows = [None] * len(points)
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = [executor.submit(bind_session(run_one), point) for point in points]
+        for index, future in enumerate(futures):
+            rows[index] = future.result()
+            if on_progress is not None:
+                on_progress(sum(f.done() for f in futures), len(futures))
+    return rows
+
+# Function to turn sweep rows into a tidy pandas DataFrame (pandas ships with Streamlit)
+def sweep_table(rows):
+    import pandas as pd
+    return pd.DataFrame(rows)
@@ -0,0 +1,24 @@
+from dedup_index import DuplicateIndex, fact_digest, make_scope
+
+ARTICLE = " ".join(f"The council met for hearing {index} on the transit budget and heard from residents at length."
+                   for index in range(20)) + " Fares will rise 3 percent next year."
+
+def test_near_duplicates_reuse_the_stored_result(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "near.sqlite3"))
+    scope = make_scope("gpt-4o-mini", "Tool", {})
+    index.add(scope, ARTICLE, {"text": "result"})
+    result, score = index.find(scope, "By a staff writer. " + ARTICLE)
+    assert result == {"text": "result"} and score >= index.threshold
+    assert index.find(make_scope("gpt-4o", "Tool", {}), ARTICLE) is None
+
+def test_changed_numbers_or_negations_are_never_reused(tmp_path):
+    index = DuplicateIndex(str(tmp_path / "near.sqlite3"))
+    scope = make_scope("Tool")
+    index.add(scope, ARTICLE, {"text": "result"})
+    assert index.find(scope, ARTICLE.replace("3 percent", "30 percent")) is None
+    assert index.find(scope, ARTICLE.replace("will rise", "will not rise")) is None
+    assert index.find(scope, ARTICLE.replace("will rise", "won’t rise")) is None
+
+def test_fact_digest_ignores_wording_but_not_facts():
+    assert fact_digest("Sales rose 1,200 units.") == fact_digest("Sales climbed by 1200 units!")
+    assert fact_digest("It did not pass.") != fact_digest("It did pass.")
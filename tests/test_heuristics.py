@@ -0,0 +1,66 @@
+from heuristics import MODEL_REVIEW_MARKER, classify_fact_opinion, highlight_rhetorical_devices, split_sentences
+
+# Function to get {sentence: local label or None} from a pre-pass result
+def labels(result):
+    labelled = {}
+    for line in result["annotated_text"].split("\n\n"):
+        if line.startswith(MODEL_REVIEW_MARKER):
+            labelled[line[len(MODEL_REVIEW_MARKER) + 1:]] = None
+        else:
+            label, sentence = line[3:].split("]** ", 1)
+            labelled[sentence] = label
+    return labelled
+
+def test_split_sentences_keeps_abbreviations_and_offsets():
+    text = "Mr. Smith moved to the U.S. in 1990. Did he stay?\n\nYes! He works at Acme Corp. today."
+    sentences, starts = split_sentences(text)
+    assert sentences == ["Mr. Smith moved to the U.S. in 1990.", "Did he stay?", "Yes!",
+                         "He works at Acme Corp. today."]
+    assert [text[start:start + len(sentence)] for sentence, start in zip(sentences, starts)] == sentences
+
+def test_split_sentences_of_empty_text():
+    sentences, starts = split_sentences("  \n ")
+    assert sentences == [] and len(starts) == 0
+
+def test_fact_opinion_labels_only_clear_cases():
+    result = labels(classify_fact_opinion(
+        "Clearly, this is a terrible plan. According to the report, ridership grew 8 percent in 2023. "
+        "The mayor said the plan was disastrous and cost 3 million. I think it rained. The council met."))
+    assert result == {
+        "Clearly, this is a terrible plan.": "Opinion",
+        "According to the report, ridership grew 8 percent in 2023.": "Fact",
+        # Cues on both sides, or too few, go to the model
+        "The mayor said the plan was disastrous and cost 3 million.": None,
+        "I think it rained.": None,
+        "The council met.": None,
+    }
+
+def test_fact_opinion_counts_ambiguous_sentences():
+    result = classify_fact_opinion("The council met. It was sunny.")
+    assert result["sentences"] == 2 and result["ambiguous"] == 2
+    assert result["ambiguous_text"] == "The council met.\nIt was sunny."
+    assert result["explanations"] == ""
+
+def test_rhetorical_devices_leave_literal_sentences_to_the_model():
+    result = labels(highlight_rhetorical_devices(
+        "He has never visited Paris. It looks like the vote will pass on Tuesday. When will the bridge open? "
+        "The mayor said the plan was a dagger to the heart of the city, costing 3 million. "
+        "Prices rose as much as a third."))
+    assert set(result.values()) == {None}
+
+def test_rhetorical_devices_label_high_precision_patterns():
+    result = labels(highlight_rhetorical_devices(
+        "Her voice was as cold as an iceberg.\n\n"
+        "We will build roads. We will build schools. We will build hope.\n\n"
+        "Who could blame them?"))
+    assert result["Her voice was as cold as an iceberg."] == "Simile"
+    assert result["We will build schools."] == "Repetition"
+    assert result["Who could blame them?"] == "Rhetorical question"
+
+def test_answered_questions_are_not_rhetorical():
+    result = labels(highlight_rhetorical_devices("Who could blame them? Nobody did."))
+    assert set(result.values()) == {None}
+
+def test_quoted_questions_are_not_rhetorical():
+    result = labels(highlight_rhetorical_devices('He asked, "Who could blame them?"'))
+    assert set(result.values()) == {None}
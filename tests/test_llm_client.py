@@ -0,0 +1,180 @@
+import threading
+import time
+
+import pytest
+
+openai = pytest.importorskip("openai")
+
+import llm_client  # noqa: E402
+from llm_client import (  # noqa: E402
+    RateLimiter, SingleFlight, StreamAbandoned, StreamFlight, create_chat_completion, is_retryable,
+    retry_after_seconds,
+)
+
+RESPONSE = {"choices": [{"message": {"content": "ok"}}], "usage": {"prompt_tokens": 5, "completion_tokens": 1,
+                                                                  "total_tokens": 6}}
+
+# Function to make an upstream stream of the given deltas
+def deltas(*items):
+    yield from items
+
+def test_rate_limiter_admits_within_budget_and_waits_beyond_it():
+    limiter = RateLimiter(requests_per_minute=600, tokens_per_minute=100000)
+    for _ in range(600):
+        assert limiter.acquire(10) < 0.01
+    # The bucket refills at 10 requests a second, so the next one waits about 0.1 s
+    waited = limiter.acquire(10)
+    assert 0.05 < waited < 0.5
+
+def test_rate_limiter_settle_refunds_unused_tokens():
+    limiter = RateLimiter(requests_per_minute=1000, tokens_per_minute=1000)
+    limiter.acquire(1000)
+    limiter.settle(1000, 100)
+    assert limiter.acquire(800) < 0.01
+
+def test_rate_limiter_backs_off_after_throttling():
+    limiter = RateLimiter()
+    limiter.on_throttle(retry_after=0.2)
+    assert limiter.scale == 0.5 and limiter.stats()["throttled"] == 1
+    assert limiter.acquire(1) >= 0.15
+    limiter.on_success()
+    assert limiter.scale == 0.55
+
+def test_single_flight_shares_one_call():
+    flight, calls, release = SingleFlight(), [], threading.Event()
+    results = []
+
+    def call():
+        calls.append(1)
+        release.wait(5)
+        return "result"
+
+    threads = [threading.Thread(target=lambda: results.append(flight.run("key", call)), daemon=True)
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.coalesced < 3 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join(5)
+    assert results == ["result"] * 4 and len(calls) == 1
+    # Once finished, the same key calls again
+    assert flight.run("key", lambda: "again") == "again"
+
+def test_single_flight_passes_errors_to_every_caller():
+    flight, started, release, errors = SingleFlight(), threading.Event(), threading.Event(), []
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise ValueError("upstream failed")
+
+    def run():
+        try:
+            flight.run("key", fail)
+        except ValueError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=run, daemon=True)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=run, daemon=True)
+    follower.start()
+    while not flight.coalesced:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+    assert errors == ["upstream failed"] * 2
+
+def test_stream_flight_fans_deltas_out_to_followers():
+    flight, calls, step = StreamFlight(), [], threading.Semaphore(0)
+
+    def upstream():
+        calls.append(1)
+        for delta in ("Hel", "lo", "!"):
+            step.acquire(timeout=5)
+            yield delta
+
+    leader = flight.run("key", upstream)
+    step.release()
+    assert next(leader) == "Hel"
+    received = []
+    follower = threading.Thread(target=lambda: received.extend(flight.run("key", upstream)), daemon=True)
+    follower.start()
+    while not flight.coalesced:
+        time.sleep(0.01)
+    step.release()
+    step.release()
+    assert "".join(leader) == "lo!"
+    follower.join(5)
+    assert received == ["Hel", "lo", "!"] and len(calls) == 1
+
+def test_stream_flight_follower_fails_when_the_leader_stops_part_way():
+    flight = StreamFlight()
+    leader = flight.run("key", lambda: deltas("a", "b"))
+    next(leader)
+    follower = flight.run("key", lambda: deltas("x"))
+    assert next(follower) == "a"
+    leader.close()
+    with pytest.raises(StreamAbandoned):
+        list(follower)
+    # With nothing in flight the next caller streams on its own
+    assert list(flight.run("key", lambda: deltas("x"))) == ["x"]
+
+def test_retry_after_is_read_from_the_error_headers():
+    assert retry_after_seconds(openai.error.RateLimitError("slow down", headers={"retry-after": "2.5"})) == 2.5
+    assert retry_after_seconds(openai.error.RateLimitError("slow down", headers={"retry-after": "soon"})) is None
+    assert retry_after_seconds(openai.error.RateLimitError("slow down")) is None
+
+def test_only_transient_errors_are_retried():
+    assert is_retryable(openai.error.RateLimitError("slow down"))
+    assert is_retryable(openai.error.APIError("oops", http_status=503))
+    assert not is_retryable(openai.error.APIError("bad", http_status=400))
+    assert not is_retryable(openai.error.InvalidRequestError("bad request", param=None))
+
+@pytest.fixture
+def upstream(monkeypatch):
+    calls, sleeps, real_sleep = [], [], time.sleep
+    errors = []
+
+    def create(**kwargs):
+        calls.append(kwargs)
+        if errors:
+            raise errors.pop(0)
+        return RESPONSE
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        real_sleep(min(seconds, 0.01))
+
+    monkeypatch.setattr(llm_client.openai.ChatCompletion, "create", create)
+    monkeypatch.setattr(llm_client.time, "sleep", sleep)
+    monkeypatch.setattr(llm_client, "rate_limiter", RateLimiter())
+    monkeypatch.setattr(llm_client, "BACKOFF_BASE_SECONDS", 0.05)
+    return calls, sleeps, errors
+
+def test_throttled_requests_wait_for_retry_after(upstream):
+    calls, sleeps, errors = upstream
+    errors.append(openai.error.RateLimitError("slow down", headers={"retry-after": "0.2"}))
+    retries = llm_client.retry_count
+    assert create_chat_completion([{"role": "user", "content": "hi"}], 10) == RESPONSE
+    assert len(calls) == 2 and 0.2 in sleeps
+    assert llm_client.retry_count == retries + 1
+    assert llm_client.rate_limiter.stats()["throttled"] == 1
+
+def test_server_errors_back_off_with_jitter(upstream):
+    calls, sleeps, errors = upstream
+    errors.extend([openai.error.APIError("oops", http_status=502), openai.error.ServiceUnavailableError("down")])
+    assert create_chat_completion([{"role": "user", "content": "hi"}], 10) == RESPONSE
+    assert len(calls) == 3
+    assert 0 <= sleeps[0] <= 0.05 and 0 <= sleeps[1] <= 0.1
+
+def test_client_errors_are_not_retried(upstream):
+    calls, _, errors = upstream
+    errors.append(openai.error.InvalidRequestError("bad request", param=None))
+    with pytest.raises(openai.error.InvalidRequestError):
+        create_chat_completion([{"role": "user", "content": "hi"}], 10)
+    assert len(calls) == 1
@@ -0,0 +1,146 @@
+import threading
+import time
+
+import pytest
+
+from scheduler import BATCH, INTERACTIVE, FairScheduler, QueueFull, queue_position_listener
+
+# Function to wait until a condition holds, failing the test after a few seconds
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+# Function to start a daemon thread that takes a slot, records its name once admitted and holds
+# the slot until `release` is set
+def take_slot(scheduler, name, admitted, user=None, priority=INTERACTIVE, release=None, cost=1):
+    def run():
+        try:
+            with scheduler.slot(cost, user, priority):
+                admitted.append(name)
+                if release is not None:
+                    release.wait(5)
+        except QueueFull:
+            admitted.append(f"{name}: full")
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return thread
+
+def test_interactive_requests_go_before_batch_ones():
+    scheduler = FairScheduler(slots=1, interactive_slots=0)
+    admitted, release = [], threading.Event()
+    take_slot(scheduler, "holder", admitted, release=release)
+    wait_until(lambda: admitted == ["holder"])
+    take_slot(scheduler, "batch", admitted, "a", BATCH)
+    wait_until(lambda: scheduler.stats()["batch_waiting"] == 1)
+    take_slot(scheduler, "interactive", admitted, "b", INTERACTIVE)
+    wait_until(lambda: scheduler.stats()["interactive_waiting"] == 1)
+    release.set()
+    wait_until(lambda: len(admitted) == 3)
+    assert admitted == ["holder", "interactive", "batch"]
+
+def test_batch_work_never_takes_the_interactive_slots():
+    scheduler = FairScheduler(slots=2, interactive_slots=1)
+    admitted, release = [], threading.Event()
+    take_slot(scheduler, "batch 1", admitted, "a", BATCH, release)
+    take_slot(scheduler, "batch 2", admitted, "a", BATCH, release)
+    wait_until(lambda: scheduler.stats()["batch_waiting"] == 1)
+    assert admitted == ["batch 1"]
+    take_slot(scheduler, "interactive", admitted, "b", INTERACTIVE, release)
+    wait_until(lambda: "interactive" in admitted)
+    release.set()
+    wait_until(lambda: len(admitted) == 3)
+
+def test_users_share_the_queue_fairly():
+    scheduler = FairScheduler(slots=1, interactive_slots=0)
+    admitted, release = [], threading.Event()
+    take_slot(scheduler, "holder", admitted, release=release)
+    wait_until(lambda: admitted == ["holder"])
+    for index in range(3):
+        take_slot(scheduler, f"heavy {index}", admitted, "heavy", cost=100)
+        wait_until(lambda: scheduler.stats()["interactive_waiting"] == index + 1)
+    take_slot(scheduler, "light", admitted, "light", cost=100)
+    wait_until(lambda: scheduler.stats()["interactive_waiting"] == 4)
+    release.set()
+    wait_until(lambda: len(admitted) == 5)
+    # The light user's one request does not wait behind all of the heavy user's
+    assert admitted.index("light") <= 2
+
+def test_interactive_requests_over_the_limit_are_refused():
+    scheduler = FairScheduler(slots=1, interactive_slots=0, max_queued_per_user=1)
+    admitted, release = [], threading.Event()
+    take_slot(scheduler, "holder", admitted, release=release)
+    wait_until(lambda: admitted == ["holder"])
+    take_slot(scheduler, "queued", admitted, "a")
+    wait_until(lambda: scheduler.stats()["interactive_waiting"] == 1)
+    with pytest.raises(QueueFull):
+        with scheduler.slot(1, "a", INTERACTIVE):
+            pass
+    assert scheduler.stats()["rejected"] == 1
+    release.set()
+    wait_until(lambda: admitted == ["holder", "queued"])
+
+def test_batch_requests_over_the_limit_wait_for_room():
+    scheduler = FairScheduler(slots=1, interactive_slots=0, max_queued_per_user=1)
+    admitted, release = [], threading.Event()
+    take_slot(scheduler, "holder", admitted, release=release)
+    wait_until(lambda: admitted == ["holder"])
+    take_slot(scheduler, "first", admitted, "a", BATCH)
+    wait_until(lambda: scheduler.stats()["batch_waiting"] == 1)
+    second = take_slot(scheduler, "second", admitted, "a", BATCH)
+    time.sleep(0.1)
+    assert second.is_alive() and scheduler.stats()["batch_waiting"] == 1
+    release.set()
+    wait_until(lambda: len(admitted) == 3)
+    assert admitted == ["holder", "first", "second"]
+    assert scheduler.stats()["rejected"] == 0
+
+def test_a_cancelled_request_gives_up_its_place():
+    scheduler = FairScheduler(slots=1, interactive_slots=0)
+    admitted, release, positions = [], threading.Event(), []
+
+    def report(position, waiting):
+        positions.append(position)
+        raise KeyboardInterrupt  # the caller goes away while waiting, as on a page rerun
+
+    def cancelled():
+        with queue_position_listener(report):
+            try:
+                with scheduler.slot(1, "a"):
+                    admitted.append("cancelled")
+            except KeyboardInterrupt:
+                pass
+
+    take_slot(scheduler, "holder", admitted, release=release)
+    wait_until(lambda: admitted == ["holder"])
+    thread = threading.Thread(target=cancelled, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert positions == [1]
+    assert scheduler.stats()["interactive_waiting"] == 0
+    take_slot(scheduler, "next", admitted, "b")
+    release.set()
+    wait_until(lambda: admitted == ["holder", "next"])
+    wait_until(lambda: scheduler.stats()["interactive_running"] == 0)
+
+def test_waiting_requests_report_their_position():
+    scheduler = FairScheduler(slots=1, interactive_slots=0)
+    admitted, release, reports = [], threading.Event(), []
+
+    def waiter():
+        with queue_position_listener(lambda position, waiting: reports.append((position, waiting))):
+            with scheduler.slot(1, "a"):
+                admitted.append("waiter")
+
+    take_slot(scheduler, "holder", admitted, release=release)
+    wait_until(lambda: admitted == ["holder"])
+    thread = threading.Thread(target=waiter, daemon=True)
+    thread.start()
+    wait_until(lambda: reports)
+    # The scheduler lock is free while the listener runs
+    assert scheduler.user_status("a")["position"] == 1
+    release.set()
+    thread.join(5)
+    assert reports[0] == (1, 1) and reports[-1] == (None, 0)
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+from mock_servers import MockRedisServer
+from shared_state import MemoryState, RedisState, SQLiteState, open_state
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def state(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryState()
+    elif request.param == "sqlite":
+        yield SQLiteState(str(tmp_path / "state.sqlite3"))
+    else:
+        server = MockRedisServer().start()
+        try:
+            yield RedisState(server.url)
+        finally:
+            server.stop()
+
+def test_get_set_delete(state):
+    assert state.get("missing") is None
+    state.set("key", "value")
+    assert state.get("key") == "value"
+    state.delete("key")
+    assert state.get("key") is None
+
+def test_add_only_sets_absent_keys(state):
+    assert state.add("lock", "a", ttl=5)
+    assert not state.add("lock", "b", ttl=5)
+    assert state.get("lock") == "a"
+
+def test_incr_counts_up_and_down(state):
+    assert state.incr("counter") == 1
+    assert state.incr("counter", 5) == 6
+    assert state.incr("counter", -6) == 0
+    assert state.incr("counter", 2) == 2
+
+def test_values_expire_after_their_ttl(state):
+    state.set("short", "value", ttl=0.2)
+    state.add("lease", "owner", ttl=0.2)
+    time.sleep(0.3)
+    assert state.get("short") is None
+    assert state.add("lease", "next", ttl=5)
+
+def test_incr_keeps_the_ttl_from_when_the_key_was_created(state):
+    assert state.incr("window", 3, ttl=0.4) == 3
+    time.sleep(0.2)
+    # Later increments, including ones that pass through zero, do not extend the expiry
+    assert state.incr("window", -3, ttl=0.4) == 0
+    assert state.incr("window", 1, ttl=0.4) == 1
+    time.sleep(0.3)
+    assert state.get("window") is None
+    assert state.incr("window", 1, ttl=0.4) == 1
+
+def test_clear_removes_keys_with_a_prefix(state):
+    state.set("jobs:1", "a")
+    state.set("jobs:2", "b")
+    state.set("other", "c")
+    state.clear("jobs:")
+    assert state.get("jobs:1") is None and state.get("jobs:2") is None
+    assert state.get("other") == "c"
+
+def test_open_state_picks_the_backend(tmp_path):
+    assert isinstance(open_state("memory"), MemoryState)
+    assert isinstance(open_state(f"sqlite:///{tmp_path / 'state.sqlite3'}"), SQLiteState)
+    with pytest.raises(ValueError):
+        open_state("ftp://example.com")
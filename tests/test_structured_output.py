@@ -0,0 +1,42 @@
+import json
+
+from structured_output import StructuredResponseParser
+
+# Function to feed a response to a fresh parser in pieces of `size` characters and return its final parts
+def parse(response, size=1):
+    parser = StructuredResponseParser(fallback=None)
+    for start in range(0, len(response), size):
+        parser.feed(response[start:start + size])
+    return parser, parser.parts(final=True)
+
+def test_fields_are_read_as_they_stream():
+    parser = StructuredResponseParser(fallback=None)
+    parser.feed('{"text": "Hello wor')
+    assert parser.parts() == ("Hello wor", "", False)
+    parser.feed('ld", "analysis": "Sho')
+    assert parser.parts() == ("Hello world", "Sho", True)
+
+def test_escapes_split_across_deltas():
+    response = json.dumps({"text": 'She said "café"\nthen left \\ early', "analysis": "Tab\there."})
+    expected = ('She said "café"\nthen left \\ early', "Tab\there.", True)
+    for size in (1, 2, 3, 5):
+        parser, parts = parse(response.replace("é", "\\u00e9"), size)
+        assert parts == expected
+        # The incremental result agrees with the strict parse
+        assert parser.parts()[:2] == expected[:2]
+
+def test_nested_values_with_brackets_and_quotes_in_strings():
+    response = ('{"meta": {"note": "a } \\" ] {", "tags": ["x]", "\\\\", "{"]}, '
+                '"text": "Rewritten.", "analysis": "Done."}')
+    for size in (1, 4, len(response)):
+        parser, parts = parse(response, size)
+        assert parser.parts() == ("Rewritten.", "Done.", True)
+        assert parts == ("Rewritten.", "Done.", True)
+
+def test_code_fence_before_the_object_is_skipped():
+    _, parts = parse('```json\n{"text": "A", "analysis": "B"}\n```')
+    assert parts == ("A", "B", True)
+
+def test_empty_analysis_is_not_reported_as_found():
+    _, parts = parse('{"text": "A", "analysis": "  "}')
+    assert parts[2] is False
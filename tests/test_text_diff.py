@@ -0,0 +1,44 @@
+from text_diff import change_stats, diff_texts, render_diff_html, split_sentence_spans, summarize_changes
+
+ARTICLE = ("The council met on Tuesday. Mr. Smith of the U.S. delegation spoke first. "
+           "He said the plan, e.g. the new bus routes, would cost $40 million.\n\n"
+           "Critics disagreed. The vote passed anyway!")
+
+def test_sentence_spans_join_back_to_the_text():
+    spans = split_sentence_spans(ARTICLE)
+    assert "".join(spans) == ARTICLE
+    assert [span.strip() for span in spans] == [
+        "The council met on Tuesday.",
+        "Mr. Smith of the U.S. delegation spoke first.",
+        "He said the plan, e.g. the new bus routes, would cost $40 million.",
+        "Critics disagreed.",
+        "The vote passed anyway!",
+    ]
+
+def test_identical_texts_have_no_changes():
+    stats = change_stats(ARTICLE, ARTICLE)
+    assert stats["sentences_unchanged"] == 5
+    assert stats["percent_rewritten"] == 0.0
+    assert render_diff_html(ARTICLE, ARTICLE) == ARTICLE
+
+def test_rewritten_added_and_removed_sentences_are_counted():
+    modified = (ARTICLE.replace("Critics disagreed.", "Critics strongly disagreed.")
+                .replace("The council met on Tuesday. ", "") + " Turnout was low.")
+    stats = change_stats(ARTICLE, modified)
+    assert stats["sentences_rewritten"] == 1
+    assert stats["sentences_removed"] == 1
+    assert stats["sentences_added"] == 1
+    assert stats["sentences_unchanged"] == 3
+    assert 0 < stats["percent_rewritten"] < 50
+    assert summarize_changes(stats).startswith(f"{stats['percent_rewritten']:.0f}% rewritten: 1 sentences changed")
+
+def test_diff_markup_is_word_level_and_escaped():
+    html = render_diff_html("Prices rose <fast>. Nothing else.", "Prices fell <fast>. Nothing else.")
+    assert html == "Prices <del>rose </del><ins>fell </ins>&lt;fast&gt;. Nothing else."
+
+def test_long_rewrites_align_on_unique_sentences():
+    original = " ".join(f"Sentence number {index} is here." for index in range(3000))
+    modified = original.replace("Sentence number 1500 is here.", "Sentence 1500 was rewritten.")
+    entries = diff_texts(original, modified)
+    assert [entry[0] for entry in entries] == ["equal", "replace", "equal"]
+    assert change_stats(original, modified)["sentences_rewritten"] == 1
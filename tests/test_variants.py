@@ -0,0 +1,81 @@
+import json
+
+import pytest
+
+pytest.importorskip("openai")
+
+import variants  # noqa: E402
+from metrics import metrics  # noqa: E402
+from model_router import BudgetExceeded  # noqa: E402
+from variants import ARTICLE_PLACEHOLDER, build_variants_prompt, parse_variants, plan_groups, run_variants  # noqa: E402
+
+TOOL = "Narrative Perspective Changer"
+VALUES = ["first-person", "third-person", "antagonist", "protagonist"]
+ARTICLE = "The council approved the new transit budget after a lengthy public hearing on Tuesday."
+
+def test_plan_groups_fits_the_output_budget():
+    per_variant = variants.variant_output_tokens(ARTICLE)
+    assert plan_groups(ARTICLE, VALUES) == [VALUES]
+    assert plan_groups(ARTICLE, VALUES, max_tokens=per_variant * 3) == [VALUES[:3], VALUES[3:]]
+    assert plan_groups(ARTICLE, VALUES, max_tokens=1) == [[value] for value in VALUES]
+
+def test_plan_groups_sends_long_articles_separately():
+    article = "\n\n".join([ARTICLE * 10] * 20)
+    assert plan_groups(article, VALUES, max_tokens=10 ** 6) == [[value] for value in VALUES]
+
+def test_build_variants_prompt_holds_one_copy_of_the_article():
+    prompt = build_variants_prompt(TOOL, ARTICLE, VALUES[:2])
+    assert prompt.count(ARTICLE) == 1 and ARTICLE_PLACEHOLDER not in prompt
+    assert "Task 1 (perspective: first-person)" in prompt and "Task 2 (perspective: third-person)" in prompt
+    assert "all 2 results" in prompt
+
+def test_parse_variants_reads_entries_by_name_or_position():
+    response = json.dumps({"variants": [
+        {"variant": "unknown", "text": "A"},
+        {"variant": "third-person", "text": " B ", "analysis": "b"},
+        {"variant": "third-person", "text": "duplicate"},
+    ]})
+    assert parse_variants(response, VALUES[:2]) == {"third-person": ("B", "b"), "first-person": ("A", "")}
+
+def test_parse_variants_skips_unreadable_or_empty_entries():
+    assert parse_variants("not json", VALUES) == {}
+    assert parse_variants('["a list"]', VALUES) == {}
+    assert parse_variants(json.dumps({"variants": [{"text": "  "}, "text", {"text": 3}]}), VALUES) == {}
+
+@pytest.fixture
+def separate_calls(monkeypatch):
+    calls = []
+
+    def run_tool(tool_name, original_text, params, **kwargs):
+        calls.append(params["perspective"])
+        return {"tool": tool_name, "params": params, "text": f"separate {params['perspective']}", "analysis": "",
+                "error": None, "requests": 1}
+
+    monkeypatch.setattr(variants, "run_tool", run_tool)
+    return calls
+
+def test_missing_variants_fall_back_to_separate_calls(monkeypatch, separate_calls):
+    def request_completion(prompt, max_tokens, **kwargs):
+        metrics.count_request("api")
+        return json.dumps({"variants": [{"variant": "first-person", "text": "combined"}]})
+
+    monkeypatch.setattr(variants, "request_completion", request_completion)
+    results, requests = run_variants(TOOL, ARTICLE, VALUES[:2])
+    assert [result["text"] for result in results] == ["combined", "separate third-person"]
+    assert separate_calls == ["third-person"] and requests == 2
+
+def test_cached_combined_answers_are_not_counted_as_requests(monkeypatch, separate_calls):
+    response = json.dumps({"variants": [{"variant": value, "text": value} for value in VALUES]})
+    monkeypatch.setattr(variants, "request_completion", lambda prompt, max_tokens, **kwargs: response)
+    results, requests = run_variants(TOOL, ARTICLE, VALUES)
+    assert [result["text"] for result in results] == VALUES
+    assert requests == 0 and not separate_calls
+
+def test_budget_errors_are_raised_instead_of_retried_separately(monkeypatch, separate_calls):
+    def request_completion(prompt, max_tokens, **kwargs):
+        raise BudgetExceeded("The shared token budget is used up.")
+
+    monkeypatch.setattr(variants, "request_completion", request_completion)
+    with pytest.raises(BudgetExceeded):
+        run_variants(TOOL, ARTICLE, VALUES)
+    assert not separate_calls
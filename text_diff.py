@@ -0,0 +1,179 @@
+import bisect
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+from html import escape
+
+from heuristics import SENTENCE_SPLIT
+
+# Original-vs-modified diff for long rewrites.
+# Sentences are compared by their normalized text; sentences that occur exactly once on each side
+# anchor the alignment (patience diff), so a 10k-word article costs O(n log n) instead of difflib's
+# quadratic scan, and difflib only runs on the short stretches between anchors. Rewritten sentence
+# runs are then diffed word by word the same way.
+
+WORD = re.compile(r"\S+\s*")
+MAX_GAP_PRODUCT = 250000  # largest len(a) * len(b) stretch handed to difflib; larger ones become one replace
+DIFF_CACHE_SIZE = 64
+
+# Function to split a text into sentences that keep their trailing whitespace, so joining them gives the text back
+def split_sentence_spans(text):
+    sentences, start = [], 0
+    for match in SENTENCE_SPLIT.finditer(text):
+        sentences.append(text[start:match.end()])
+        start = match.end()
+    if start < len(text):
+        sentences.append(text[start:])
+    return sentences
+
+# Function to get the comparison key of a sentence or word (whitespace differences do not count)
+def token_key(token):
+    return " ".join(token.split())
+
+# Function to find the longest increasing run of b positions among unique common tokens (the anchors)
+def unique_anchors(a, b):
+    counts = {}
+    for side, keys in ((0, a), (1, b)):
+        for index, key in enumerate(keys):
+            entry = counts.setdefault(key, [0, 0, None, None])
+            entry[side] += 1
+            entry[side + 2] = index
+    pairs = sorted((i, j) for count_a, count_b, i, j in counts.values() if count_a == 1 and count_b == 1)
+    # Longest increasing subsequence of the b positions, with back-pointers
+    tails, tail_indexes, previous = [], [], [None] * len(pairs)
+    for index, (_, j) in enumerate(pairs):
+        position = bisect.bisect_left(tails, j)
+        if position:
+            previous[index] = tail_indexes[position - 1]
+        if position == len(tails):
+            tails.append(j)
+            tail_indexes.append(index)
+        else:
+            tails[position] = j
+            tail_indexes[position] = index
+    anchors = []
+    index = tail_indexes[-1] if tail_indexes else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    return anchors[::-1]
+
+# Function to diff two key lists into difflib-style opcodes (tag, i1, i2, j1, j2)
+def anchored_opcodes(a, b, a_offset=0, b_offset=0):
+    opcodes = []
+    start = 0
+    while start < len(a) and start < len(b) and a[start] == b[start]:
+        start += 1
+    end_a, end_b = len(a), len(b)
+    while end_a > start and end_b > start and a[end_a - 1] == b[end_b - 1]:
+        end_a -= 1
+        end_b -= 1
+    if start:
+        opcodes.append(("equal", a_offset, a_offset + start, b_offset, b_offset + start))
+
+    middle_a, middle_b = a[start:end_a], b[start:end_b]
+    anchors = unique_anchors(middle_a, middle_b) if middle_a and middle_b else []
+    if anchors:
+        last_i = last_j = 0
+        for i, j in anchors + [(len(middle_a), len(middle_b))]:
+            opcodes += anchored_opcodes(middle_a[last_i:i], middle_b[last_j:j],
+                                        a_offset + start + last_i, b_offset + start + last_j)
+            if i < len(middle_a):
+                opcodes.append(("equal", a_offset + start + i, a_offset + start + i + 1,
+                                b_offset + start + j, b_offset + start + j + 1))
+            last_i, last_j = i + 1, j + 1
+    elif middle_a and middle_b and len(middle_a) * len(middle_b) <= MAX_GAP_PRODUCT:
+        matcher = SequenceMatcher(None, middle_a, middle_b, autojunk=False)
+        opcodes += [(tag, a_offset + start + i1, a_offset + start + i2, b_offset + start + j1, b_offset + start + j2)
+                    for tag, i1, i2, j1, j2 in matcher.get_opcodes()]
+    elif middle_a or middle_b:
+        tag = "replace" if middle_a and middle_b else ("delete" if middle_a else "insert")
+        opcodes.append((tag, a_offset + start, a_offset + end_a, b_offset + start, b_offset + end_b))
+
+    if end_a < len(a):
+        opcodes.append(("equal", a_offset + end_a, a_offset + len(a), b_offset + end_b, b_offset + len(b)))
+    return merge_opcodes(opcodes)
+
+# Function to merge neighbouring opcodes with the same tag
+def merge_opcodes(opcodes):
+    merged = []
+    for tag, i1, i2, j1, j2 in opcodes:
+        if i1 == i2 and j1 == j2:
+            continue
+        if merged and merged[-1][0] == tag:
+            merged[-1] = (tag, merged[-1][1], i2, merged[-1][3], j2)
+        else:
+            merged.append((tag, i1, i2, j1, j2))
+    return merged
+
+# Function to diff two texts: sentence-level opcodes, with word-level opcodes for each rewritten run.
+# Returns a tuple of (tag, old_tokens, new_tokens) where replace runs hold word-level entries of the same shape.
+@lru_cache(maxsize=DIFF_CACHE_SIZE)
+def diff_texts(original, modified):
+    a, b = split_sentence_spans(original), split_sentence_spans(modified)
+    result = []
+    for tag, i1, i2, j1, j2 in anchored_opcodes([token_key(s) for s in a], [token_key(s) for s in b]):
+        if tag != "replace":
+            result.append((tag, tuple(a[i1:i2]), tuple(b[j1:j2])))
+            continue
+        old_words, new_words = WORD.findall("".join(a[i1:i2])), WORD.findall("".join(b[j1:j2]))
+        words = tuple((word_tag, tuple(old_words[k1:k2]), tuple(new_words[l1:l2]))
+                      for word_tag, k1, k2, l1, l2 in anchored_opcodes([token_key(w) for w in old_words],
+                                                                     [token_key(w) for w in new_words]))
+        result.append(("replace", tuple(a[i1:i2]), tuple(b[j1:j2]), words))
+    return tuple(result)
+
+# Function to compute change statistics for a rewrite (small enough to store with each result)
+def change_stats(original, modified):
+    stats = {"sentences_original": 0, "sentences_modified": 0, "sentences_unchanged": 0, "sentences_rewritten": 0,
+             "sentences_added": 0, "sentences_removed": 0, "words_original": 0, "words_modified": 0, "words_kept": 0}
+    for entry in diff_texts(original, modified):
+        tag, old, new = entry[:3]
+        stats["sentences_original"] += len(old)
+        stats["sentences_modified"] += len(new)
+        old_words = sum(len(sentence.split()) for sentence in old)
+        stats["words_original"] += old_words
+        stats["words_modified"] += sum(len(sentence.split()) for sentence in new)
+        if tag == "equal":
+            stats["sentences_unchanged"] += len(old)
+            stats["words_kept"] += old_words
+        elif tag == "delete":
+            stats["sentences_removed"] += len(old)
+        elif tag == "insert":
+            stats["sentences_added"] += len(new)
+        else:
+            stats["sentences_rewritten"] += min(len(old), len(new))
+            stats["sentences_removed"] += max(0, len(old) - len(new))
+            stats["sentences_added"] += max(0, len(new) - len(old))
+            stats["words_kept"] += sum(len(words) for word_tag, words, _ in entry[3] if word_tag == "equal")
+    words = stats["words_original"]
+    stats["percent_rewritten"] = round(100 * (1 - stats["words_kept"] / words), 1) if words else 0.0
+    return stats
+
+# Function to describe change statistics in one line
+def summarize_changes(stats):
+    return (f"{stats['percent_rewritten']:.0f}% rewritten: {stats['sentences_rewritten']} sentences changed, "
+            f"{stats['sentences_added']} added, {stats['sentences_removed']} removed, "
+            f"{stats['sentences_unchanged']} unchanged")
+
+def _marked(tag, old, new):
+    parts = []
+    if tag in ("delete", "replace") and old:
+        parts.append(f"<del>{escape(''.join(old))}</del>")
+    if tag in ("insert", "replace") and new:
+        parts.append(f"<ins>{escape(''.join(new))}</ins>")
+    return "".join(parts)
+
+# Function to render the modified text with inline <del>/<ins> change markup (HTML-escaped)
+def render_diff_html(original, modified):
+    parts = []
+    for entry in diff_texts(original, modified):
+        tag, old, new = entry[:3]
+        if tag == "equal":
+            parts.append(escape("".join(new)))
+        elif tag == "replace":
+            parts += [escape("".join(words_new)) if word_tag == "equal" else _marked(word_tag, words_old, words_new)
+                      for word_tag, words_old, words_new in entry[3]]
+        else:
+            parts.append(_marked(tag, old, new))
+    return "".join(parts)
@@ -0,0 +1,370 @@
+import contextvars
+import inspect
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from chunking import CHUNK_THRESHOLD_TOKENS, CHUNK_TOKENS, estimate_tokens, needs_chunking, split_into_chunks
+from dedup_index import make_scope
+from heuristics import FAST_PATHS
+from llm_client import build_messages, count_message_tokens, request_completion
+from metrics import labelled_by_tool, metrics, run_usage
+from model_router import bind_session, router
+from structured_output import StructuredResponseParser, build_structured_prompt
+from text_diff import change_stats
+
+# Default number of concurrent requests when several tools run over one text
+FANOUT_CONCURRENCY = int(os.environ.get("TIM_FANOUT_CONCURRENCY", "5"))
+# Default number of concurrent requests when one long text is processed in chunks
+CHUNK_CONCURRENCY = int(os.environ.get("TIM_CHUNK_CONCURRENCY", "6"))
+# Label clear-cut sentences locally and send only the ambiguous ones (TIM_LOCAL_FAST_PATH=0 disables)
+LOCAL_FAST_PATH = os.environ.get("TIM_LOCAL_FAST_PATH", "1") != "0"
+# Ask for a function-call result instead of the "---" separated reply (TIM_STRUCTURED_OUTPUT=0 disables)
+STRUCTURED_OUTPUT = os.environ.get("TIM_STRUCTURED_OUTPUT", "1") != "0"
+
+# Splits a (possibly partial) response into modified text and analysis on the "---" separator
+class ResponseSplitter:
+    SEPARATOR = "\n---\n"
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, delta):
+        self.buffer += delta
+        return self.parts()
+
+    def parts(self, final=False):
+        index = self.buffer.find(self.SEPARATOR)
+        if index >= 0:
+            return self.buffer[:index], self.buffer[index + len(self.SEPARATOR):], True
+        text = self.buffer
+        if not final:
+            # Hold back a trailing partial separator so it never flashes on screen
+            for size in range(len(self.SEPARATOR) - 1, 0, -1):
+                if text.endswith(self.SEPARATOR[:size]):
+                    text = text[:-size]
+                    break
+        return text, "", False
+
+# Options for the six What If? dimensions, in widget order (the first option is the default)
+WHAT_IF_OPTIONS = {
+    "sentiment": ["positive", "neutral", "negative"],
+    "context": ["current", "historical", "future", "economic boom", "economic downturn"],
+    "source": ["neutral", "left-leaning", "right-leaning", "academic", "tabloid"],
+    "demographic": ["general", "youth", "elderly", "urban", "rural"],
+    "socioeconomic": ["middle class", "upper class", "working class", "unemployed"],
+    "cultural": ["mainstream", "conservative", "liberal", "traditional", "modern"],
+}
+
+# Options of the tools with one enumerated setting: tool -> (prompt builder parameter, options in widget order)
+VARIANT_OPTIONS = {
+    "Emotion Amplifier/Reducer": ("emotion_intensity", ["amplify", "reduce"]),
+    "Narrative Perspective Changer": ("perspective", ["first-person", "third-person", "antagonist", "protagonist"]),
+    "Information Complexity Mixer": ("complexity_level", ["simplified", "complexified"]),
+    "Cross-Cultural Interpretation Tool": ("culture", ["Western", "Eastern", "Middle Eastern", "African", "South American"]),
+}
+
+# Prompt builders for each tool (defaults match the first option of each widget)
+def build_what_if_prompt(original_text, sentiment="positive", context="current", source="neutral", demographic="general", socioeconomic="middle class", cultural="mainstream"):
+    return f"""Original Text: {original_text}
+
+Modify the text based on the following parameters:
+Sentiment: {sentiment}
+Context: {context}
+Source: {source}
+Demographic: {demographic}
+Socio-Economic Background: {socioeconomic}
+Cultural Context: {cultural}
+
+Provide the modified text below, and include a brief analysis of how the information has been manipulated. Separate the modified text and analysis with three dashes (---) on a new line."""
+
+def build_counter_argument_prompt(original_text):
+    return f"""Assuming the role of a seasoned debater, create a comprehensive, logically sound, and persuasive counter-narrative to the following text:
+
+{original_text}
+
+Provide a well-structured counter-argument, and include an analysis of the rhetorical techniques and logical fallacies (if any) used in the original text. Separate the counter-argument and analysis with three dashes (---) on a new line."""
+
+def build_neutralizer_prompt(original_text):
+    return f"""Neutralize the following text by removing any bias, emotional language, or subjective statements. 
+Present only factual information in a neutral tone. If claims are made without evidence, indicate that they are unverified.
+Maintain the overall structure and length of the original text as much as possible.
+After neutralizing the text, provide a brief analysis of what changes were made and why.
+
+Original text:
+{original_text}
+
+Please provide the neutralized version of the text, followed by an analysis of the changes made. Separate the neutralized text and analysis with three dashes (---) on a new line."""
+
+def build_emotion_prompt(original_text, emotion_intensity="amplify"):
+    return f"""Original Text: {original_text}
+
+Please rewrite the text with a focus on {emotion_intensity} the emotional intensity. If the text is neutral, make it more emotionally charged, or tone it down to be more analytical. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
+
+def build_perspective_prompt(original_text, perspective="first-person"):
+    return f"""Original Text: {original_text}
+
+Please rewrite the text from a {perspective} perspective. Change pronouns, restructure sentences, and adjust the tone to match the new perspective. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
+
+def build_fact_vs_opinion_prompt(original_text):
+    return f"""Analyze the following text and distinguish between veifiable factual statements and inferred opinions. Isolate and highlight Facts Vs. Opinions. Provide explanations for the categorization.
+
+Original text:
+{original_text}
+
+Please provide the analyzed text with explanations. Separate the analyzed text and explanations with three dashes (---) on a new line."""
+
+def build_complexity_prompt(original_text, complexity_level="simplified"):
+    return f"""Original Text: {original_text}
+
+Please rewrite the text to make it {complexity_level}. Either simplify the content for a general audience or add more complexity and detail. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
+
+def build_rhetorical_devices_prompt(original_text):
+    return f"""Analyze the following text for rhetorical devices. Highlight devices like metaphors, similes, hyperbole, etc., and provide explanations on how they impact the reader.
+
+Original text:
+{original_text}
+
+Please provide the highlighted text with explanations. Separate the highlighted text and explanations with three dashes (---) on a new line."""
+
+def build_cultural_prompt(original_text, culture="Western"):
+    return f"""Original Text: {original_text}
+
+Please reinterpret the text from the perspective of {culture} culture. Adjust language, idioms, and cultural references to simulate how the text might be perceived in that cultural context. Include a brief analysis of the changes made. Separate the modified text and analysis with three dashes (---) on a new line."""
+
+def build_variable_adjustment_prompt(original_text, accuracy=50, completeness=50, relevance=50, timeliness=50, consistency=50, objectivity=50, credibility=50, clarity=50, accessibility=50, value=50):
+    return f"""Original Text: {original_text}
+
+Please rewrite the text based on the following criteria adjustments:
+Accuracy: {accuracy}%
+Completeness: {completeness}%
+Relevance: {relevance}%
+Timeliness: {timeliness}%
+Consistency: {consistency}%
+Objectivity: {objectivity}%
+Credibility: {credibility}%
+Clarity: {clarity}%
+Accessibility: {accessibility}%
+Value: {value}%
+
+Modify the text to reflect these adjustments. For example, if accuracy is set to a low percentage, introduce some inaccuracies. If clarity is high, make the text more straightforward and easy to understand.
+
+After rewriting the text, provide a brief analysis of the changes made and how they reflect the adjusted variables.
+
+Separate the rewritten text and the analysis with three dashes (---) on a new line."""
+
+# Prompt builder, report title and output labels for each tool
+TOOL_PROMPTS = {
+    "What If? Scenario Analyzer": {"build": build_what_if_prompt, "title": "What If? Scenario Analysis"},
+    "Debate Counter-Argument Generator": {"build": build_counter_argument_prompt, "title": "Debate Counter-Argument Report", "text_label": "Counter-Argument", "diff": False},
+    "Article Neutralizer": {"build": build_neutralizer_prompt, "title": "Text Neutralization Report", "text_label": "Neutralized Text"},
+    "Emotion Amplifier/Reducer": {"build": build_emotion_prompt, "title": "Emotion Amplifier/Reducer Report"},
+    "Narrative Perspective Changer": {"build": build_perspective_prompt, "title": "Narrative Perspective Changer Report"},
+    "Fact vs. Opinion Analyzer": {"build": build_fact_vs_opinion_prompt, "title": "Fact vs. Opinion Analyzer Report", "text_label": "Analyzed Text", "analysis_label": "Explanations"},
+    "Information Complexity Mixer": {"build": build_complexity_prompt, "title": "Information Complexity Mixer Report"},
+    "Rhetorical Device Highlighter": {"build": build_rhetorical_devices_prompt, "title": "Rhetorical Device Highlighter Report", "text_label": "Highlighted Text", "analysis_label": "Explanations"},
+    "Cross-Cultural Interpretation Tool": {"build": build_cultural_prompt, "title": "Cross-Cultural Interpretation Report"},
+    "Variable Adjustment": {"build": build_variable_adjustment_prompt, "title": "Variable Adjustment Analysis Report", "text_label": "Rewritten Text"},
+}
+
+# Function to build the prompt for a tool, asking for the structured result when enabled
+def build_tool_prompt(tool_name, original_text, params=None, structured=STRUCTURED_OUTPUT, chunk=None):
+    spec = TOOL_PROMPTS[tool_name]
+    with metrics.timer("prompt_build", tool_name):
+        prompt = spec["build"](original_text, **(params or {}))
+        if chunk is not None:
+            prompt = build_chunk_prompt(prompt, *chunk)
+        if structured:
+            prompt = build_structured_prompt(prompt, spec.get("text_label", "Modified Text"), spec.get("analysis_label", "Analysis"))
+    return prompt
+
+# Function to make an incremental parser for a (streamed) response
+def make_response_parser(structured=STRUCTURED_OUTPUT):
+    if structured:
+        return StructuredResponseParser(ResponseSplitter())
+    return ResponseSplitter()
+
+# Function to split a complete response into (text, analysis) using the tool's labels
+def split_response(response, analysis_label="Analysis", structured=False):
+    parser = make_response_parser(structured)
+    parser.feed(response)
+    text, analysis, found = parser.parts(final=True)
+    return text.strip(), analysis.strip() if found else f"No separate {analysis_label.lower()} provided."
+
+# Function to scope a tool prompt to one part of a longer article
+def build_chunk_prompt(prompt, index, total):
+    return f"""{prompt}
+
+Note: the text above is part {index} of {total} of a longer article. Process only this part and keep its length; do not add an introduction or conclusion for the whole article."""
+
+# Function to build the reduce prompt that merges per-chunk analyses into one
+def build_reduce_prompt(tool_name, analysis_label, analyses):
+    parts = "\n\n".join(f"Part {index}:\n{analysis}" for index, analysis in enumerate(analyses, 1))
+    return f"""The following {analysis_label.lower()} were written by the "{tool_name}" tool for consecutive parts of one article.
+
+{parts}
+
+Merge them into a single, non-repetitive {analysis_label.lower()} that covers the whole article. Reply with the merged text only."""
+
+# Function to run a tool over a long text: rewrite the chunks in parallel, then reduce the analyses
+def run_tool_chunked(tool_name, original_text, params, use_cache=True, cache=None, on_progress=None,
+                     max_workers=CHUNK_CONCURRENCY, chunk_tokens=CHUNK_TOKENS, structured=STRUCTURED_OUTPUT):
+    spec = TOOL_PROMPTS[tool_name]
+    analysis_label = spec.get("analysis_label", "Analysis")
+    chunks = split_into_chunks(original_text, chunk_tokens)
+    prompts = [build_tool_prompt(tool_name, chunk, params, structured, chunk=(index, len(chunks)))
+               for index, chunk in enumerate(chunks, 1)]
+
+    responses = [None] * len(prompts)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(prompts)))) as executor:
+        # Each worker runs in a copy of this context so its metrics keep the tool label
+        futures = {executor.submit(contextvars.copy_context().run, request_completion, prompt,
+                                   use_cache=use_cache, cache=cache, structured=structured): index
+                   for index, prompt in enumerate(prompts)}
+        for completed, future in enumerate(as_completed(futures), 1):
+            responses[futures[future]] = future.result()
+            if on_progress is not None:
+                on_progress(completed, len(prompts))
+
+    texts, analyses = [], []
+    for response in responses:
+        parser = make_response_parser(structured)
+        parser.feed(response)
+        text, analysis, found = parser.parts(final=True)
+        texts.append(text.strip())
+        if found and analysis.strip():
+            analyses.append(analysis.strip())
+
+    if len(analyses) > 1:
+        analysis = request_completion(build_reduce_prompt(tool_name, analysis_label, analyses),
+                                      use_cache=use_cache, cache=cache)
+    elif analyses:
+        analysis = analyses[0]
+    else:
+        analysis = f"No separate {analysis_label.lower()} provided."
+    return "\n\n".join(texts), analysis, len(chunks)
+
+# Function to keep only the parameters a tool's prompt builder accepts
+def tool_params(tool_name, params):
+    accepted = inspect.signature(TOOL_PROMPTS[tool_name]["build"]).parameters
+    return {key: value for key, value in (params or {}).items() if key in accepted and key != "original_text"}
+
+# Function to get each tool's (text label, analysis label) pair for reports
+def tool_labels():
+    return {name: (spec.get("text_label", "Modified Text"), spec.get("analysis_label", "Analysis"))
+            for name, spec in TOOL_PROMPTS.items()}
+
+# Function to get the change statistics of a tool result, or None for tools that write new text rather than rewrite
+def result_changes(tool_name, original_text, text):
+    return change_stats(original_text, text) if text and TOOL_PROMPTS[tool_name].get("diff", True) else None
+
+# Function to estimate the routes of the requests a tool run over a text makes: one for a short text, or
+# one per chunk plus the merge of their analyses for a long one. Only the text length and the tool's
+# instructions are used, so nothing is split or built.
+def tool_routes(tool_name, original_text, params=None, structured=STRUCTURED_OUTPUT):
+    spec = TOOL_PROMPTS[tool_name]
+    analysis_label = spec.get("analysis_label", "Analysis")
+    instructions = spec["build"]("", **tool_params(tool_name, params))
+    if structured:
+        instructions = build_structured_prompt(instructions, spec.get("text_label", "Modified Text"), analysis_label)
+    overhead = count_message_tokens(build_messages(instructions))
+    text_tokens = estimate_tokens(original_text)
+    if text_tokens <= CHUNK_THRESHOLD_TOKENS:
+        return [router.route(overhead + text_tokens, tool=tool_name)]
+    chunks = math.ceil(text_tokens / CHUNK_TOKENS)
+    chunk_route = router.route(overhead + estimate_tokens(build_chunk_prompt("", chunks, chunks))
+                               + math.ceil(text_tokens / chunks), tool=tool_name)
+    # Each chunk's analysis is assumed to fill a quarter of its output budget
+    merge_tokens = count_message_tokens(build_messages(build_reduce_prompt(tool_name, analysis_label, [])))
+    merge_route = router.route(merge_tokens + chunks * chunk_route.max_tokens // 4, tool=tool_name)
+    return [chunk_route] * chunks + [merge_route]
+
+# Function to merge the local pre-pass with the model's output for the ambiguous sentences
+def merge_fast_path(local, text=None, analysis=None):
+    merged_text = local["annotated_text"]
+    merged_analysis = local["explanations"] or "No sentences were classified locally."
+    if text:
+        merged_text += f"\n\n**Model review of the remaining sentences:**\n\n{text}"
+    if analysis:
+        merged_analysis = f"**Local pre-pass:**\n{merged_analysis}\n\n**Model:**\n{analysis}"
+    return merged_text, merged_analysis
+
+# Function to get the model a tool run over a text is routed to (for a long text, the model its chunks get)
+def routed_model(tool_name, original_text, params=None, structured=STRUCTURED_OUTPUT):
+    return tool_routes(tool_name, original_text, params, structured)[0].model
+
+# Function to get the near-duplicate scope of a tool run, so results are only reused under the same settings
+# and from the same model
+def tool_scope(tool_name, original_text, params, structured=STRUCTURED_OUTPUT, fast_path=LOCAL_FAST_PATH):
+    params = tool_params(tool_name, params)
+    return make_scope(routed_model(tool_name, original_text, params, structured), tool_name, params, structured,
+                      fast_path)
+
+# Function to run the model part of a tool, chunking long texts
+def run_model(tool_name, original_text, params, use_cache=True, cache=None, on_progress=None, structured=STRUCTURED_OUTPUT):
+    if needs_chunking(original_text):
+        return run_tool_chunked(tool_name, original_text, params, use_cache, cache, on_progress, structured=structured)
+    analysis_label = TOOL_PROMPTS[tool_name].get("analysis_label", "Analysis")
+    response = request_completion(build_tool_prompt(tool_name, original_text, params, structured),
+                                  use_cache=use_cache, cache=cache, structured=structured)
+    text, analysis = split_response(response, analysis_label, structured)
+    return text, analysis, 1
+
+# Function to run one tool over a text without any UI; errors are reported in the result
+# With a near-duplicate index, an article that closely matches one already processed reuses its result;
+# with a result store, every successful run is added to the searchable history.
+@labelled_by_tool
+def run_tool(tool_name, original_text, params=None, use_cache=True, cache=None, on_progress=None,
+             structured=STRUCTURED_OUTPUT, fast_path=LOCAL_FAST_PATH, duplicates=None, store=None, source_url=None):
+    spec = TOOL_PROMPTS[tool_name]
+    params = tool_params(tool_name, params)
+    result = {
+        "tool": tool_name,
+        "params": params,
+        "text_label": spec.get("text_label", "Modified Text"),
+        "analysis_label": spec.get("analysis_label", "Analysis"),
+        "error": None,
+        "chunks": 0,
+    }
+    started = time.monotonic()
+    scope = tool_scope(tool_name, original_text, params, structured, fast_path)
+    match = duplicates.find(scope, original_text) if duplicates is not None and use_cache else None
+    if match is not None:
+        stored, result["near_duplicate"] = match
+        result.update(stored)
+    else:
+        try:
+            local = FAST_PATHS[tool_name](original_text) if fast_path and tool_name in FAST_PATHS else None
+            if local is None:
+                result["text"], result["analysis"], result["chunks"] = run_model(
+                    tool_name, original_text, params, use_cache, cache, on_progress, structured)
+            else:
+                result["local_sentences"] = local["sentences"]
+                result["ambiguous_sentences"] = local["ambiguous"]
+                text = analysis = None
+                if local["ambiguous"]:
+                    text, analysis, result["chunks"] = run_model(
+                        tool_name, local["ambiguous_text"], params, use_cache, cache, on_progress, structured)
+                result["text"], result["analysis"] = merge_fast_path(local, text, analysis)
+        except Exception as e:
+            result["text"], result["analysis"], result["error"] = "", "", str(e)
+        if duplicates is not None and not result["error"]:
+            duplicates.add(scope, original_text, {key: result[key] for key in ("text", "analysis", "chunks")})
+    result.update(run_usage())
+    result["changes"] = result_changes(tool_name, original_text, result["text"]) if not result["error"] else None
+    result["seconds"] = time.monotonic() - started
+    if store is not None and not result["error"]:
+        store.add(tool_name, params, original_text, result["text"], result["analysis"], source_url,
+                  result["tokens_in"], result["tokens_out"], result["seconds"], result["changes"])
+    return result
+
+# Function to run several tools over one text concurrently; results come back in tool order
+def run_tools_concurrently(original_text, tool_names, max_workers=FANOUT_CONCURRENCY, use_cache=True, cache=None,
+                           duplicates=None, store=None, source_url=None):
+    def run_one(tool_name):
+        return run_tool(tool_name, original_text, use_cache=use_cache, cache=cache, duplicates=duplicates,
+                        store=store, source_url=source_url)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        return list(executor.map(bind_session(run_one), tool_names))
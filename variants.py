@@ -0,0 +1,123 @@
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from chunking import estimate_tokens, needs_chunking
+from llm_client import request_completion
+from metrics import labelled_by_tool, run_usage
+from model_router import bind_session
+from structured_output import VARIANTS_FUNCTION
+from tim_tools import TOOL_PROMPTS, VARIANT_OPTIONS, result_changes, run_tool, tool_params
+
+# Limits for multi-variant requests (override with environment variables)
+VARIANT_MAX_TOKENS = int(os.environ.get("TIM_VARIANT_MAX_TOKENS", "8000"))  # output budget of one combined request
+VARIANT_CONCURRENCY = int(os.environ.get("TIM_VARIANT_CONCURRENCY", "5"))
+OUTPUT_RATIO = 1.3  # rewritten text tokens per article token
+ANALYSIS_TOKENS = 250  # allowance for each variant's analysis
+
+ARTICLE_PLACEHOLDER = "<<ORIGINAL_TEXT>>"
+
+# Function to estimate the output tokens one variant of a rewrite needs
+def variant_output_tokens(original_text):
+    return int(estimate_tokens(original_text) * OUTPUT_RATIO) + ANALYSIS_TOKENS
+
+# Function to split variants into groups whose combined output fits one request (groups of 1 mean separate calls)
+def plan_groups(original_text, values, max_tokens=VARIANT_MAX_TOKENS):
+    per_call = max(1, max_tokens // variant_output_tokens(original_text))
+    if needs_chunking(original_text):
+        per_call = 1
+    return [values[index:index + per_call] for index in range(0, len(values), per_call)]
+
+# Function to get a tool's instruction for one option, without the article itself
+def variant_instruction(tool_name, params):
+    prompt = TOOL_PROMPTS[tool_name]["build"](ARTICLE_PLACEHOLDER, **params)
+    return "\n".join(line for line in prompt.splitlines() if ARTICLE_PLACEHOLDER not in line).strip()
+
+# Function to build one prompt that asks for several options over a single copy of the article
+def build_variants_prompt(tool_name, original_text, values, base_params=None):
+    name, _ = VARIANT_OPTIONS[tool_name]
+    tasks = "\n\n".join(
+        f"Task {index} ({name.replace('_', ' ')}: {value}):\n{variant_instruction(tool_name, dict(base_params or {}, **{name: value}))}"
+        for index, value in enumerate(values, 1)
+    )
+    return f"""Original Text: {original_text}
+
+Complete each of the following {len(values)} tasks separately, always starting from the Original Text above.
+
+{tasks}
+
+Instead of separating the text and analysis with three dashes, return all {len(values)} results in one call to the {VARIANTS_FUNCTION["name"]} function: one entry per task, in task order, each with the task's option in "variant", the rewritten text in "text" and the analysis in "analysis"."""
+
+# Function to read the per-variant entries of a combined response; missing or unreadable ones are left out
+def parse_variants(response, values):
+    try:
+        entries = json.loads(response).get("variants") or []
+    except (ValueError, AttributeError):
+        return {}
+    parsed = {}
+    for index, entry in enumerate(entries):
+        if not isinstance(entry, dict) or not isinstance(entry.get("text"), str) or not entry["text"].strip():
+            continue
+        value = entry.get("variant")
+        if value not in values and index < len(values):
+            value = values[index]
+        if value in values and value not in parsed:
+            parsed[value] = (entry["text"].strip(), (entry.get("analysis") or "").strip())
+    return parsed
+
+# Function to run one group of variants in a single request, returning ({value: (text, analysis)}, usage).
+# Upstream failures (including BudgetExceeded and QueueFull) are raised: separate calls would fail the same way.
+@labelled_by_tool
+def run_group(tool_name, original_text, values, base_params=None, use_cache=True, cache=None):
+    max_tokens = min(VARIANT_MAX_TOKENS, len(values) * variant_output_tokens(original_text))
+    response = request_completion(build_variants_prompt(tool_name, original_text, values, base_params), max_tokens,
+                                  use_cache=use_cache, cache=cache, structured=VARIANTS_FUNCTION)
+    return parse_variants(response, values), run_usage()
+
+# Function to run every option of a tool over one text, sharing one copy of the article per request.
+# Options that do not fit the output budget, or come back missing, unreadable or truncated, fall back
+# to separate run_tool calls in parallel. Returns (results in option order, number of upstream requests;
+# answers from the cache or shared with an identical request in flight do not count).
+def run_variants(tool_name, original_text, values=None, base_params=None, use_cache=True, cache=None,
+                 max_workers=VARIANT_CONCURRENCY, store=None, source_url=None):
+    name, options = VARIANT_OPTIONS[tool_name]
+    values = list(values or options)
+    spec = TOOL_PROMPTS[tool_name]
+    groups = [group for group in plan_groups(original_text, values) if len(group) > 1]
+    requests = 0
+    results = {}
+
+    def combined(group):
+        started = time.monotonic()
+        parsed, usage = run_group(tool_name, original_text, group, base_params, use_cache, cache)
+        return group, parsed, usage, time.monotonic() - started
+
+    def separate(value):
+        params = dict(base_params or {}, **{name: value})
+        return run_tool(tool_name, original_text, params, use_cache=use_cache, cache=cache,
+                        store=store, source_url=source_url)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for group, parsed, usage, seconds in executor.map(bind_session(combined), groups):
+            requests += usage["requests"]
+            for value, (text, analysis) in parsed.items():
+                params = tool_params(tool_name, dict(base_params or {}, **{name: value}))
+                # The request's tokens are shared evenly between the variants it produced
+                tokens_in, tokens_out = (usage[key] // len(parsed) for key in ("tokens_in", "tokens_out"))
+                results[value] = {
+                    "tool": tool_name, "params": params, "variant": value, "error": None, "chunks": 1,
+                    "text_label": spec.get("text_label", "Modified Text"),
+                    "analysis_label": spec.get("analysis_label", "Analysis"),
+                    "text": text, "analysis": analysis or f"No separate {spec.get('analysis_label', 'analysis').lower()} provided.",
+                    "tokens_in": tokens_in, "tokens_out": tokens_out, "seconds": seconds,
+                    "changes": result_changes(tool_name, original_text, text),
+                }
+                if store is not None:
+                    store.add(tool_name, params, original_text, text, results[value]["analysis"], source_url,
+                              tokens_in, tokens_out, seconds, results[value]["changes"])
+        missing = [value for value in values if value not in results]
+        for value, result in zip(missing, executor.map(bind_session(separate), missing)):
+            requests += result.get("requests", 0)
+            results[value] = dict(result, variant=value)
+    return [results[value] for value in values], requests